@@ -2,55 +2,313 @@
 # -*- coding: utf8 -*-
 # ConsoleIO - print sensor data to the screen as used in PyConsole.
 # Copyright (C) 2018  John Snowdon
-# 
+#
 # This program is free software: you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
-# 
+#
 # This program is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
-# 
+#
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Every sample applied in the main process is also put on our sample queue
+# (see SensorRouter.addListener()), so the table is kept up to date without
+# asking the other processes for anything but the sensor units, once every
+# CONSOLE_STATUS_TIME seconds.
+#
+# On a terminal, the table is drawn with curses every CONSOLE_REFRESH_TIME
+# seconds: one line per sensor with its value, reads per second, the time
+# taken by its last read and a sparkline of the values it has read. Only the lines
+# which have changed are written, and curses only sends the characters of
+# those lines which differ from what is already on screen.
+#
+# Anywhere else (e.g. output redirected to a file) the table is printed
+# every CONSOLE_PLAIN_TIME seconds instead.
+
 # Standard libraries
 import multiprocessing
+import collections
+import locale
+import signal
 import time
-import timeit 
+import timeit
+import sys
 
 # Settings file
 from libs import settings
+from libs.MessageBus import drainQueue
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
 
 # Start a new logger
 from libs.newlog import newlog
 logger = newlog(__name__)
 
-def ConsoleIO(ecudata):
-	""" Console IO - a poor mans digital dashboard! 
-	Seriously, all we are doing here is printing out the 
-	sensor values :) """
-	
-	sleep_time = 5
-	
+# Sparkline characters, lowest to highest
+SPARK_CHARS = u"▁▂▃▄▅▆▇█"
+SPARK_ASCII = "_.-:=+*#"
+
+# Columns of each sensor line
+LINE_FORMAT = "%-8s %10s %-8s %7s %8s  %s"
+
+def formatValue(value = None, fmt = "%.2f"):
+	""" A sensor value as text, whatever type it is, or -- if there isn't one """
+
+	if value is None:
+		return "--"
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return fmt % value
+	return str(value)
+
+class ConsoleTable():
+	""" The latest value, rate, read time and history of every sensor, as lines of text """
+
+	def __init__(self, ecudata = None, sparkChars = SPARK_CHARS):
+
+		self.ecudata = ecudata
+		self.sparkChars = sparkChars
+		self.limits = {}
+		for s in settings.SENSORS:
+			self.limits[s['sensorId']] = (s['minValue'], s['maxValue'])
+		self.sensorIds = list(settings.SENSOR_IDS)
+		self.units = {}
+		self.values = {}
+		self.readTimes = {}
+		self.lastRead = {}
+		self.samples = {}
+		self.rates = {}
+		self.history = {}
+		self.lines = {}
+		self.generation = None
+		self.snapshot = None
+		self.rate_counts = {}
+		self.rate_timer = timeit.default_timer()
+
+	def sample(self, sensorId = None, value = None, timerData = 0, readTime = None):
+		""" Record a sample taken off the sample queue """
+
+		if sensorId not in self.history:
+			self.history[sensorId] = collections.deque(maxlen = settings.CONSOLE_HISTORY)
+			if sensorId not in self.sensorIds:
+				self.sensorIds.append(sensorId)
+		if value != self.values.get(sensorId):
+			self.lines.pop(sensorId, None)
+		self.values[sensorId] = value
+		# Only count a new reading, not a repeat of the last one
+		if (readTime is not None) and (readTime == self.lastRead.get(sensorId)):
+			return
+		self.lastRead[sensorId] = readTime
+		self.readTimes[sensorId] = timerData
+		self.samples[sensorId] = self.samples.get(sensorId, 0) + 1
+		if isinstance(value, (int, float)) and not isinstance(value, bool):
+			self.history[sensorId].append(value)
+		self.lines.pop(sensorId, None)
+
+	def refresh(self):
+		""" Work out sample rates, and read the units of any new sensors """
+
+		now = timeit.default_timer()
+		elapsed = now - self.rate_timer
+		if elapsed > 0:
+			for sensorId in self.samples.keys():
+				rate = (self.samples[sensorId] - self.rate_counts.get(sensorId, 0)) / elapsed
+				if rate != self.rates.get(sensorId):
+					self.rates[sensorId] = rate
+					self.lines.pop(sensorId, None)
+			self.rate_counts = dict(self.samples)
+		self.rate_timer = now
+
+		if len(self.units) < len(self.values):
+			try:
+				for sensorId, sensorData in self.ecudata.getAllSensorData().items():
+					if sensorId not in self.units:
+						self.units[sensorId] = sensorData.get('sensorUnit', '')
+						self.lines.pop(sensorId, None)
+			except Exception as e:
+				logger.warn("Unable to read sensor units: %s" % e)
+
+	def header(self):
+
+		return LINE_FORMAT % ("Sensor", "Value", "Unit", "Rate/s", "Read ms", "History")
+
+	def line(self, sensorId = None):
+		""" The line of a single sensor, only formatted again once it has changed """
+
+		text = self.lines.get(sensorId)
+		if text is None:
+			text = LINE_FORMAT % (
+				sensorId[:8],
+				formatValue(self.values.get(sensorId)),
+				self.units.get(sensorId, '')[:8],
+				formatValue(self.rates.get(sensorId), "%.1f"),
+				formatValue(self.readTimes.get(sensorId), "%.3f"),
+				self.sparkline(sensorId),
+			)
+			self.lines[sensorId] = text
+		return text
+
+	def sparkline(self, sensorId = None):
+		""" Recent values of a sensor, scaled between its min and max values """
+
+		history = self.history.get(sensorId)
+		if not history:
+			return ""
+		low, high = self.limits.get(sensorId, (min(history), max(history)))
+		span = high - low
+		top = len(self.sparkChars) - 1
+		chars = []
+		for value in history:
+			if span <= 0:
+				idx = 0
+			else:
+				idx = int((value - low) * top / span)
+			chars.append(self.sparkChars[max(0, min(top, idx))])
+		return "".join(chars)
+
+	def status(self):
+		""" The lines below the table; the status block is only read again once it has changed """
+
+		statusBlock = self.ecudata.statusBlock
+		if statusBlock is None:
+			return []
+		generation = statusBlock.generation()
+		if generation != self.generation:
+			self.generation = generation
+			self.snapshot = statusBlock.snapshot()
+		status = self.snapshot
+		footer = [
+			"Sample count: %-8s Samples/s: %6.1f" % (self.ecudata.getCounter(), status['sampleRate']),
+			"ECU: %-5s AEM: %-5s Demo: %-5s Power: %s" % (
+				"ERROR" if status['ecuError'] else "ok",
+				"ERROR" if status['aemError'] else "ok",
+				"on" if status['demoMode'] else "off",
+				"LOST" if status['powerError'] else "ok"),
+		]
+		if status['logging']:
+			footer.append("Logging: #%-4d %7.2fMB %6.1f lines/s" % (status['logSession'], status['logSize'] / 1024 / 1024, status['logRate']))
+		else:
+			footer.append("Logging: off")
+		return footer
+
+def consolePlain(table = None, sampleQueue = None):
+	""" Print the whole table every CONSOLE_PLAIN_TIME seconds """
+
+	loopTimer = LoopTimer("ConsoleIO")
 	while True:
-		logger.debug("Waking")
-		
+		loopTimer.start()
+		for sample in drainQueue(sampleQueue, limit = settings.CONSOLE_QUEUE_SIZE):
+			table.sample(sample[0], sample[1], sample[2], sample[3])
+		table.refresh()
+
 		print("*========================================*")
-		print("| PyCosworth Digital Dashboard :every %ss|" % sleep_time)
+		print("| PyCosworth Digital Dashboard :every %ss|" % settings.CONSOLE_PLAIN_TIME)
 		print("|----------------------------------------|")
-		for sensorId in settings.SENSOR_IDS:
-			sensorData = ecudata.getSensorData(sensorId = sensorId)
-			sampleData = ecudata.getData(sensorId = sensorId, allData = True)
-			
-			if (sampleData is not None) and (sensorData is not None):
-				print("| %12s: %5.1f %s	[%.4fms]" % (sensorData['classId'], sampleData[0], sensorData['sensorUnit'], sampleData[1]))
-		
+		print(table.header())
+		for sensorId in table.sensorIds:
+			print(table.line(sensorId))
 		print("*----------------------------------------*")
-		print("| Sample Count:   %6s                 |" % (ecudata.getCounter()))
+		for text in table.status():
+			print(text)
 		print("*========================================*")
-		
-		time.sleep(sleep_time)
-		
\ No newline at end of file
+
+		loopTimer.stop()
+		time.sleep(settings.CONSOLE_PLAIN_TIME)
+
+def consoleCurses(table = None, sampleQueue = None, curses = None):
+	""" Redraw the lines of the table which have changed, every CONSOLE_REFRESH_TIME seconds """
+
+	screen = curses.initscr()
+	try:
+		try:
+			curses.curs_set(0)
+		except curses.error:
+			pass
+		drawn = {}
+		size = None
+		status_timer = None
+		repaint_timer = timeit.default_timer()
+
+		loopTimer = LoopTimer("ConsoleIO")
+		while True:
+			loopTimer.start()
+
+			for sample in drainQueue(sampleQueue, limit = settings.CONSOLE_QUEUE_SIZE):
+				table.sample(sample[0], sample[1], sample[2], sample[3])
+			if (status_timer is None) or ((timeit.default_timer() - status_timer) >= settings.CONSOLE_STATUS_TIME):
+				table.refresh()
+				status_timer = timeit.default_timer()
+
+			# Start again if the terminal has changed size, or every so often
+			# in case anything else has written over us
+			if (screen.getmaxyx() != size) or ((timeit.default_timer() - repaint_timer) >= settings.CONSOLE_REPAINT_TIME):
+				size = screen.getmaxyx()
+				screen.clear()
+				drawn = {}
+				repaint_timer = timeit.default_timer()
+			rows, cols = size
+
+			lines = ["PyCosworth Digital Dashboard", table.header()]
+			for sensorId in table.sensorIds:
+				lines.append(table.line(sensorId))
+			lines.append("")
+			lines.extend(table.status())
+
+			changed = False
+			for row, text in enumerate(lines[:rows]):
+				if drawn.get(row) == text:
+					continue
+				try:
+					screen.move(row, 0)
+					screen.clrtoeol()
+					# The bottom right cell cannot be written without an error
+					screen.addstr(row, 0, text[:cols - 1])
+				except curses.error:
+					pass
+				drawn[row] = text
+				changed = True
+			if changed:
+				screen.refresh()
+
+			loopTimer.stop()
+			time.sleep(settings.CONSOLE_REFRESH_TIME)
+	finally:
+		curses.endwin()
+
+def ConsoleIO(ecudata, sampleQueue):
+	""" Console IO - a poor mans digital dashboard!
+	Seriously, all we are doing here is printing out the
+	sensor values :) """
+
+	proc_name = multiprocessing.current_process().name
+
+	logger.info("ConsoleIO process now running")
+
+	# Leave the terminal as we found it, however we are stopped
+	signal.signal(signal.SIGTERM, lambda signum, frame : sys.exit(0))
+
+	curses = None
+	if sys.stdout.isatty():
+		try:
+			import curses
+			locale.setlocale(locale.LC_ALL, '')
+			curses.setupterm()
+		except Exception as e:
+			logger.warn("Unable to use curses, the table will be printed every %ss instead" % settings.CONSOLE_PLAIN_TIME)
+			logger.warn("%s" % e)
+			curses = None
+
+	sparkChars = SPARK_CHARS
+	if "utf" not in locale.getpreferredencoding(False).lower():
+		sparkChars = SPARK_ASCII
+	table = ConsoleTable(ecudata = ecudata, sparkChars = sparkChars)
+
+	if curses:
+		consoleCurses(table, sampleQueue, curses)
+	else:
+		consolePlain(table, sampleQueue)
@@ -22,48 +22,72 @@ import time
 import timeit 
 import os
 import sys
-import re
 
 # Controldata messages
 from libs.ControlData import ControlData
+from libs.MessageBus import drainQueue
+from libs.StatusBlock import StatusBlock
+
+# Segmented, checksummed log files
+from libs.SegmentLog import SegmentLogWriter, segmentFilename, sessionSegments, recoverSegment
+from libs.LogCompress import isCompressed
+
+# List of every logging session
+from libs.LogCatalog import LogCatalog, scanSession, sessionSize, SESSION_RECORDING
 
 # Settings file
 from libs import settings
 
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
+
 # Start a new logger
 from libs.newlog import newlog
 logger = newlog(__name__)
 
-def getNextLogfile():
-	""" Find the next free logfile name. """
+def recoverSessions(catalog = None, compressQueue = None):
+	""" Repair any session which was still being recorded when we last stopped,
+	most likely cut short by a loss of power """
 	
-	if os.path.exists(settings.LOGGING_DIR):
-		logger.info("Log directory [%s] already exists" % settings.LOGGING_DIR)
-		pass
-	else:
-		logger.info("Log directory [%s] is missing, creating..." % settings.LOGGING_DIR)
-		os.mkdir(settings.LOGGING_DIR, mode=0o775)
-		logger.info("Done")
+	for entry in catalog.sessions():
+		if entry['status'] != SESSION_RECORDING:
+			continue
+		session = entry['session']
+		logger.warn("Logging session %s was not closed, recovering" % session)
+		segments = sessionSegments(segmentFilename(session, 0))
+		if (len(segments) > 0) and (isCompressed(segments[-1]) is False):
+			try:
+				recoverSegment(segments[-1])
+				# LogCompressorIO leaves the newest segment of a session being recorded alone
+				sendSegment(compressQueue, segments[-1])
+			except Exception as e:
+				logger.error("Unable to recover log segment [%s]" % segments[-1])
+				logger.error("%s" % e)
+		# Whatever made it to disk is now the record of the session
+		details = scanSession(session)
+		catalog.closeSession(session, duration = details['duration'], segments = details['segments'], size = details['size'], peaks = details['peaks'])
+
+def sendSegment(compressQueue = None, filename = None):
+	""" Tell LogCompressorIO about a segment which is finished with """
 	
-	reMatch = '%s[0-9][0-9][0-9]%s' % (settings.LOGGING_FILE_PREFIX, settings.LOGGING_FILE_SUFFIX)
-	currentFilenames = [f for f in os.listdir(settings.LOGGING_DIR + "/") if re.match(r'%s' % reMatch, f)]
+	if compressQueue:
+		logger.debug("Sending closed segment [%s] for compression" % filename)
+		cdata = ControlData()
+		cdata.button = settings.STATUS_SEGMENT_CLOSED
+		cdata.destination = settings.BUTTON_DEST_COMPRESSOR
+		cdata.setPayload(data = { 'filename' : filename })
+		compressQueue.put(cdata)
+
+def notifyCompressor(compressQueue = None, writer = None):
+	""" Tell LogCompressorIO about any segments which are now finished with """
 	
-	if len(currentFilenames) == 0:
-		nextFilename = settings.LOGGING_FILE_PREFIX + "000" + settings.LOGGING_FILE_SUFFIX
-	else:
-		currentFilenames.sort()
-		# Latest file
-		latestFilename = currentFilenames[-1]
-		# Latest file number
-		latestFilenumber = latestFilename.split("_")[1].split(settings.LOGGING_FILE_SUFFIX)[0]
-		# Increment file number
-		nextFilenumber = int(latestFilenumber) + 1
-		# Construct filename
-		nextFilenumberStr = "%03d" % nextFilenumber
-		nextFilename = settings.LOGGING_FILE_PREFIX + str(nextFilenumberStr) + settings.LOGGING_FILE_SUFFIX
-	return nextFilename
+	for filename in writer.closedSegments():
+		sendSegment(compressQueue, filename)
 
-def DataLoggerIO(ecudata, dataQueue, controlQueue):
+def DataLoggerIO(ecudata, dataQueue, controlQueue, compressQueue = None):
 	""" Logs ecu data to disk """
 	
 	myButtonId = settings.BUTTON_DEST_DATALOGGER
@@ -71,52 +95,80 @@ def DataLoggerIO(ecudata, dataQueue, controlQueue):
 	logger.debug("DataLoggerIO process now running")
 	
 	logging = False
-	heartbeat_timer = timeit.default_timer()
-	stats = {
-		'status' 	: False,
-		'description' : "Logger stopped."
-	}
-	f = False
+	rate_timer = timeit.default_timer()
+	rate_lines = 0
+	writer = False
+	session = None
+	peaks = {}
 	sensorIds = []
 	previousSampleCount = -1
+	loopTimer = LoopTimer("DataLoggerIO")
+	
+	# Logging status is shared with every other process here
+	statusBlock = ecudata.statusBlock
+	if statusBlock is None:
+		statusBlock = StatusBlock()
+	
+	# Tidy up after any power cut while the last session was being written
+	catalog = LogCatalog()
+	recoverSessions(catalog, compressQueue)
+	
 	while True:
+		loopTimer.start()
 		logger.debug("Waking")
 		
 		if logging:
-			stats['sampleCount'] = ecudata.getCounter()
+			sampleCount = ecudata.getCounter()
 			
-			if stats['sampleCount'] != previousSampleCount:
+			if sampleCount != previousSampleCount:
 			
 				# Write counter sample number and time from start of log file
 				t_now = time.time() - t_start
-				line = "%s,%.3f," % (stats['sampleCount'], t_now)
+				line = "%s,%.3f," % (sampleCount, t_now)
 				
 				# Write a line containing the value of every sensor
+				values = []
 				for sensorId in sensorIds:
 					d = ecudata.getData(sensorId)
+					values.append(d)
+					if isinstance(d, (int, float)) and ((sensorId not in peaks) or (d > peaks[sensorId])):
+						peaks[sensorId] = d
 					if d is None:
 						line = line + "0,"
 					else:
 						line = line + str(d) + ","
-				f.write(line + "\n")
+				line = line + "\n"
+				if writer:
+					writer.write(line, t_now, values)
+					rate_lines += 1
 				
-				# check for free disk space
-				# check if reaching a set limit of time/space
+				# free disk space is looked after by LogCompressorIO
+				# check if reaching a set limit of time
 				
-			previousSampleCount = stats['sampleCount']
+			previousSampleCount = sampleCount
+			
+			# Write out and sync a partial block if it has been waiting too long
+			if writer:
+				writer.tick()
+				notifyCompressor(compressQueue, writer)
 			
-		# Listen for control messages
-		if controlQueue.empty() == False:
-			cdata = controlQueue.get()
+		# Listen for control messages, handling every one waiting
+		for cdata in drainQueue(controlQueue):
 			if cdata.isMine(myButtonId):
 				logger.debug("Got a control message")
 											
 				# exit
 				if cdata.button == settings.STATUS_SHUTDOWN:
+					shutdown_start = timeit.default_timer()
 					if logging is True:
-						if f:
-							f.close()
+						if writer:
+							# Write out and sync the last block before we go
+							writer.close()
+							catalog.closeSession(session, duration = time.time() - t_start, segments = writer.segment + 1, size = sessionSize(session), peaks = peaks)
+							logger.critical("Log session [%s] flushed in %.3fs" % (session, timeit.default_timer() - shutdown_start))
+					statusBlock.set(logging = False, logSession = -1)
 					logger.critical("Shutting down")
+					acknowledge()
 					sys.exit(0)
 						
 				
@@ -126,57 +178,50 @@ def DataLoggerIO(ecudata, dataQueue, controlQueue):
 						# stop
 						logger.info("Stop logging")
 						logging = False
-						stats = {
-							'status' : False,
-							'description' : "Logger stopped."
-						}
-						# send message to say stopped
 						# close logfile
-						if f:
-							f.close()
+						if writer:
+							writer.close()
+							catalog.closeSession(session, duration = time.time() - t_start, segments = writer.segment + 1, size = sessionSize(session), peaks = peaks)
+							notifyCompressor(compressQueue, writer)
+							writer = False
 					elif logging is False:
 						# start
 						logger.info("Start logging")
-						stats = {
-							'status' : True,
-							'description' : "Logger started."
-						}
 						logging = True
 						sensorIds = ecudata.getSensorIds()
 						sensorIds.sort()
-						# send message to say started
-						# find name of next logfile
-						filename = getNextLogfile()
-						stats['logFile'] = filename
-						# open logfile
+						# open first segment of the next logging session
 						try:
 							t_start = time.time()
-							f = open(settings.LOGGING_DIR + "/" + filename, 'w')
+							peaks = {}
+							session = catalog.newSession(sensorIds, t_start)
 							header = "Counter,Time,"
 							for sensorId in sensorIds:
 								header = header + sensorId + ","
 							header = header + "\n"
-							f.write(header)
+							writer = SegmentLogWriter(session, header, sensorIds)
 						except Exception as e:
 							logger.error("Unable to open logfile")
 							logger.error("%s" % e)
-							f = False
+							writer = False
 		
-		# Send heartbeat message indicating logging status
-		if (timeit.default_timer() - heartbeat_timer) >= settings.LOGGING_HEARTBEAT_TIMER:
-			logger.debug("Sending heartbeat - logging:%s" % logging)
-			cdata = ControlData()
-			cdata.button = settings.BUTTON_LOGGING_STATUS
-			cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-			stats['status'] = logging
-			if logging and f:
-				f_stat = os.stat(settings.LOGGING_DIR + "/" + filename)
-				stats['fileSize'] = f_stat.st_size / 1024 / 1024
-			cdata.setPayload(data = stats)
-			dataQueue.put(cdata)
-			# Reset timer
-			heartbeat_timer = timeit.default_timer()
+		# Other processes see logging start and stop as soon as it happens...
+		if logging and writer:
+			statusBlock.set(logging = True, logSession = session)
+		else:
+			statusBlock.set(logging = False, logSession = -1, logSize = 0)
+		
+		# ...and the size and rate of the log every second or so
+		if (timeit.default_timer() - rate_timer) >= settings.LOGGING_RATE_TIMER:
+			if logging and writer:
+				statusBlock.set(logSize = writer.size(), logRate = rate_lines / (timeit.default_timer() - rate_timer))
+			else:
+				statusBlock.set(logRate = 0)
+			rate_timer = timeit.default_timer()
+			rate_lines = 0
 			
+		loopTimer.stop()
+		
 		if logging is False:
 			time.sleep(settings.LOGGING_SLEEP)
 		else:
@@ -17,8 +17,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+
+# Button presses and key presses are both handled by a single selector, so
+# the process sleeps until there is input of either kind and reacts to it
+# straight away:
+#
+# GPIO		Each pin in settings.GPIO_BUTTON_PINS has an edge callback. The
+#			callback, which runs in a thread of the RPi.GPIO library, writes
+#			the pin, its level and the time to a pipe watched by the selector.
+#			Buttons connect the pin to ground (the internal pull-up is used),
+#			and the time between the falling and rising edge is classified
+#			as a short, medium or long press using settings.BUTTON_TIME_*.
+#			A long press is sent as soon as the button has been held long
+#			enough, without waiting for it to be released.
+#
+# Keyboard	STDIN is put into cbreak mode, so keys arrive as they are pressed
+#			without waiting for Enter. A key which is in settings.BUTTON_MAP,
+#			and is not the start of any longer entry, is sent immediately.
+#			Longer entries (e.g. 'e1') are typed followed by Enter. A terminal
+#			cannot tell how long a key is held, so key presses are always short.
+
 # Standard libraries
 import multiprocessing
+import selectors
+import struct
+import signal
 import time
 import timeit 
 import sys
@@ -29,16 +52,169 @@ import traceback
 from libs import settings
 from libs.ControlData import ControlData
 
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
 # Start a new logger
 from libs.newlog import newlog
 logger = newlog(__name__)
 
+# pin, level, time; as written to the pipe by the GPIO edge callback
+GPIO_EVENT = struct.Struct("<BBd")
+
+def pressDuration(seconds = 0):
+	""" Classify the length of a button press as BUTTON_SHORT, BUTTON_MEDIUM or BUTTON_LONG """
+	
+	if seconds >= settings.BUTTON_TIME_LONG[0]:
+		return settings.BUTTON_LONG
+	if seconds >= settings.BUTTON_TIME_MEDIUM[0]:
+		return settings.BUTTON_MEDIUM
+	return settings.BUTTON_SHORT
+
+def sendButton(actionQueue = None, button = None, duration = None):
+	""" Send a button press up to the main process """
+	
+	cdata = ControlData()
+	cdata.setButton(button)
+	cdata.setDuration(duration)
+	cdata.setPayload(data = {'status' : True, 'description' : "Button press detected"})
+	actionQueue.put(cdata)
+	logger.info("Send controldata message: BUTTON[%s] DURATION[0x%02x] DESTINATION[%s]" % (button, cdata.duration, cdata.destination))
+
+class KeyInput():
+	""" Turns characters typed at the terminal into button presses """
+	
+	def __init__(self, fd = None):
+		
+		self.fd = fd
+		self.buffer = ""
+		self.terminal = None
+		try:
+			import termios
+			import tty
+			self.terminal = termios.tcgetattr(fd)
+			tty.setcbreak(fd)
+			logger.info("Keyboard input is unbuffered")
+		except Exception as e:
+			# Not a terminal; input arrives a line at a time instead
+			self.terminal = None
+			logger.info("Keyboard input is line buffered")
+	
+	def restore(self):
+		""" Put the terminal back the way we found it """
+		
+		if self.terminal is not None:
+			import termios
+			termios.tcsetattr(self.fd, termios.TCSADRAIN, self.terminal)
+			self.terminal = None
+	
+	def read(self):
+		""" Read whatever has been typed, returning the buttons it completes,
+		or None once STDIN has been closed """
+		
+		data = os.read(self.fd, 64)
+		if len(data) == 0:
+			return None
+		buttons = []
+		for c in data.decode('utf-8', 'ignore'):
+			if c in "\r\n":
+				if self.buffer in settings.BUTTON_MAP.keys():
+					buttons.append(self.buffer)
+				elif len(self.buffer) > 0:
+					logger.info("Ignoring keyboard input: [%s]" % self.buffer)
+				self.buffer = ""
+				continue
+			self.buffer += c
+			longer = [k for k in settings.BUTTON_MAP.keys() if (len(k) > len(self.buffer)) and k.startswith(self.buffer)]
+			if (self.buffer in settings.BUTTON_MAP.keys()) and (len(longer) == 0):
+				buttons.append(self.buffer)
+				self.buffer = ""
+			elif len(longer) == 0:
+				logger.info("Ignoring keyboard input: [%s]" % self.buffer)
+				self.buffer = ""
+		return buttons
+
+class GPIOInput():
+	""" Edge triggered GPIO buttons, timed from press to release """
+	
+	def __init__(self, GPIO = None):
+		
+		self.GPIO = GPIO
+		self.pressed = {}
+		self.sent = {}
+		self.readFd, self.writeFd = os.pipe()
+		os.set_blocking(self.readFd, False)
+		for pin in settings.GPIO_BUTTON_PINS.keys():
+			GPIO.setup(pin, GPIO.IN, pull_up_down = GPIO.PUD_UP)
+			GPIO.add_event_detect(pin, GPIO.BOTH, callback = self.__edge__, bouncetime = settings.GPIO_BOUNCE_TIME)
+			logger.info("Watching GPIO pin %s for button [%s]" % (pin, settings.GPIO_BUTTON_PINS[pin]))
+	
+	def close(self):
+		
+		for pin in settings.GPIO_BUTTON_PINS.keys():
+			self.GPIO.remove_event_detect(pin)
+		self.GPIO.cleanup()
+	
+	def read(self):
+		""" Process the edges written by the callback, returning a list of (button, duration) """
+		
+		presses = []
+		try:
+			data = os.read(self.readFd, GPIO_EVENT.size * 64)
+		except BlockingIOError:
+			return presses
+		for offset in range(0, len(data) - (len(data) % GPIO_EVENT.size), GPIO_EVENT.size):
+			pin, level, t = GPIO_EVENT.unpack_from(data, offset)
+			if level == 0:
+				# Pressed
+				self.pressed[pin] = t
+				self.sent[pin] = False
+			elif pin in self.pressed.keys():
+				# Released; unless it was already sent as a long press
+				if self.sent[pin] is False:
+					presses.append((settings.GPIO_BUTTON_PINS[pin], pressDuration(t - self.pressed[pin])))
+				del self.pressed[pin]
+		return presses
+	
+	def held(self, now = 0):
+		""" Any buttons which have now been held long enough to be a long press """
+		
+		presses = []
+		for pin in self.pressed.keys():
+			if (self.sent[pin] is False) and ((now - self.pressed[pin]) >= settings.BUTTON_TIME_LONG[0]):
+				self.sent[pin] = True
+				presses.append((settings.GPIO_BUTTON_PINS[pin], settings.BUTTON_LONG))
+		return presses
+	
+	def timeout(self, now = 0):
+		""" Seconds until the next button being held becomes a long press, or None """
+		
+		waiting = [self.pressed[pin] + settings.BUTTON_TIME_LONG[0] - now for pin in self.pressed.keys() if self.sent[pin] is False]
+		if len(waiting) == 0:
+			return None
+		return max(0, min(waiting))
+	
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+	
+	def __edge__(self, pin = None):
+		""" Called by RPi.GPIO, in its own thread, on every edge """
+		
+		os.write(self.writeFd, GPIO_EVENT.pack(pin, self.GPIO.input(pin), time.monotonic()))
+
 def GPIOButtonIO(actionQueue, stdin):
 	""" GPIO - listen for button presses on the Raspberry Pi GPIO pins """
 	
 	proc_name = multiprocessing.current_process().name
 	logger.info("GPIO input process now running")
 	
+	selector = selectors.DefaultSelector()
+	gpioInput = None
+	keyInput = None
+	
 	######################################################
 	# First try importing the library - this will fail on a non-Pi
 	######################################################
@@ -57,6 +233,8 @@ def GPIOButtonIO(actionQueue, stdin):
 	if USE_GPIO:
 		try:
 			GPIO.setmode(GPIO.BOARD)
+			gpioInput = GPIOInput(GPIO)
+			selector.register(gpioInput.readFd, selectors.EVENT_READ, gpioInput)
 			logger.info("GPIO features initialised")
 		except Exception as e:
 			logger.error("Unable to initialise GPIO features!")
@@ -68,13 +246,15 @@ def GPIOButtonIO(actionQueue, stdin):
 	# Try initialising STDIN for keyboard input
 	######################################################
 	try:
-		sys.stdin = os.fdopen(stdin)
+		keyInput = KeyInput(stdin)
+		selector.register(stdin, selectors.EVENT_READ, keyInput)
 		logger.info("Opened STDIN for keyboard input")
 		USE_STDIN = True
-	except:
+	except Exception as e:
 		logger.error("Unable to open STDIN for keyboard input!")
 		logger.error("%s" % e)
 		logger.debug("%s" % traceback.print_exc())
+		USE_STDIN = False
 		############################################################
 		# If GPIO support is also unavailable, then exit, as
 		# we have no way of capturing input
@@ -82,62 +262,60 @@ def GPIOButtonIO(actionQueue, stdin):
 		if USE_GPIO == False:
 			logger.fatal("This process will now exit - We have NO methods to capture input")
 			exit(1)
-
+	
+	# Leave the terminal as we found it, however we are stopped
+	signal.signal(signal.SIGTERM, lambda signum, frame : sys.exit(0))
+	
 	######################################################
-	# The main loop where we scan for button or key presses
+	# The main loop where we wait for button or key presses
 	######################################################
-	i = 0
-	button = False
-	while True:
-		logger.debug("Waking")		
-		i += 1
-			
-		if i == 1000:
-			logger.debug("Still running [%s]" % proc_name)
-			i = 0
-
-		if USE_GPIO:
-			######################################################
-			# Scan for any button presses on the GPIO pins
-			######################################################
-		
-			logger.info("Received GPIO input")
-		
-			#cdata = ControlData()
-			#cdata.setButton(mybutton)
-			#cdata.setDuration(myduration)
+	loopTimer = LoopTimer("GPIOButtonIO")
+	try:
+		while True:
+			# Sleep until there is some input, or a held button becomes a long press,
+			# but wake up often enough for the supervisor to see us looping
+			timeout = settings.SUPERVISOR_CHECK_TIMER
+			if gpioInput:
+				held = gpioInput.timeout(time.monotonic())
+				if held is not None:
+					timeout = min(timeout, held)
+			events = selector.select(timeout)
 			
-			# Decode it, send it back up the actionQueue
-			# actionQueue.put(cdata)
-			pass
-		
-		if USE_STDIN:
-			######################################################
-			# Python3 and Python2 handle STDIN input in two
-			# different ways
-			######################################################
-			if sys.version_info[0] == 3:
-				myInput = input()
-			else:
-				myInput = raw_input()
+			loopTimer.start()
+			presses = []
+			for key, mask in events:
+				if key.data is gpioInput:
+					presses += gpioInput.read()
+				
+				if key.data is keyInput:
+					buttons = keyInput.read()
+					if buttons is None:
+						logger.warn("STDIN has been closed, no more keyboard input")
+						selector.unregister(key.fileobj)
+						USE_STDIN = False
+						continue
+					for button in buttons:
+						logger.info("Received keyboard input: [%s]" % button)
+						presses.append((button, settings.BUTTON_SHORT))
 			
-			logger.info("Received keyboard input: [%s]" % myInput)
+			if gpioInput:
+				presses += gpioInput.held(time.monotonic())
 			
 			######################################################
 			# We only pass through control signals that are 
 			# defined in the settings file - not just any random button press!
 			######################################################
-			if myInput in settings.BUTTON_MAP.keys():
-				mybutton = myInput
-				mydest = settings.BUTTON_MAP[mybutton]['dest']
-				cdata = ControlData()
-				cdata.setButton(mybutton)
-				cdata.setPayload(data = {'status' : True, 'description' : "Button press detected"})
-				actionQueue.put(cdata)
-				logger.info("Send controldata message: BUTTON[%s] DESTINATION[%s]" % (mybutton, mydest))
+			for button, duration in presses:
+				if button in settings.BUTTON_MAP.keys():
+					sendButton(actionQueue, button, duration)
 			
-		######################################################
-		# Sleep until next time
-		######################################################
-		time.sleep(settings.GPIO_SLEEP_TIME)
-				
+			if (USE_GPIO == False) and (USE_STDIN == False):
+				logger.fatal("This process will now exit - We have NO methods to capture input")
+				break
+			
+			loopTimer.stop()
+	finally:
+		if keyInput:
+			keyInput.restore()
+		if gpioInput:
+			gpioInput.close()
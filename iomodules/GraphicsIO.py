@@ -47,6 +47,16 @@ from libs import settings
 
 # Control data
 from libs.ControlData import ControlData
+from libs.MessageBus import drainQueue
+
+# Sample latency histograms
+from libs.LatencyTrace import LatencyTracer, traceStamp, TRACE_APPLY
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
 
 # Start a new logger
 from libs.newlog import newlog
@@ -138,47 +148,49 @@ def GraphicsIO(ecudata, controlQueue):
 	#
 	#####################################################################################
 	
-	# Show the splash logo
-	r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
-	# Splash logo sequence
-	for i in ['boot_logo', 'boot_logo1']:
-		image = image_assets[i][r].copy()
-		if USE_OLED_GRAPHICS_MASTER:
-			updateOLEDScreen(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)
-		if USE_SDL_GRAPHICS:
-			updateSDLWindow(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)
-
-		# Slide out intro screen....
-		time.sleep(1.5)
-		slideBitmapVertical(
-			bitmap = image,
-			x_start = 0, 
-			y_start = 0, 
-			y_end = settings.GFX_MASTER_WINDOW['y_size'], 
-			direction = "down", 
-			steps = 30,
-			sleep = 0.025,
-			windowSettings = settings.GFX_MASTER_WINDOW,
-			USE_SDL_GRAPHICS = USE_SDL_GRAPHICS,
-			USE_OLED_GRAPHICS = USE_OLED_GRAPHICS
-		)		
-		
-	# Show a 'please wait' loading sequence - just so that the serial port can 
-	# start collecting data or finish setting up.
-	r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
-	res_list = list(image_assets['wait_sequence'].keys())	
-	frame_count = len(res_list[0])
-	frames = range(0, frame_count -1)
-	for f in frames:
-		if r in image_assets['wait_sequence'].keys():
-			# Main screen
-			r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
-			image = image_assets['wait_sequence'][r][f]
+	# With GFX_FAST_BOOT the sensors are shown straight away instead
+	if settings.GFX_FAST_BOOT is False:
+		# Show the splash logo
+		r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
+		# Splash logo sequence
+		for i in ['boot_logo', 'boot_logo1']:
+			image = image_assets[i][r].copy()
 			if USE_OLED_GRAPHICS_MASTER:
-				updateOLEDScreen(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)		
+				updateOLEDScreen(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)
 			if USE_SDL_GRAPHICS:
 				updateSDLWindow(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)
-			time.sleep(0.5)
+
+			# Slide out intro screen....
+			time.sleep(1.5)
+			slideBitmapVertical(
+				bitmap = image,
+				x_start = 0, 
+				y_start = 0, 
+				y_end = settings.GFX_MASTER_WINDOW['y_size'], 
+				direction = "down", 
+				steps = 30,
+				sleep = 0.025,
+				windowSettings = settings.GFX_MASTER_WINDOW,
+				USE_SDL_GRAPHICS = USE_SDL_GRAPHICS,
+				USE_OLED_GRAPHICS = USE_OLED_GRAPHICS
+			)		
+		
+		# Show a 'please wait' loading sequence - just so that the serial port can 
+		# start collecting data or finish setting up.
+		r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
+		res_list = list(image_assets['wait_sequence'].keys())	
+		frame_count = len(res_list[0])
+		frames = range(0, frame_count -1)
+		for f in frames:
+			if r in image_assets['wait_sequence'].keys():
+				# Main screen
+				r = "%sx%s" % (settings.GFX_MASTER_SIZE[0], settings.GFX_MASTER_SIZE[1])
+				image = image_assets['wait_sequence'][r][f]
+				if USE_OLED_GRAPHICS_MASTER:
+					updateOLEDScreen(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)		
+				if USE_SDL_GRAPHICS:
+					updateSDLWindow(pilImage = image, windowSettings = settings.GFX_MASTER_WINDOW)
+				time.sleep(0.5)
 	
 	####################################################################################
 	#
@@ -208,18 +220,23 @@ def GraphicsIO(ecudata, controlQueue):
 		fired_windows = 0
 		
 	# Slide out intro screen....
-	slideBitmapVertical(
-		bitmap = image.copy(),
-		x_start = 0, 
-		y_start = 0, 
-		y_end = settings.GFX_MASTER_WINDOW['y_size'], 
-		direction = "down", 
-		steps = 30,
-		sleep = 0.025,
-		windowSettings = settings.GFX_MASTER_WINDOW,
-		USE_SDL_GRAPHICS = USE_SDL_GRAPHICS,
-		USE_OLED_GRAPHICS = USE_OLED_GRAPHICS
-	)
+	if settings.GFX_FAST_BOOT is False:
+		slideBitmapVertical(
+			bitmap = image.copy(),
+			x_start = 0, 
+			y_start = 0, 
+			y_end = settings.GFX_MASTER_WINDOW['y_size'], 
+			direction = "down", 
+			steps = 30,
+			sleep = 0.025,
+			windowSettings = settings.GFX_MASTER_WINDOW,
+			USE_SDL_GRAPHICS = USE_SDL_GRAPHICS,
+			USE_OLED_GRAPHICS = USE_OLED_GRAPHICS
+		)
+	
+	# The screen is blank until the first frame is drawn, but a control
+	# message may still need an image to draw over before then
+	image = Image.new('1', (settings.GFX_MASTER_WINDOW['x_size'], settings.GFX_MASTER_WINDOW['y_size']))
 	
 	# Default state of various indicators
 	IS_LOGGING = False
@@ -228,24 +245,59 @@ def GraphicsIO(ecudata, controlQueue):
 	IS_AEM_ERROR = False
 	IS_DEMO_ENABLED = False
 	
+	# Alarms currently raised by the main process, by alarmId
+	ALARMS = {}
+	
+	# Everything shown on the last frame drawn
+	last_frame = None
+	
+	# The last change to the shared status flags we have seen
+	status_generation = -1
+	
+	# Age of each sample from the serial read to the screen
+	if settings.LATENCY_TRACE:
+		tracer = LatencyTracer()
+		latency_timer = timeit.default_timer()
+		last_traced = None
+	
+	loopTimer = LoopTimer("GraphicsIO")
 	while True:
+		loopTimer.start()
 		
 		# Set a timer for this loop
 		if settings.INFO:
 			t1 = timeit.default_timer()
 		
+		####################################################
+		#
+		# ECU, AEM, demo mode, logging and power status are
+		# read from shared memory, whenever any of it changes
+		#
+		####################################################
+		if ecudata.statusBlock and (ecudata.statusBlock.generation() != status_generation):
+			status = ecudata.statusBlock.snapshot()
+			status_generation = status['generation']
+			if (status['logging'] != 0) != IS_LOGGING:
+				logger.info("Logging status is now [%s]" % (status['logging'] != 0))
+			IS_LOGGING = status['logging'] != 0
+			IS_ECU_ERROR = status['ecuError'] != 0
+			IS_AEM_ERROR = status['aemError'] != 0
+			IS_DEMO_ENABLED = status['demoMode'] != 0
+			IS_POWERED = status['powerError'] == 0
+		
 		####################################################
 		#
 		# Listen for control messages
 		#
 		####################################################
-		if controlQueue.empty() == False:
-			cdata = controlQueue.get()
+		# Handle every message waiting, not just the first
+		for cdata in drainQueue(controlQueue):
 			if cdata.isMine(myButtonId):
 				logger.debug("Got a control message")
 
 				if cdata.button == settings.STATUS_SHUTDOWN:
 					logger.critical("Shutting down")
+					acknowledge()
 					sys.exit(0)
 
 				##########################################################
@@ -262,51 +314,18 @@ def GraphicsIO(ecudata, controlQueue):
 						# Update the SDL window
 						updateSDLWindow(pilImage = image, windowSettings = windowSettings)
 					time.sleep(5)
+					# The overlay is still on screen, so the next frame must be drawn
+					last_frame = None
 
 				##########################################################
-				# Logging status
-				##########################################################
-				if cdata.button and (cdata.button == settings.BUTTON_LOGGING_STATUS):
-					if cdata.data['status'] is True:
-						if IS_LOGGING is False:
-							logger.info("Enabling logging status message")
-							IS_LOGGING = True
-					else:
-						if IS_LOGGING:
-							logger.info("Disabling logging status message")
-							IS_LOGGING = False
-
-				##########################################################
-				# Power is off / timer until shutdown/ignition turned back on
-				##########################################################
-				if cdata.button and (cdata.button == settings.STATUS_POW_ERROR):
-					pass
-				if cdata.button and (cdata.button == settings.STATUS_POW_OK):
-					pass
-
-				##########################################################
-				# ECU connection error
-				##########################################################
-				if cdata.button and (cdata.button == settings.STATUS_ECU_ERROR):
-					IS_ECU_ERROR = True
-				if cdata.button and (cdata.button == settings.STATUS_ECU_OK):
-					IS_ECU_ERROR = False
-
-				##########################################################
-				# AEM connection error
-				##########################################################
-				if cdata.button and (cdata.button == settings.STATUS_AEM_ERROR):
-					IS_AEM_ERROR = True
-				if cdata.button and (cdata.button == settings.STATUS_AEM_OK):
-					IS_AEM_ERROR = False
-
-				##########################################################
-				# Demo mode
+				# Sensor alarm raised or cleared
 				##########################################################
-				if cdata.button and (cdata.button == settings.STATUS_DEMO_ENABLED):
-					IS_DEMO_ENABLED = True
-				if cdata.button and (cdata.button == settings.STATUS_DEMO_DISABLED):
-					IS_DEMO_ENABLED = False
+				if cdata.button and (cdata.button == settings.STATUS_ALARM):
+					alarm = cdata.getPayload()
+					if alarm['status']:
+						ALARMS[alarm['alarmId']] = alarm
+					elif alarm['alarmId'] in ALARMS.keys():
+						del ALARMS[alarm['alarmId']]
 
 				##########################################################
 				# Change sensor for the window
@@ -338,6 +357,8 @@ def GraphicsIO(ecudata, controlQueue):
 						USE_OLED_GRAPHICS = USE_OLED_GRAPHICS
 					)					
 					time.sleep(0.2)
+					# The screen has been slid out, so the next frame must be drawn
+					last_frame = None
 			#time.sleep(0.2)
 			
 		##############################################################
@@ -356,46 +377,78 @@ def GraphicsIO(ecudata, controlQueue):
 			# Add latest sensor value to list of previous values
 			# As the list is a fixed size, this also pushes the oldest
 			# value off the back of the list.
-			value = ecudata.getData(currentSensorId)
-			if value:
+			value = None
+			trace = None
+			sample = ecudata.getData(currentSensorId, allData = True)
+			if sample:
+				value = sample[0]
+				# Only trace each sample once, not every redraw of it
+				if settings.LATENCY_TRACE and sample[3] and (len(sample[3]) > TRACE_APPLY):
+					if sample[3][TRACE_APPLY] != last_traced:
+						last_traced = sample[3][TRACE_APPLY]
+						trace = traceStamp(sample[3])
+			# A reading of 0 (e.g. RPM with the engine off) is still a reading
+			if value is not None:
 				windowSettings['displayModes'][currentSensorId]['previousValues'].append(value)
 			sensorData = ecudata.getSensorData(currentSensorId)
+			peakData = None if (IS_ECU_ERROR or IS_AEM_ERROR) else ecudata.getPeakData(currentSensorId)
 			
-			# Simple numeric gauge
-			if currentMode == settings.GFX_MODE_NUMERIC:
-				# Simple numeric display
-				image = gaugeNumeric(ecudata = ecudata,
-					sensor = windowSettings['displayModes'][currentSensorId],
-					windowSettings = windowSettings,
-					sensorData = sensorData
-				)
-			else:
-				pass
+			# Filtered sensor values mostly round to the same digits as
+			# last time, in which case the screen already shows this frame
+			previousValues = windowSettings['displayModes'][currentSensorId]['previousValues']
+			frame = (currentSensorId, currentMode,
+				("%.f" % previousValues[-1]) if len(previousValues) > 0 else None,
+				("%.f" % peakData['max']) if (peakData and (peakData['max'] is not None)) else None,
+				IS_LOGGING, IS_DEMO_ENABLED, IS_ECU_ERROR, IS_AEM_ERROR,
+				list(ALARMS.keys())[-1] if len(ALARMS) > 0 else None)
 			
-			# Display any warning/errors/status messages
-			if IS_LOGGING:
-				addLogStatus(pilImage = image, windowSettings = windowSettings)
-			
-			# Display any demo mode status
-			if IS_DEMO_ENABLED:
-				addDemoStatus(pilImage = image, windowSettings = windowSettings)
-			
-			# Display ECU error connection status
-			if IS_ECU_ERROR:
-				addECUStatus(pilImage = image, windowSettings = windowSettings)
-			else:
-				# We only print the AEM AFR error status if the main ECU is 
-				# not already in error!
-				if IS_AEM_ERROR:
-					addAEMStatus(pilImage = image, windowSettings = windowSettings)
-			
-			if USE_OLED_GRAPHICS:
-				# Update the OLED screen
-				updateOLEDScreen(pilImage = image, windowSettings = windowSettings)
+			if frame != last_frame:
+				last_frame = frame
+				
+				# Simple numeric gauge
+				if currentMode == settings.GFX_MODE_NUMERIC:
+					# Simple numeric display
+					image = gaugeNumeric(ecudata = ecudata,
+						sensor = windowSettings['displayModes'][currentSensorId],
+						windowSettings = windowSettings,
+						sensorData = sensorData,
+						peakData = peakData
+					)
+				else:
+					pass
+				
+				# Display any warning/errors/status messages
+				if IS_LOGGING:
+					addLogStatus(pilImage = image, windowSettings = windowSettings)
+				
+				# Display any demo mode status
+				if IS_DEMO_ENABLED:
+					addDemoStatus(pilImage = image, windowSettings = windowSettings)
+				
+				# Display the latest sensor alarm
+				if len(ALARMS) > 0:
+					addAlarmStatus(pilImage = image, windowSettings = windowSettings, alarm = list(ALARMS.values())[-1])
+				
+				# Display ECU error connection status
+				if IS_ECU_ERROR:
+					addECUStatus(pilImage = image, windowSettings = windowSettings)
+				else:
+					# We only print the AEM AFR error status if the main ECU is 
+					# not already in error!
+					if IS_AEM_ERROR:
+						addAEMStatus(pilImage = image, windowSettings = windowSettings)
+				
+				if USE_OLED_GRAPHICS:
+					# Update the OLED screen
+					updateOLEDScreen(pilImage = image, windowSettings = windowSettings)
+				
+				if USE_SDL_GRAPHICS:
+					# Update the SDL window
+					updateSDLWindow(pilImage = image, windowSettings = windowSettings)
 			
-			if USE_SDL_GRAPHICS:
-				# Update the SDL window
-				updateSDLWindow(pilImage = image, windowSettings = windowSettings)
+			# The sample has now reached the screen
+			if trace:
+				tracer.record(traceStamp(trace))
 				
 			# Reset the timer for this window
 			setRefresh(windowSettings)
@@ -415,6 +468,17 @@ def GraphicsIO(ecudata, controlQueue):
 				fired_windows = 0
 				t0 = timeit.default_timer()
 				
+		# Publish latency histograms for diagnostics
+		if settings.LATENCY_TRACE:
+			if (timeit.default_timer() - latency_timer) >= settings.LATENCY_REPORT_TIMER:
+				ecudata.setStatusData(tracer.summary())
+				tracer.dump(settings.LATENCY_DUMP_FILE)
+				if settings.INFO:
+					tracer.show()
+				latency_timer = timeit.default_timer()
+				
+		loopTimer.stop()
+		
 		# After updating all of the windows, sleep so that we limit the amount of screen refreshes we do
 		time.sleep(settings.GFX_SLEEP_TIME)
 		
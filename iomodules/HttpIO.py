@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# HttpIO - serve live sensor data and metrics over HTTP, e.g. to a phone or laptop.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A small asyncio HTTP server, with the following endpoints:
+#
+# /data		latest value, unit and peaks of every sensor, plus the status block, as JSON
+# /stats	reads per second and read time of every sensor (a sample repeating
+#			the last read of a sensor is not counted), queue depths and the
+#			status data of every worker, as JSON
+# /metrics	all of the above, as Prometheus text
+# /stream	Server-Sent-Events; one 'samples' event every HTTP_POLL_TIME
+#			seconds, with the sensors which have changed since the last one
+#
+# Every sample applied in the main process is also put on our sample queue
+# (see SensorRouter.addListener()), so the latest values cost nothing to
+# read. Everything else held in the shared ecuData is read once every
+# HTTP_STATUS_TIME seconds, a single read of each shared dictionary, however
+# many requests there are. A request is only ever answered from what we hold
+# here, and a JSON body is only built again once something in it has changed.
+
+# Standard libraries
+import multiprocessing
+import asyncio
+import json
+import time
+import timeit
+import sys
+import os
+
+# Settings file
+from libs import settings
+from libs.MessageBus import drainQueue
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+HTTP_STATUS_LINES = {
+	200 : "OK",
+	404 : "Not Found",
+	405 : "Method Not Allowed",
+	503 : "Service Unavailable",
+}
+
+class HttpState():
+	""" The latest sensor values and statistics, as served to every client """
+
+	def __init__(self, ecudata = None, queues = {}):
+
+		self.ecudata = ecudata
+		self.queues = queues
+		self.values = {}
+		self.sampleTimes = {}
+		self.readTimes = {}
+		self.samples = {}
+		self.rates = {}
+		self.latency = {}
+		self.sensors = {}
+		self.peaks = {}
+		self.status = {}
+		self.statusBlock = {}
+		self.depths = {}
+		self.changed = {}
+		self.clients = []
+		self.requests = 0
+		self.dropped = 0
+		# Incremented whenever anything served changes
+		self.generation = 0
+		self.cache = {}
+		self.rate_counts = {}
+		self.rate_timer = timeit.default_timer()
+
+	def sample(self, sensorId = None, value = None, timerData = 0, readTime = None):
+		""" Record a sample taken off the sample queue """
+
+		self.values[sensorId] = value
+		self.changed[sensorId] = value
+		self.generation += 1
+		# Only count a new reading, not a repeat of the last one
+		if (readTime is not None) and (readTime == self.readTimes.get(sensorId)):
+			return
+		self.readTimes[sensorId] = readTime
+		self.sampleTimes[sensorId] = time.time()
+		self.samples[sensorId] = self.samples.get(sensorId, 0) + 1
+		# Time taken to read the sensor, in ms: count, total, min, max, last
+		stats = self.latency.get(sensorId)
+		if stats is None:
+			self.latency[sensorId] = [1, timerData, timerData, timerData, timerData]
+		else:
+			stats[0] += 1
+			stats[1] += timerData
+			stats[2] = min(stats[2], timerData)
+			stats[3] = max(stats[3], timerData)
+			stats[4] = timerData
+
+	def refresh(self):
+		""" Read everything else we serve from the shared ecuData """
+
+		now = timeit.default_timer()
+		elapsed = now - self.rate_timer
+		if elapsed > 0:
+			for sensorId in self.samples.keys():
+				self.rates[sensorId] = (self.samples[sensorId] - self.rate_counts.get(sensorId, 0)) / elapsed
+			self.rate_counts = dict(self.samples)
+		self.rate_timer = now
+
+		try:
+			self.sensors = self.ecudata.getAllSensorData()
+			self.peaks = self.ecudata.getAllPeakData()
+			self.status = self.ecudata.getAllStatusData()
+		except Exception as e:
+			logger.warn("Unable to read shared sensor data: %s" % e)
+		if self.ecudata.statusBlock is not None:
+			self.statusBlock = self.ecudata.statusBlock.snapshot()
+		for name, q in self.queues.items():
+			try:
+				self.depths[name] = q.qsize()
+			except NotImplementedError:
+				self.depths[name] = None
+		self.generation += 1
+
+	def body(self, path = None):
+		""" The response body of an endpoint, only built again once something has changed """
+
+		cached = self.cache.get(path)
+		if cached and (cached[0] == self.generation):
+			return cached[1]
+		if path == "/metrics":
+			body = self.metrics().encode('utf8')
+		elif path == "/stats":
+			body = json.dumps(self.stats(), sort_keys = True).encode('utf8')
+		else:
+			body = json.dumps(self.data(), sort_keys = True).encode('utf8')
+		self.cache[path] = (self.generation, body)
+		return body
+
+	def data(self):
+		""" The latest value of every sensor """
+
+		sensors = {}
+		for sensorId, value in self.values.items():
+			sensorData = self.sensors.get(sensorId, {})
+			sensors[sensorId] = {
+				'value' : value,
+				'time' : self.sampleTimes[sensorId],
+				'unit' : sensorData.get('sensorUnit'),
+				'description' : sensorData.get('description'),
+				'peaks' : self.peaks.get(sensorId),
+			}
+		return {
+			'time' : time.time(),
+			'sensors' : sensors,
+			'status' : self.statusBlock,
+		}
+
+	def stats(self):
+		""" Sample rates and times of every sensor, and the state of the queues and workers """
+
+		sensors = {}
+		for sensorId, stats in self.latency.items():
+			sensors[sensorId] = {
+				'samples' : self.samples[sensorId],
+				'rate' : self.rates.get(sensorId, 0),
+				'sampleTime' : {
+					'last' : stats[4],
+					'min' : stats[2],
+					'max' : stats[3],
+					'average' : stats[1] / stats[0],
+				},
+			}
+		return {
+			'time' : time.time(),
+			'sensors' : sensors,
+			'queues' : self.depths,
+			'workers' : self.status,
+			'http' : {
+				'clients' : len(self.clients),
+				'requests' : self.requests,
+				'dropped' : self.dropped,
+			},
+		}
+
+	def metrics(self):
+		""" Everything we know, in the Prometheus text format """
+
+		lines = []
+		def metric(name = None, help = None, kind = "gauge", values = []):
+			lines.append("# HELP pycosworth_%s %s" % (name, help))
+			lines.append("# TYPE pycosworth_%s %s" % (name, kind))
+			for labels, value in values:
+				if isinstance(value, bool):
+					value = int(value)
+				if not isinstance(value, (int, float)):
+					continue
+				lines.append("pycosworth_%s%s %s" % (name, labels, value))
+
+		metric("sensor_value", "Latest value of each sensor",
+			values = [('{sensor="%s"}' % sensorId, value) for sensorId, value in sorted(self.values.items())])
+		metric("sensor_samples_total", "Samples of each sensor seen since start up", "counter",
+			values = [('{sensor="%s"}' % sensorId, count) for sensorId, count in sorted(self.samples.items())])
+		metric("sensor_rate", "Samples of each sensor per second",
+			values = [('{sensor="%s"}' % sensorId, rate) for sensorId, rate in sorted(self.rates.items())])
+		metric("sensor_sample_time_ms", "Time taken to read each sensor, in milliseconds",
+			values = [('{sensor="%s"}' % sensorId, stats[1] / stats[0]) for sensorId, stats in sorted(self.latency.items())])
+		metric("status", "Shared status block fields",
+			values = [('{field="%s"}' % field, value) for field, value in sorted(self.statusBlock.items())])
+		metric("queue_depth", "Messages waiting on each queue",
+			values = [('{queue="%s"}' % name, depth) for name, depth in sorted(self.depths.items())])
+		workers = self.status.get('workers', {}).get('workers', [])
+		metric("worker_restarts_total", "Times each worker has been restarted", "counter",
+			values = [('{worker="%s"}' % worker['name'], worker['restarts']) for worker in workers])
+		link = self.status.get('cosworthLink', {})
+		metric("ecu_link_up", "Is the link to the Cosworth ECU up",
+			values = [("", link['state'] == "up")] if link else [])
+		metric("ecu_link_error_rate", "Fraction of recent Cosworth ECU reads which failed",
+			values = [("", link['errorRate'])] if link else [])
+		metric("ecu_link_reconnects_total", "Times the serial port to the Cosworth ECU has been reopened", "counter",
+			values = [("", link['reconnects'])] if link else [])
+		metric("ecu_link_reads_total", "Outcome of every Cosworth ECU read, by sensor", "counter",
+			values = [('{sensor="%s",result="%s"}' % (sensorId, result), count) for sensorId, counts in sorted(link.get('channels', {}).items()) for result, count in sorted(counts.items())])
+		metric("ecu_link_round_trip_ms", "Average time from sending a control code to the Cosworth ECU to its reply, in milliseconds",
+			values = [('{code="%s"}' % code, stats['average']) for code, stats in sorted(link.get('roundTrip', {}).items())])
+		metric("http_clients", "Clients connected to the sample stream",
+			values = [("", len(self.clients))])
+		metric("http_dropped_total", "Stream events thrown away as a client was too slow", "counter",
+			values = [("", self.dropped)])
+		return "\n".join(lines) + "\n"
+
+	def publish(self):
+		""" Send the sensors changed since the last call to every stream client """
+
+		if len(self.changed) == 0:
+			return
+		event = ("event: samples\ndata: %s\n\n" % json.dumps(self.changed, sort_keys = True)).encode('utf8')
+		self.changed = {}
+		for client in self.clients:
+			if client.full():
+				# A slow client misses the oldest event, not the newest
+				client.get_nowait()
+				self.dropped += 1
+			client.put_nowait(event)
+
+	def close(self):
+		""" End the stream of every client """
+
+		for client in self.clients:
+			if client.full():
+				client.get_nowait()
+			client.put_nowait(None)
+
+class HttpServer():
+	""" Answers HTTP requests from an HttpState """
+
+	def __init__(self, state = None):
+
+		self.state = state
+
+	async def handle(self, reader, writer):
+		""" A single client connection """
+
+		try:
+			request = await asyncio.wait_for(reader.readline(), settings.HTTP_TIMEOUT)
+			parts = request.decode('latin-1').split()
+			if len(parts) < 2:
+				return
+			method = parts[0]
+			path = parts[1].split('?')[0]
+			# We have no use for any of the headers
+			while True:
+				line = await asyncio.wait_for(reader.readline(), settings.HTTP_TIMEOUT)
+				if line in (b"\r\n", b"\n", b""):
+					break
+			self.state.requests += 1
+
+			if method not in ("GET", "HEAD"):
+				await self.__respond__(writer, 405)
+			elif path == "/stream":
+				await self.__stream__(writer)
+			elif path in ("/data", "/stats"):
+				await self.__respond__(writer, 200, self.state.body(path), "application/json", method == "HEAD")
+			elif path == "/metrics":
+				await self.__respond__(writer, 200, self.state.body(path), "text/plain; version=0.0.4", method == "HEAD")
+			elif path == "/":
+				index = json.dumps({ 'endpoints' : ["/data", "/stats", "/metrics", "/stream"] }).encode('utf8')
+				await self.__respond__(writer, 200, index, "application/json", method == "HEAD")
+			else:
+				await self.__respond__(writer, 404)
+		except (asyncio.TimeoutError, ConnectionError):
+			pass
+		except Exception as e:
+			logger.warn("Error handling HTTP request: %s" % e)
+		finally:
+			writer.close()
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __header__(self, code = 200, contentType = None, length = None):
+
+		header = "HTTP/1.1 %s %s\r\n" % (code, HTTP_STATUS_LINES[code])
+		header += "Access-Control-Allow-Origin: *\r\n"
+		header += "Cache-Control: no-cache\r\n"
+		if contentType:
+			header += "Content-Type: %s\r\n" % contentType
+		if length is not None:
+			header += "Content-Length: %s\r\n" % length
+		header += "Connection: close\r\n"
+		return (header + "\r\n").encode('latin-1')
+
+	async def __respond__(self, writer = None, code = 200, body = b"", contentType = None, head = False):
+
+		if code != 200:
+			body = ("%s %s\n" % (code, HTTP_STATUS_LINES[code])).encode('latin-1')
+			contentType = "text/plain"
+		writer.write(self.__header__(code, contentType, len(body)))
+		if head is False:
+			writer.write(body)
+		await writer.drain()
+
+	async def __stream__(self, writer = None):
+		""" Send sample events until the client goes away """
+
+		if len(self.state.clients) >= settings.HTTP_MAX_CLIENTS:
+			await self.__respond__(writer, 503)
+			return
+		client = asyncio.Queue(settings.HTTP_CLIENT_QUEUE)
+		self.state.clients.append(client)
+		logger.info("Stream client connected, %s now connected" % len(self.state.clients))
+		try:
+			writer.write(self.__header__(200, "text/event-stream"))
+			# Everything we have so far, so the client need not wait for each sensor to change
+			writer.write(("event: samples\ndata: %s\n\n" % json.dumps(self.state.values, sort_keys = True)).encode('utf8'))
+			await writer.drain()
+			while True:
+				event = await client.get()
+				if event is None:
+					break
+				writer.write(event)
+				await writer.drain()
+		finally:
+			self.state.clients.remove(client)
+			logger.info("Stream client disconnected, %s now connected" % len(self.state.clients))
+
+async def HttpLoop(state = None, sampleQueue = None, controlQueue = None):
+	""" Take samples and control messages off their queues until we are told to shut down """
+
+	myButtonId = settings.BUTTON_DEST_HTTP
+	status_timer = None
+
+	loopTimer = LoopTimer("HttpIO")
+	while True:
+		loopTimer.start()
+
+		for cdata in drainQueue(controlQueue):
+			if cdata.isMine(myButtonId):
+				if cdata.button == settings.STATUS_SHUTDOWN:
+					logger.critical("Shutting down")
+					return
+
+		for sample in drainQueue(sampleQueue, limit = settings.HTTP_QUEUE_SIZE):
+			state.sample(sample[0], sample[1], sample[2], sample[3])
+		state.publish()
+
+		if (status_timer is None) or ((timeit.default_timer() - status_timer) >= settings.HTTP_STATUS_TIME):
+			state.refresh()
+			status_timer = timeit.default_timer()
+
+		loopTimer.stop()
+		await asyncio.sleep(settings.HTTP_POLL_TIME)
+
+async def HttpMain(ecudata = None, sampleQueue = None, controlQueue = None, queues = {}):
+
+	state = HttpState(ecudata = ecudata, queues = queues)
+	server = HttpServer(state = state)
+	httpd = await asyncio.start_server(server.handle, settings.HTTP_HOST, settings.HTTP_PORT)
+	logger.info("Serving HTTP on %s:%s" % (settings.HTTP_HOST, settings.HTTP_PORT))
+	try:
+		await HttpLoop(state, sampleQueue, controlQueue)
+	finally:
+		httpd.close()
+		state.close()
+		# Let every stream client see the end of its stream
+		await asyncio.sleep(0.1)
+
+def HttpIO(ecudata, sampleQueue, controlQueue, queues = {}):
+	""" Serve the latest sensor values and metrics over HTTP """
+
+	proc_name = multiprocessing.current_process().name
+
+	logger.info("HttpIO process now running")
+
+	try:
+		asyncio.run(HttpMain(ecudata, sampleQueue, controlQueue, queues))
+	except OSError as e:
+		# Most likely the port is in use; the supervisor will try again later
+		logger.error("Unable to serve HTTP on %s:%s" % (settings.HTTP_HOST, settings.HTTP_PORT))
+		logger.error("%s" % e)
+		sys.exit(1)
+	acknowledge()
+	sys.exit(0)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+# LogCompressorIO - compresses finished log segments and keeps the log directory within its quota.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard libraries
+import multiprocessing
+import queue
+import time
+import timeit
+import json
+import os
+import sys
+
+# Control messages
+from libs.MessageBus import drainQueue
+
+# Segmented log files
+from libs.SegmentLog import segmentBlocks, segmentMatch, segmentFilename, sessionSegments, syncFile
+
+# List of every logging session
+from libs.LogCatalog import LogCatalog, sessionFiles, sessionSize, SESSION_RECORDING
+
+# Block compression
+from libs.LogCompress import compressFormat, compressBlock, isCompressed, mapFilename, COMPRESS_SUFFIXES
+
+# Settings file
+from libs import settings
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+def writeFile(filename = None, data = b""):
+	""" Write a file in full, synced to disk, replacing any existing file in one step """
+
+	tmpFilename = filename + ".tmp"
+	with open(tmpFilename, 'wb') as f:
+		f.write(data)
+		f.flush()
+		syncFile(f.fileno())
+	os.replace(tmpFilename, filename)
+
+def compressSegment(filename = None):
+	""" Compress a closed segment block by block, then remove the original.
+	Returns the (original, compressed) size in bytes. """
+
+	with open(filename, 'rb') as f:
+		data = f.read()
+	blocks = segmentBlocks(data)
+	if len(blocks) == 0:
+		logger.warn("No complete blocks in [%s], not compressing" % filename)
+		return 0, 0
+	if blocks[-1][1] < len(data):
+		logger.warn("Discarding %s bytes after the last valid block of [%s]" % (len(data) - blocks[-1][1], filename))
+
+	fmt = compressFormat()
+	compressed = bytearray()
+	chunks = []
+	for start, end in blocks:
+		z = compressBlock(data[start:end], fmt)
+		chunks.append([start, end, len(compressed), len(z)])
+		compressed.extend(z)
+
+	# The map goes first, so that a compressed file is never without one
+	with open(mapFilename(filename) + ".tmp", 'w') as f:
+		json.dump({ 'format' : fmt, 'chunks' : chunks }, f)
+	os.replace(mapFilename(filename) + ".tmp", mapFilename(filename))
+	writeFile(filename + COMPRESS_SUFFIXES[fmt], bytes(compressed))
+	os.remove(filename)
+	return len(data), len(compressed)
+
+def freeSpace():
+	""" Bytes free on the disk holding the log directory """
+
+	s = os.statvfs(settings.LOGGING_DIR)
+	return s.f_bavail * s.f_frsize
+
+def enforceQuota(catalog = None):
+	""" Delete the oldest logging sessions until the logs fit in the quota and
+	there is enough free space. The newest session is never deleted, as it may
+	still be being written. """
+
+	quota = settings.LOGGING_QUOTA_MB * 1024 * 1024
+	minFree = settings.LOGGING_MIN_FREE_MB * 1024 * 1024
+	sessions = catalog.sessions()
+	if len(sessions) < 2:
+		return 0
+	# The size of the session being recorded isn't in the catalog until it is closed
+	sessions[-1]['size'] = sessionSize(sessions[-1]['session'])
+	used = sum([entry['size'] for entry in sessions])
+
+	removed = 0
+	for entry in sessions[:-1]:
+		overQuota = (quota > 0) and (used > quota)
+		lowSpace = (minFree > 0) and (freeSpace() < minFree)
+		if (overQuota is False) and (lowSpace is False):
+			break
+		logger.warn("Removing logging session %s (%.1fMB) - %s" % (entry['session'], entry['size'] / 1024 / 1024, "over quota" if overQuota else "disk space low"))
+		for f in sessionFiles(entry['session']):
+			try:
+				os.remove(f)
+			except Exception as e:
+				logger.error("Unable to remove [%s]" % f)
+				logger.error("%s" % e)
+		catalog.removeSession(entry['session'])
+		used -= entry['size']
+		removed += 1
+	return removed
+
+def openSegments(catalog = None):
+	""" The newest segment of every session still marked as being recorded,
+	which DataLoggerIO may have open """
+
+	segments = []
+	for entry in catalog.sessions():
+		if entry['status'] == SESSION_RECORDING:
+			found = sessionSegments(segmentFilename(entry['session'], 0))
+			if len(found) > 0:
+				segments.append(found[-1])
+	return segments
+
+def closedSegments(before = 0, skip = []):
+	""" Uncompressed segments which were last written before a given time """
+
+	segments = []
+	for f in sorted(os.listdir(settings.LOGGING_DIR)):
+		filename = os.path.join(settings.LOGGING_DIR, f)
+		if segmentMatch(filename) and (isCompressed(filename) is False) and (filename not in skip):
+			if os.path.getmtime(filename) < before:
+				segments.append(filename)
+	return segments
+
+def LogCompressorIO(controlQueue):
+	""" Compresses closed log segments in the background """
+
+	myButtonId = settings.BUTTON_DEST_COMPRESSOR
+
+	logger.debug("LogCompressorIO process now running")
+
+	# Stay out of the way of every other process
+	try:
+		os.nice(settings.LOGGING_COMPRESS_NICE)
+	except Exception as e:
+		logger.warn("Unable to lower the priority of the log compressor")
+		logger.warn("%s" % e)
+
+	catalog = LogCatalog()
+
+	# We may have been restarted while DataLoggerIO is still writing, so the
+	# newest segment of any session still being recorded is left alone. If
+	# that session was cut short by a power cut instead, DataLoggerIO sends
+	# us the segment once it has recovered it.
+	pending = closedSegments(before = time.time(), skip = openSegments(catalog))
+	if len(pending) > 0:
+		logger.info("Found %s log segments to compress" % len(pending))
+
+	loopTimer = LoopTimer("LogCompressorIO")
+	while True:
+
+		# Wait for a control message, or the next time to check on the disk
+		messages = []
+		if len(pending) == 0:
+			try:
+				messages.append(controlQueue.get(block = True, timeout = settings.LOGGING_COMPRESS_SLEEP))
+			except queue.Empty:
+				pass
+		# Then take every other message waiting
+		messages += drainQueue(controlQueue)
+
+		loopTimer.start()
+		for cdata in messages:
+			if cdata.isMine(myButtonId) is False:
+				continue
+
+			# exit
+			if cdata.button == settings.STATUS_SHUTDOWN:
+				logger.critical("Shutting down")
+				acknowledge()
+				sys.exit(0)
+
+			# a segment has been closed by DataLoggerIO
+			if cdata.button == settings.STATUS_SEGMENT_CLOSED:
+				pending.append(cdata.getPayload()['filename'])
+
+		# Compress one segment at a time, so that we can still respond to
+		# control messages
+		if len(pending) > 0:
+			filename = pending.pop(0)
+			if os.path.exists(filename):
+				try:
+					t = timeit.default_timer()
+					size, compressed = compressSegment(filename)
+					if size > 0:
+						logger.info("Compressed [%s] %.1fKB -> %.1fKB in %.2fs" % (filename, size / 1024, compressed / 1024, timeit.default_timer() - t))
+						session = segmentMatch(filename)[0]
+						entry = catalog.session(session)
+						if entry and (entry['status'] != SESSION_RECORDING):
+							catalog.updateSession(session, size = sessionSize(session))
+				except Exception as e:
+					logger.error("Unable to compress [%s]" % filename)
+					logger.error("%s" % e)
+
+		try:
+			enforceQuota(catalog)
+		except Exception as e:
+			logger.error("Unable to check log disk usage")
+			logger.error("%s" % e)
+
+		loopTimer.stop()
@@ -23,24 +23,35 @@ import timeit
 import sys
 import os
 
-# Sensor back end libraries
-from iomodules.sensors.Cosworth import CosworthSensors
-from iomodules.sensors.AEM import AEMSensors
-from iomodules.sensors.Demo import DemoSensors
+# Sensor back end libraries are only imported when enabled, as
+# most of them pull in serial
 
 # Settings file
 from libs import settings
-from libs.ControlData import ControlData
+from libs.MessageBus import drainQueue
+from libs.LatencyTrace import traceStamp
+from libs.SensorFilters import sensorFilters, filterSample
+from libs.StatusBlock import StatusBlock
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
 
 # Start a new logger
 from libs.newlog import newlog
 logger = newlog(__name__)
 
-def SensorIO(dataQueue, controlQueue):
+def SensorIO(dataQueue, controlQueue, statusBlock = None):
 	""" Serial IO """
 		
 	proc_name = multiprocessing.current_process().name
 	myButtonId = settings.BUTTON_DEST_SENSORIO
+	
+	# ECU, AEM and demo mode status is shared with every other process here
+	if statusBlock is None:
+		statusBlock = StatusBlock()
 		
 	# Initialise connection
 	logger.info("Initialising Sensor IO [id:%d]" % myButtonId)
@@ -54,12 +65,13 @@ def SensorIO(dataQueue, controlQueue):
 	# Load any cosworth sensor types here
 	if settings.USE_COSWORTH:
 		logger.info("Trying Cosworth ECU sensors...")
+		from iomodules.sensors.Cosworth import CosworthSensors
 		cosworth = CosworthSensors(ecuType = settings.COSWORTH_ECU_TYPE, pressureType = "mbar")
-		if cosworth.__is_connected__():
-			cosworth_sensors = cosworth.available()
-		else:
+		# The sensors are kept even if the ECU can't be reached yet, as
+		# the module reconnects by itself
+		cosworth_sensors = cosworth.available()
+		if cosworth.__is_connected__() is False:
 			logger.warn("Unable to initialise Cosworth ECU comms")
-			cosworth_sensors = []
 			IS_ECU_ERROR = True
 	else:
 		cosworth = None
@@ -68,6 +80,7 @@ def SensorIO(dataQueue, controlQueue):
 	# Load any aem sensor types here
 	if settings.USE_AEM:
 		logger.info("Trying AEM Wideband AFR sensors...")
+		from iomodules.sensors.AEM import AEMSensors
 		aem = AEMSensors()
 		if aem.__is_connected__():
 			aem_sensors = aem.available()
@@ -79,10 +92,25 @@ def SensorIO(dataQueue, controlQueue):
 		aem = None
 		aem_sensors = []
 	
+	# Load the UPS hat supply and battery sensors here
+	if settings.USE_UPS:
+		logger.info("Trying UPS telemetry sensors...")
+		from iomodules.sensors.UPS import UPSSensors
+		ups = UPSSensors()
+		if ups.__is_connected__():
+			ups_sensors = ups.available()
+		else:
+			logger.warn("Unable to initialise UPS telemetry")
+			ups_sensors = []
+	else:
+		ups = None
+		ups_sensors = []
+	
 	# Load any demo sensor types here
 	if settings.USE_SENSOR_DEMO:
 		logger.info("Trying Demo sensors...")
 		SENSOR_DEMO = True
+		from iomodules.sensors.Demo import DemoSensors
 		demo = DemoSensors()
 		demo_sensors = demo.available()
 	else:
@@ -90,6 +118,23 @@ def SensorIO(dataQueue, controlQueue):
 		demo = None
 		demo_sensors = []
 	
+	# Load a recorded log to play back, in place of live sensors
+	if settings.USE_SENSOR_REPLAY:
+		logger.info("Trying Replay sensors...")
+		from iomodules.sensors.Replay import ReplaySensors
+		replay = ReplaySensors(filename = settings.SENSOR_REPLAY_FILE, speed = settings.SENSOR_REPLAY_SPEED, loop = settings.SENSOR_REPLAY_LOOP, start = settings.SENSOR_REPLAY_START)
+		if replay.__is_connected__():
+			SENSOR_REPLAY = True
+			replay_sensors = list(replay.available())
+		else:
+			logger.warn("Unable to open log for replay")
+			SENSOR_REPLAY = False
+			replay_sensors = []
+	else:
+		SENSOR_REPLAY = False
+		replay = None
+		replay_sensors = []
+	
 	####################################################
 	#
 	# This loop runs forever, or until the process is
@@ -98,7 +143,12 @@ def SensorIO(dataQueue, controlQueue):
 	####################################################
 	logger.info("Sensor retrieval starting")
 	
-	for sensor in settings.SENSORS:
+	# Smoothing of noisy sensors, before the values are displayed or logged
+	filters = sensorFilters()
+	
+	# The start up sensor is read first, so that it is live as soon as possible
+	startupSensors = sorted(settings.SENSORS, key = lambda sensor: sensor['sensorId'] != settings.STARTUP_SENSOR)
+	for sensor in startupSensors:
 		sensorId = sensor['sensorId']
 		sensorData = False			
 		if sensorId in cosworth_sensors:
@@ -107,31 +157,47 @@ def SensorIO(dataQueue, controlQueue):
 		if sensorId in aem_sensors:
 			sensorData = aem.sensor(sensorId, force = True)
 			timerData = aem.performance(sensorId)
+		if sensorId in ups_sensors:
+			sensorData = ups.sensor(sensorId, force = True)
+			timerData = ups.performance(sensorId)
 		if SENSOR_DEMO:
 			if (sensorData is False) and (sensorId in demo_sensors):
 				sensorData = demo.sensor(sensorId, force = True)
 				timerData = demo.performance(sensorId)
 		if sensorData:
+			if sensorData['value'] is not None:
+				filterSample(filters, sensorData)
+			if sensorData['readTime']:
+				sensorData['trace'] = traceStamp((sensorData['readTime'],))
 			dataQueue.put((settings.TYPE_DATA, sensorData, 0, 0))
 			
-	heartbeat_timer = timeit.default_timer()
+	rate_timer = timeit.default_timer()
+	rate_samples = 0
+	link_timer = timeit.default_timer()
 	timerData = {
 		'last' : 0,
 	}
+	loopTimer = LoopTimer("SensorIO")
 	while True:
+		loopTimer.start()
 		data_added = False
 		####################################################
 		#
 		# Listen for control messages
 		#
 		####################################################
-		if controlQueue.empty() == False:
-			cdata = controlQueue.get()
+		# Handle every message waiting, not just the first
+		for cdata in drainQueue(controlQueue):
 			if cdata.isMine(myButtonId):
 				logger.debug("Got a control message")
 				
 				if cdata.button == settings.STATUS_SHUTDOWN:
 					logger.critical("Shutting down")
+					# Release the serial ports and I2C bus
+					for backend in [cosworth, aem, ups]:
+						if backend and backend.__is_connected__():
+							backend.close()
+					acknowledge()
 					sys.exit(0)
 				
 				# Toggle demo mode
@@ -141,31 +207,12 @@ def SensorIO(dataQueue, controlQueue):
 						SENSOR_DEMO = False
 						demo = False
 						demo_sensors = []
-						status = {
-							'sourceId' : myButtonId,
-							'demoMode' : True
-						}
-						logger.debug("Confirming Demo mode disabled status")
-						cdata = ControlData()
-						cdata.button = settings.STATUS_DEMO_DISABLED
-						cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-						cdata.setPayload(data = {'status' : True, 'description' : "Demo mode has been disabled."})
-						dataQueue.put((settings.TYPE_STATUS, cdata, counter, None))
 					elif SENSOR_DEMO is False:
 						logger.info("Enable demo mode")
 						SENSOR_DEMO = True
+						from iomodules.sensors.Demo import DemoSensors
 						demo = DemoSensors()
 						demo_sensors = demo.available()
-						status = {
-							'sourceId' : myButtonId,
-							'demoMode' : True
-						}
-						logger.debug("Confirming Demo mode enabled status")
-						cdata = ControlData()
-						cdata.button = settings.STATUS_DEMO_ENABLED
-						cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-						cdata.setPayload(data = {'status' : True, 'description' : "Demo mode is enabled."})
-						dataQueue.put((settings.TYPE_STATUS, cdata, counter, None))
 
 						
 				# Reset Cosworth ecu comms
@@ -174,13 +221,8 @@ def SensorIO(dataQueue, controlQueue):
 						logger.info("Resetting Cosworth ECU serial connection")
 						cosworth.__reconnectECU__()
 						time.sleep(2)
-						if cosworth.__is_connected__():
-							cosworth_sensors = cosworth.available()
-							IS_ECU_ERROR = False
-						else:
+						if cosworth.__is_connected__() is False:
 							logger.warn("Unable to initialise Cosworth ECU comms")
-							cosworth_sensors = []
-							IS_ECU_ERROR = True
 						
 					# Reset AEM comms
 					if (settings.USE_AEM):
@@ -195,6 +237,26 @@ def SensorIO(dataQueue, controlQueue):
 							aem_sensors = []
 							IS_AEM_ERROR = True
 		
+		####################################################
+		#
+		# Replay loop - send every row of the log which is
+		# due, in place of reading any live sensors.
+		#
+		####################################################
+		replay_rows = 0
+		while SENSOR_REPLAY and replay.next():
+			for sensorId in replay_sensors:
+				sensorData = replay.sensor(sensorId, force = True)
+				if sensorData and (sensorData['value'] is not None):
+					sensorData['trace'] = traceStamp((sensorData['readTime'],))
+					dataQueue.put((settings.TYPE_DATA, sensorData, counter, 0))
+					rate_samples += 1
+			counter += 1
+			replay_rows += 1
+			# Don't starve the control messages when replaying flat out
+			if replay_rows >= settings.SENSOR_REPLAY_BATCH:
+				break
+		
 		####################################################
 		#
 		# Standard loop - do a read of sensors defined in
@@ -203,6 +265,10 @@ def SensorIO(dataQueue, controlQueue):
 		####################################################
 		for sensor in settings.SENSORS:
 			
+			# Live sensors are not read while a log is replayed
+			if SENSOR_REPLAY:
+				break
+			
 			sensorId = sensor['sensorId']
 			sensorData = False
 			
@@ -223,54 +289,50 @@ def SensorIO(dataQueue, controlQueue):
 					sensorData = demo.sensor(sensorId)
 					timerData = demo.performance(sensorId)
 			
+			# The UPS hat is read in demo mode too, as it is the Pi's own supply
+			if (sensorData is False) and (sensorId in ups_sensors):
+				sensorData = ups.sensor(sensorId)
+				timerData = ups.performance(sensorId)
+			
 			# Did we get any data for this sensor?
 			if sensorData:
 				if sensorData['value'] is not None:
 					logger.debug("Received %s: value:%s counter:%s" % (sensorData['sensor']['sensorId'], sensorData['value'], counter))
+					filterSample(filters, sensorData)
+					# Timestamp the hop from the serial read onto the queue
+					if sensorData['readTime']:
+						sensorData['trace'] = traceStamp((sensorData['readTime'],))
 					dataQueue.put((settings.TYPE_DATA, sensorData, counter, timerData['last']))
 					data_added = True
+					rate_samples += 1
 		
-		# Send heartbeat message indicating ECU error status
-		if (timeit.default_timer() - heartbeat_timer) >= settings.SENSOR_ERROR_HEARTBEAT_TIMER:
-			if settings.USE_COSWORTH:
-				if IS_ECU_ERROR:
-					logger.debug("Sending Cosworth ECU error status")
-					cdata = ControlData()
-					cdata.button = settings.STATUS_ECU_ERROR
-					cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-					cdata.setPayload(data = {'status' : True, 'description' : "Cosworth ECU connection error."})
-					dataQueue.put((settings.TYPE_STATUS, cdata, counter, timerData['last']))
-				else:
-					logger.debug("Sending Cosworth ECU okay status")
-					cdata = ControlData()
-					cdata.button = settings.STATUS_ECU_OK
-					cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-					cdata.setPayload(data = {'status' : False, 'description' : "Cosworth ECU connected okay."})
-					dataQueue.put((settings.TYPE_STATUS, cdata, counter, timerData['last']))
-			
-			# Send heartbeat message indicating AEM error status
-			if settings.USE_AEM:
-				if IS_AEM_ERROR:
-					logger.debug("Sending AEM AFR error status")
-					cdata = ControlData()
-					cdata.button = settings.STATUS_AEM_ERROR
-					cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-					cdata.setPayload(data = {'status' : True, 'description' : "AEM Wideband AFR connection error."})
-					dataQueue.put((settings.TYPE_STATUS, cdata, counter, timerData['last']))
-				else:
-					logger.debug("Sending AEM AFR okay status")
-					cdata = ControlData()
-					cdata.button = settings.STATUS_AEM_OK
-					cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
-					cdata.setPayload(data = {'status' : False, 'description' : "AEM Wideband AFR connected okay."})
-					dataQueue.put((settings.TYPE_STATUS, cdata, counter, timerData['last']))
-				
-			heartbeat_timer = timeit.default_timer()
+		# The ECU link comes and goes by itself
+		if cosworth:
+			IS_ECU_ERROR = not cosworth.healthy()
+			if (timeit.default_timer() - link_timer) >= settings.COSWORTH_STATS_TIMER:
+				dataQueue.put((settings.TYPE_STATUS, cosworth.link(), counter, 0))
+				link_timer = timeit.default_timer()
+		
+		# Any change of ECU, AEM or demo mode status is seen by the
+		# other processes as soon as it is written here
+		statusBlock.set(ecuError = IS_ECU_ERROR, aemError = IS_AEM_ERROR, demoMode = SENSOR_DEMO)
+		
+		# As is our sample rate, every second or so
+		if (timeit.default_timer() - rate_timer) >= settings.SENSOR_RATE_TIMER:
+			statusBlock.set(sampleRate = rate_samples / (timeit.default_timer() - rate_timer))
+			rate_timer = timeit.default_timer()
+			rate_samples = 0
+		
+		loopTimer.stop()
 		
 		# Sleep at the end of each round so that we don't
 		# consume too many processor cycles. May need to experiment
 		# with this value for different platforms.
-		time.sleep(settings.SENSOR_SLEEP_TIME)
+		if SENSOR_REPLAY and (settings.SENSOR_REPLAY_SPEED == 0):
+			# Replaying as fast as possible
+			pass
+		else:
+			time.sleep(settings.SENSOR_SLEEP_TIME)
 		
 		if data_added:
 			counter += 1
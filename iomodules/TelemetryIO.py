@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# TelemetryIO - stream live sensor values over the network, e.g. to a laptop in the pits
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every sample applied in the main process is also put on our sample queue
+# (see SensorRouter.addListener()). The queue is bounded, and the main
+# process throws away the oldest sample when it is full, so a slow network
+# never holds up the sensors. We only keep the latest value of each sensor,
+# and send a frame (see libs/Telemetry.py) every TELEMETRY_FRAME_TIME
+# seconds to a UDP multicast group. Run ./TelemetryReceiver on any machine
+# on the same network to see them.
+
+# Standard libraries
+import multiprocessing
+import socket
+import time
+import timeit
+import sys
+import os
+
+# Settings file
+from libs import settings
+from libs.MessageBus import drainQueue
+
+# Frame encoding
+from libs.Telemetry import TelemetryEncoder
+
+# Per-loop timing counters
+from libs.Profiler import LoopTimer
+
+# Tells the supervisor when we have finished shutting down
+from libs.Supervisor import acknowledge
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+def telemetrySocket():
+	""" A non-blocking UDP socket for sending to the multicast group """
+
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+	sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, settings.TELEMETRY_TTL)
+	if settings.TELEMETRY_INTERFACE:
+		sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(settings.TELEMETRY_INTERFACE))
+	sock.setblocking(False)
+	return sock
+
+def TelemetryIO(sampleQueue, controlQueue):
+	""" Send the latest sensor values over the network """
+
+	proc_name = multiprocessing.current_process().name
+	myButtonId = settings.BUTTON_DEST_TELEMETRY
+
+	logger.info("TelemetryIO process now running")
+
+	address = (settings.TELEMETRY_GROUP, settings.TELEMETRY_PORT)
+	sock = None
+	encoder = TelemetryEncoder()
+
+	frames = 0
+	dropped = 0
+	stats_timer = timeit.default_timer()
+
+	loopTimer = LoopTimer("TelemetryIO")
+	while True:
+		loopTimer.start()
+
+		for cdata in drainQueue(controlQueue):
+			if cdata.isMine(myButtonId):
+				if cdata.button == settings.STATUS_SHUTDOWN:
+					logger.critical("Shutting down")
+					if sock:
+						sock.close()
+					acknowledge()
+					sys.exit(0)
+
+		# Only the latest value of each sensor matters
+		for sample in drainQueue(sampleQueue, limit = settings.TELEMETRY_QUEUE_SIZE):
+			encoder.update(sample[0], sample[1])
+
+		frame = encoder.frame()
+		if frame:
+			try:
+				if sock is None:
+					sock = telemetrySocket()
+					logger.info("Sending telemetry to %s:%s" % address)
+				sock.sendto(frame, address)
+				frames += 1
+			except OSError as e:
+				# Network down, or its buffer full; the next frame will do
+				dropped += 1
+				logger.debug("Unable to send telemetry frame: %s" % e)
+				if not isinstance(e, BlockingIOError):
+					if sock:
+						sock.close()
+					sock = None
+
+		if (timeit.default_timer() - stats_timer) >= settings.TELEMETRY_STATS_TIMER:
+			logger.info("Telemetry frames sent: %s dropped: %s" % (frames, dropped))
+			stats_timer = timeit.default_timer()
+
+		loopTimer.stop()
+		time.sleep(settings.TELEMETRY_FRAME_TIME)
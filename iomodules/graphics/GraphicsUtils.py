@@ -171,8 +171,20 @@ def addDemoStatus(pilImage, windowSettings):
 	
 	return pilImage
 
-def gaugeNumeric(ecudata, sensor, windowSettings, sensorData):
-	""" Simple numeric display, with the sensor name in one corner """
+def addAlarmStatus(pilImage, windowSettings, alarm):
+	""" Adds an inverted banner across the top of the screen with the alarm message """
+
+	statusString = alarm['description']
+	draw = ImageDraw.Draw(pilImage)
+	font = ImageFont.truetype(settings.GFX_FONTS["pixel"]["header"]['font'], size = 16)
+	text_size = font.getsize(statusString)
+	draw.rectangle((0, 0, windowSettings['x_size'], text_size[1] + 1), fill = "white")
+	draw.text((0, 0), statusString, fill="black", font = font)
+	
+	return pilImage
+
+def gaugeNumeric(ecudata, sensor, windowSettings, sensorData, peakData = None):
+	""" Simple numeric display, with the sensor name in one corner and the peak value in another """
 	
 	sensorValueString = "%.f" % (sensor['previousValues'][-1])
 
@@ -211,6 +223,12 @@ def gaugeNumeric(ecudata, sensor, windowSettings, sensorData):
 		# Units
 		draw.text((windowSettings['x_size'] - text_size[0], text_size[1] + 8), sensorData['sensorUnit'], fill="white", font = font_small)
 		
+	if peakData and (peakData['max'] is not None):
+		# Peak value at bottom left
+		peakString = "MAX %.f" % peakData['max']
+		text_size = font_small.getsize(peakString)
+		draw.text((0, windowSettings['y_size'] - text_size[1]), peakString, fill="white", font = font_small)
+		
 	t2 = timeit.default_timer() - t1
 	logger.debug("gaugeNumeric Draw time: %0.4fms" % (t2 * 1000))
 	
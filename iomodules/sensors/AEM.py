@@ -69,11 +69,11 @@ class AEMSensors():
 		if sensorId in self.sensors.keys():
 			# Has the refresh timer expired
 			raw_v = self.sensors[sensorId].get(force = force)
-			if raw_v:
+			if raw_v is not None:
 				v = self.__translate__(sensorId, raw_v)
 			else:
 				v = raw_v
-			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : raw_v}
+			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : raw_v, 'readTime' : self.sensors[sensorId].readTime()}
 		else:
 			# Not a valid sensor
 			logger.warn("Unsupported sensor type: %s" % sensorId)
@@ -172,6 +172,9 @@ class AEMSensors():
 
 			try:
 				raw_value = self.serial.readline()
+				# Nothing before the timeout
+				if len(raw_value) == 0:
+					return None, None
 
 			except Exception as e:
 				#logger.error("Error communicating with serial port!")
@@ -188,7 +191,10 @@ class AEMSensors():
 		
 		if sensorId == 'AFR':
 			try:
-				value = rawValue.strip('\n')
+				# pyserial returns bytes from readline()
+				if isinstance(rawValue, bytes):
+					rawValue = rawValue.decode('ascii', 'ignore')
+				value = rawValue.strip()
 				value = float(value)
 			except:
 				value = rawValue
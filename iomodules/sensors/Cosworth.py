@@ -16,8 +16,37 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Every read of a sensor writes its control code(s) to the ECU and reads a
+# single byte back for each. The outcome of every read is counted against
+# its sensor (see link()):
+#
+# reads		a value was read
+# timeouts	nothing came back for the first control code
+# shortReads	the first byte came back, but not the second of a two byte sensor
+# framing	bytes were waiting before the request was sent, i.e. a late reply
+#			to an earlier request, which would have been read as this reply
+# errors	the serial port itself failed, e.g. the adaptor was unplugged
+#
+# If too many of the last COSWORTH_ERROR_WINDOW reads fail, or the serial port
+# fails, the link is taken down and the port closed. No reads are tried
+# while it is down, so a silent ECU (e.g. ignition off) does not cost a serial
+# timeout per sensor every loop. The port is opened again after a backoff
+# delay, which doubles each time the link fails in a row, and the first read
+# after that decides whether the link is back up, or down again.
+#
+# The serial timeout of 0.1s is far longer than the ECU takes to answer;
+# at 1952 baud a byte takes around 5ms each way. Each time the link comes
+# up, every control code is sent COSWORTH_CALIBRATION_READS times and its
+# round trip timed, and reads of that code then give up after a deadline
+# based on the slowest of them, so a missing reply costs a few milliseconds
+# rather than 100. Round trips of every read are timed from then on, and
+# reported with the deadlines in link(). Where the serial adaptor supports
+# it (e.g. FTDI), its low latency mode is turned on, otherwise the adaptor
+# may hold each byte received for up to 16ms before passing it on.
+
 # Standard libraries
 import multiprocessing
+import collections
 import time
 import timeit 
 import sys
@@ -69,11 +98,11 @@ class CosworthSensors():
 		if sensorId in self.sensors.keys():
 			# Has the refresh timer expired
 			raw_v = self.sensors[sensorId].get(force = force)
-			if raw_v:
+			if raw_v is not None:
 				v = self.__translate__(sensorId, raw_v)
 			else:
 				v = raw_v
-			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : raw_v}
+			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : raw_v, 'readTime' : self.sensors[sensorId].readTime()}
 		else:
 			# Not a valid sensor
 			logger.warn("Unsupported sensor type: %s" % sensorId)
@@ -112,6 +141,26 @@ class CosworthSensors():
 		logger.info("Closing sensor module")
 		self.__disconnectECU__()
 	
+	def healthy(self):
+		""" Is the link to the ECU up """
+		
+		return self.connected and (self.link_state == "up")
+	
+	def link(self):
+		""" Link health and the error counters of every sensor, suitable for ecuData.setStatusData() """
+		
+		return {
+			'sourceId' : 'cosworthLink',
+			'state' : self.link_state,
+			'errorRate' : self.__errorRate__(),
+			'reconnects' : self.reconnects,
+			'backoff' : self.backoff,
+			'channels' : copy.deepcopy(self.channels),
+			'lowLatency' : self.low_latency,
+			'roundTrip' : self.__roundTrips__(),
+			'deadlines' : dict([("0x%02x" % code, deadline * 1000) for code, deadline in self.deadlines.items()]),
+		}
+	
 	##########################################
 	#
 	# The methods listed below should not be called directly by any external code.
@@ -150,6 +199,21 @@ class CosworthSensors():
 		self.comms_timeout = 0.1
 		self.serial = False
 		
+		# Link health, see link()
+		self.link_state = "down"
+		self.results = collections.deque(maxlen = settings.COSWORTH_ERROR_WINDOW)
+		self.channels = {}
+		self.reconnects = 0
+		self.backoff = 0
+		self.retry_time = None
+		self.up_time = None
+		
+		# Round trip times of each control code: count, total, min, max, last
+		self.round_trips = {}
+		# Read timeout of each control code, set by __calibrate__()
+		self.deadlines = {}
+		self.low_latency = False
+		
 		# Sensor types
 		self.all_sensors = {
 			'RPM': { 
@@ -274,44 +338,199 @@ class CosworthSensors():
 		self.__setSensors__()
 		self.__connectECU__()
 		if self.serial is False:
+			# Keep trying in the background
+			self.__linkDown__()
 			return None
+		# Up once the ECU answers
+		self.link_state = "probing"
 
 	def __get__(self, sensorData):
 		""" Get a single sensor value.
 		This is registered as the getter() callback in the GenericSensor class.	
 		"""
 
-		if self.connected:
-			raw_value = None
-			get_start_time = timeit.default_timer()
-
-			try:
-
-				if len(sensorData['controlCodes']) == 1:
-					self.serial.write(bytes([sensorData['controlCodes'][0]]))
-					raw_value = self.serial.read(1)[0]
-					
-				elif len(sensorData['controlCodes']) == 2:
-					[sensorData['controlCodes'][0]]
-					self.serial.write(bytes([sensorData['controlCodes'][0]]))
-					raw_value_1 = self.serial.read(1)[0]
-					self.serial.write(bytes([sensorData['controlCodes'][1]]))
-					raw_value_2 = self.serial.read(1)[0]
-					raw_value = (raw_value_1 << 8) + raw_value_2
-					
-				else:
-					logger.error("Unsupported number of control codes for sensor %s" % sensorData['sensorId'])
-					return None, None
-			except Exception as e:
-				#logger.error("Error communicating with serial port!")
-				#logger.error(e)
+		if self.connected is False:
+			self.__retry__()
+			if self.connected is False:
+				logger.debug("Serial port is not open")
 				return None, None
-		else:
-			logger.debug("Serial port is not open")
+
+		controlCodes = sensorData['controlCodes']
+		if len(controlCodes) not in (1, 2):
+			logger.error("Unsupported number of control codes for sensor %s" % sensorData['sensorId'])
 			return None, None
-		
+		channel = self.channels[sensorData['sensorId']]
+
+		raw_value = 0
+		get_start_time = timeit.default_timer()
+		try:
+			if self.serial.in_waiting > 0:
+				channel['framing'] += 1
+				self.serial.reset_input_buffer()
+			for idx, controlCode in enumerate(controlCodes):
+				deadline = self.deadlines.get(controlCode, self.comms_timeout)
+				if self.serial.timeout != deadline:
+					self.serial.timeout = deadline
+				write_time = timeit.default_timer()
+				self.serial.write(bytes([controlCode]))
+				reply = self.serial.read(1)
+				if len(reply) == 0:
+					if idx == 0:
+						channel['timeouts'] += 1
+					else:
+						channel['shortReads'] += 1
+					self.__result__(False)
+					return None, None
+				self.__roundTrip__(controlCode, timeit.default_timer() - write_time)
+				raw_value = (raw_value << 8) + reply[0]
+		except (serial.SerialException, OSError) as e:
+			channel['errors'] += 1
+			logger.error("Error communicating with ECU serial port")
+			logger.error("%s" % e)
+			self.__linkDown__()
+			return None, None
+
+		channel['reads'] += 1
+		self.__result__(True)
 		return raw_value, (timeit.default_timer() - get_start_time)
 
+	def __result__(self, ok = True):
+		""" Record the outcome of a read, and take the link down if too many have failed """
+
+		self.results.append(ok)
+		if self.link_state == "probing":
+			# The first read after reconnecting decides it
+			if ok and self.__calibrate__():
+				self.__linkUp__()
+			else:
+				self.__linkDown__()
+			return
+		if ok:
+			# Up for long enough to forget about earlier failures
+			if (self.backoff > 0) and ((timeit.default_timer() - self.up_time) > settings.COSWORTH_BACKOFF_RESET):
+				self.backoff = 0
+			return
+		if (len(self.results) >= settings.COSWORTH_ERROR_MIN) and (self.__errorRate__() >= settings.COSWORTH_ERROR_RATE):
+			logger.warn("%.0f%% of the last %s ECU reads failed" % (self.__errorRate__() * 100, len(self.results)))
+			self.__linkDown__()
+
+	def __calibrate__(self):
+		""" Time the reply to every control code, and set the read deadline of each
+		from the slowest. Returns False if the serial port fails. """
+
+		calibrate_start = timeit.default_timer()
+		controlCodes = []
+		for sensor in self.sensors.values():
+			controlCodes.extend(sensor.data()['controlCodes'])
+		unanswered = []
+		try:
+			self.serial.timeout = self.comms_timeout
+			for controlCode in controlCodes:
+				times = []
+				for i in range(settings.COSWORTH_CALIBRATION_READS):
+					self.serial.reset_input_buffer()
+					write_time = timeit.default_timer()
+					self.serial.write(bytes([controlCode]))
+					if len(self.serial.read(1)) == 0:
+						break
+					times.append(timeit.default_timer() - write_time)
+				if len(times) == 0:
+					unanswered.append(controlCode)
+					logger.warn("No reply from the ECU to control code 0x%02x" % controlCode)
+					continue
+				for t in times:
+					self.__roundTrip__(controlCode, t)
+				deadline = (max(times) * settings.COSWORTH_DEADLINE_FACTOR) + settings.COSWORTH_DEADLINE_MARGIN
+				self.deadlines[controlCode] = min(max(deadline, settings.COSWORTH_DEADLINE_MIN), self.comms_timeout)
+		except (serial.SerialException, OSError) as e:
+			logger.error("Error calibrating ECU serial link")
+			logger.error("%s" % e)
+			return False
+		# Codes which never answered wait no longer than the slowest that did
+		for controlCode in unanswered:
+			if self.deadlines:
+				self.deadlines[controlCode] = max(self.deadlines.values())
+
+		times = [stats[2] for stats in self.round_trips.values()]
+		if len(times) > 0:
+			logger.info("ECU link calibrated in %.2fs; round trip %.1fms to %.1fms, read deadlines %.1fms to %.1fms" % (
+				timeit.default_timer() - calibrate_start,
+				min(times) * 1000,
+				max([stats[3] for stats in self.round_trips.values()]) * 1000,
+				min(self.deadlines.values()) * 1000 if self.deadlines else self.comms_timeout * 1000,
+				max(self.deadlines.values()) * 1000 if self.deadlines else self.comms_timeout * 1000))
+		return True
+
+	def __roundTrip__(self, controlCode = None, t = 0):
+		""" Record the time from sending a control code to its reply """
+
+		stats = self.round_trips.get(controlCode)
+		if stats is None:
+			self.round_trips[controlCode] = [1, t, t, t, t]
+		else:
+			stats[0] += 1
+			stats[1] += t
+			stats[2] = min(stats[2], t)
+			stats[3] = max(stats[3], t)
+			stats[4] = t
+
+	def __roundTrips__(self):
+		""" Round trip times of every control code, in ms """
+
+		roundTrips = {}
+		for controlCode, stats in self.round_trips.items():
+			roundTrips["0x%02x" % controlCode] = {
+				'last' : stats[4] * 1000,
+				'min' : stats[2] * 1000,
+				'max' : stats[3] * 1000,
+				'average' : (stats[1] / stats[0]) * 1000,
+			}
+		return roundTrips
+
+	def __errorRate__(self):
+		""" Fraction of the recent reads which failed """
+
+		if len(self.results) == 0:
+			return 0
+		return self.results.count(False) / len(self.results)
+
+	def __linkUp__(self):
+
+		if self.link_state != "up":
+			logger.info("ECU link is up")
+		self.link_state = "up"
+		self.up_time = timeit.default_timer()
+		self.results.clear()
+
+	def __linkDown__(self):
+		""" Close the port, and try again after the backoff delay """
+
+		if self.backoff == 0:
+			self.backoff = settings.COSWORTH_RECONNECT_BACKOFF[0]
+		else:
+			self.backoff = min(self.backoff * 2, settings.COSWORTH_RECONNECT_BACKOFF[1])
+		self.retry_time = timeit.default_timer() + self.backoff
+		self.link_state = "down"
+		self.results.clear()
+		# Until the link is calibrated again
+		self.deadlines = {}
+		if self.serial:
+			self.__disconnectECU__()
+		logger.warn("ECU link is down, reconnecting in %ss" % self.backoff)
+
+	def __retry__(self):
+		""" Open the port again once the backoff delay has passed """
+
+		if (self.retry_time is None) or (timeit.default_timer() < self.retry_time):
+			return
+		self.retry_time = None
+		self.reconnects += 1
+		self.__connectECU__()
+		if self.connected:
+			self.link_state = "probing"
+		else:
+			self.__linkDown__()
+
 	def __translate__(self, sensorId, rawValue):
 		""" Translate a raw value from a Cosworth sensor into a real-world number """
 		
@@ -407,6 +626,7 @@ class CosworthSensors():
 				# Start timer
 				newSensor.resetTimer()
 				self.sensors[sensorId] = newSensor
+				self.channels[sensorId] = { 'reads' : 0, 'timeouts' : 0, 'shortReads' : 0, 'framing' : 0, 'errors' : 0 }
 			else:
 				logger.warn("Sensor type [%s] is unsupported for ecu [%s]" % (self.all_sensors[sensorId]['classId'], self.ecuType))
 				
@@ -432,6 +652,14 @@ class CosworthSensors():
 			)
 			logger.info("Serial interface up")
 			self.connected = True
+			if settings.COSWORTH_LOW_LATENCY:
+				try:
+					self.serial.set_low_latency_mode(True)
+					self.low_latency = True
+					logger.info("Serial adaptor low latency mode enabled")
+				except Exception as e:
+					self.low_latency = False
+					logger.info("Serial adaptor does not support low latency mode: %s" % e)
 		except Exception as e:
 			self.connected = False
 			self.serial = False
@@ -454,7 +682,14 @@ class CosworthSensors():
 			logger.warn("%s" % e)
 	
 	def __reconnectECU__(self):
-		""" Close and reconnect """
+		""" Close and reconnect straight away, without waiting for any backoff """
 		
-		self.__disconnectECU__()
+		if self.serial:
+			self.__disconnectECU__()
+		self.backoff = 0
+		self.retry_time = None
 		self.__connectECU__()
+		if self.connected:
+			self.link_state = "probing"
+		else:
+			self.__linkDown__()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Emulator - pseudo-terminal emulation of the Cosworth Pectel and AEM Wideband serial datastreams.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Use as follows:
+#
+# from iomodules.sensors.Emulator import CosworthEmulator
+#
+# emu = CosworthEmulator()
+# emu.start()
+# settings.COSWORTH_ECU_USB = emu.port()
+# ...
+# emu.stop()
+#
+# The sensor modules open emu.port() exactly as they would a real USB to
+# serial adaptor, so the whole SensorIO stack can be exercised without a car.
+
+# Standard libraries
+import os
+import sys
+import math
+import time
+import timeit
+import select
+import threading
+import tty
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+class SerialEmulator():
+	""" Base class for a pty backed serial device emulator """
+
+	#############################################
+	#
+	# Public methods
+	#
+	#############################################
+
+	def port(self):
+		""" Return the device name that a sensor module should open """
+
+		return self.slave_name
+
+	def start(self):
+		""" Start emulating the device in a background thread """
+
+		logger.info("Starting %s on [%s]" % (self.name, self.slave_name))
+		self.running = True
+		self.thread = threading.Thread(target = self.__run__, name = self.name)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		""" Stop emulating the device and close the pty """
+
+		self.running = False
+		if self.thread:
+			self.thread.join(1)
+		for fd in [self.master, self.slave]:
+			try:
+				os.close(fd)
+			except Exception as e:
+				pass
+		logger.info("Stopped %s [rx:%s tx:%s bytes]" % (self.name, self.bytes_rx, self.bytes_tx))
+
+	##########################################
+	#
+	# The methods listed below should not be called directly by any external code.
+	#
+	##########################################
+
+	def __init__(self, name = "Emulator", baud = 9600):
+
+		self.name = name
+		self.baud = baud
+		# 8 data bits, no parity, 1 stop bit, plus the start bit
+		self.byte_time = 10.0 / baud
+		self.thread = None
+		self.running = False
+		self.bytes_rx = 0
+		self.bytes_tx = 0
+		self.t_start = timeit.default_timer()
+
+		# The slave end is what the sensor module opens, we drive the master end
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave)
+		self.slave_name = os.ttyname(self.slave)
+
+	def __write__(self, data):
+		""" Write to the master end of the pty at the emulated line rate """
+
+		time.sleep(len(data) * self.byte_time)
+		os.write(self.master, data)
+		self.bytes_tx += len(data)
+
+	def __elapsed__(self):
+		""" Seconds since the emulator was created """
+
+		return timeit.default_timer() - self.t_start
+
+	def __run__(self):
+
+		pass
+
+class CosworthEmulator(SerialEmulator):
+	""" Emulates the Marelli L8/P8 datastream: one control code in, one byte out """
+
+	def __init__(self, ecuType = settings.COSWORTH_ECU_TYPE, turnaround = 0.001):
+
+		SerialEmulator.__init__(self, name = "CosworthEmulator", baud = 1952)
+
+		# Time the ECU takes between receiving a code and starting its reply
+		self.turnaround = turnaround
+		self.ecuType = ecuType
+
+		# Per control code generators returning a single byte
+		self.replies = {
+			0x80 : lambda t : (self.__rpmPeriod__(t) >> 8) & 0xff,
+			0x81 : lambda t : self.__rpmPeriod__(t) & 0xff,
+			0x82 : lambda t : self.__wave__(t, 30, 220, 4.0),
+			0x83 : lambda t : self.__wave__(t, 90, 110, 60.0),
+			0x84 : lambda t : self.__wave__(t, 150, 190, 120.0),
+			0x85 : lambda t : self.__wave__(t, 0x2a, 0xf0, 3.0),
+			0x86 : lambda t : self.__wave__(t, 20, 140, 5.0),
+			0x87 : lambda t : (self.__injector__(t) >> 8) & 0xff,
+			0x88 : lambda t : self.__injector__(t) & 0xff,
+			0x89 : lambda t : self.__wave__(t, 200, 225, 30.0),
+			0x8a : lambda t : 128,
+			0x90 : lambda t : self.__wave__(t, 0, 255, 6.0),
+		}
+
+	def __wave__(self, t, low, high, period):
+		""" A slow sine wave between two raw byte values """
+
+		return int(low + ((high - low) * (1 + math.sin((2 * math.pi * t) / period)) / 2))
+
+	def __rpm__(self, t):
+		""" Simulated engine speed, idle to near the limiter and back """
+
+		return 900 + (5600 * (1 + math.sin((2 * math.pi * t) / 8.0)) / 2)
+
+	def __rpmPeriod__(self, t):
+		""" The ECU reports crank period, see CosworthSensors.__translate__ """
+
+		return min(int(1875000 / self.__rpm__(t)), 0xffff)
+
+	def __injector__(self, t):
+
+		return self.__wave__(t, 300, 1200, 4.0)
+
+	def __run__(self):
+
+		while self.running:
+			try:
+				r, w, x = select.select([self.master], [], [], 0.1)
+				if not r:
+					continue
+				data = os.read(self.master, 64)
+			except Exception as e:
+				break
+			for code in bytearray(data):
+				self.bytes_rx += 1
+				# The control code takes a byte time to arrive at the real ECU
+				time.sleep(self.byte_time + self.turnaround)
+				if code in self.replies:
+					self.__write__(bytes([self.replies[code](self.__elapsed__())]))
+				else:
+					logger.debug("Ignoring unknown control code [0x%02x]" % code)
+
+class AEMEmulator(SerialEmulator):
+	""" Emulates an AEM X-series wideband continuously streaming AFR lines """
+
+	def __init__(self, interval = 0.05):
+
+		SerialEmulator.__init__(self, name = "AEMEmulator", baud = 9600)
+
+		# Time between each line of AFR output
+		self.interval = interval
+
+	def __run__(self):
+
+		while self.running:
+			t = self.__elapsed__()
+			afr = 14.7 + (3.0 * math.sin((2 * math.pi * t) / 5.0))
+			try:
+				self.__write__(("%.1f\r\n" % afr).encode('ascii'))
+			except Exception as e:
+				break
+			time.sleep(self.interval)
@@ -40,6 +40,8 @@ class GenericSensor():
 		
 		self.history_get_times = deque(maxlen = settings.SENSOR_MAX_HISTORY)
 		self.history_raw_values = deque(maxlen = settings.SENSOR_MAX_HISTORY)
+		# time.monotonic() of the last successful read, see libs/LatencyTrace.py
+		self.read_time = None
 		self.getter = getter
 		self.sensorData = sensorData
 	
@@ -71,9 +73,13 @@ class GenericSensor():
 		
 		if force or self.refresh():
 			raw_value, get_time = self.getter(self.sensorData)
-			if (raw_value) and (get_time):
+			# Wait another refresh interval before the next read
+			self.resetTimer()
+			# A reading of 0 is still a reading; getters return None when they fail
+			if (raw_value is not None) and (get_time is not None):
 				self.history_raw_values.append(raw_value)
 				self.history_get_times.append(get_time)
+				self.read_time = time.monotonic()
 				return self.value()
 			else:
 				return None
@@ -88,6 +94,11 @@ class GenericSensor():
 		else:
 			return None
 	
+	def readTime(self):
+		""" Return the monotonic time at which the current value was read """
+		
+		return self.read_time
+	
 	def history(self):
 		
 		return list(self.history_raw_values)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+# Replay - play back recorded DataLoggerIO logs as if they were live sensor data.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard libraries
+import time
+import timeit
+import sys
+import os
+import copy
+
+# Generic sensor class
+from iomodules.sensors.GenericSensor import GenericSensor
+
+# Seekable index of each log file
+from libs.LogIndex import LogIndex, indexFilename
+from libs.LogCompress import openLog
+from libs.SegmentLog import sessionSegments
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+class CsvLogReader():
+	""" Streams rows from a DataLoggerIO CSV file, one line at a time.
+	If the file is a segment of a logging session, the following segments
+	are read on from it. """
+
+	def __init__(self, filename = None, start = 0):
+
+		self.filename = filename
+		self.start = start
+		self.segments = sessionSegments(filename)
+		self.f = openLog(filename)
+		header = self.f.readline().decode('utf-8', 'ignore').strip().split(",")
+		# Counter,Time,<sensorId>,<sensorId>,...,
+		self.sensorIds = [s for s in header[2:] if s != ""]
+		
+		# Skip most of the way to the start time, if the logs have indexes;
+		# rows() drops anything still before it
+		if start > 0:
+			self.__seek__(start)
+
+	def rows(self):
+		""" Generator of (time, {sensorId : value}) for every row in the log from the start time """
+
+		for line in self.__lines__():
+			if line.startswith(b"#"):
+				# Block trailer
+				continue
+			fields = line.decode('utf-8', 'ignore').strip().split(",")
+			if len(fields) < 2:
+				continue
+			try:
+				t = float(fields[1])
+			except ValueError:
+				# Not a data line
+				continue
+			if t < self.start:
+				continue
+			values = {}
+			for idx in range(0, len(self.sensorIds)):
+				try:
+					values[self.sensorIds[idx]] = float(fields[idx + 2])
+				except (ValueError, IndexError):
+					values[self.sensorIds[idx]] = None
+			yield t, values
+
+	def close(self):
+
+		self.f.close()
+
+	def __seek__(self, start = 0):
+		""" Open the segment holding time 'start', at the block containing it,
+		using the indexes of the segments """
+
+		found = None
+		for idx in range(0, len(self.segments)):
+			segment = self.segments[idx]
+			if os.path.exists(indexFilename(segment)) is False:
+				continue
+			index = LogIndex(segment)
+			if len(index.times) == 0:
+				continue
+			# Every later segment starts later still
+			if index.times[0] > start:
+				break
+			found = (idx, index.seek(start))
+		if found is None:
+			return
+		idx, offset = found
+		logger.info("Seeking to %ss [offset %s] in [%s]" % (start, offset, self.segments[idx]))
+		self.f.close()
+		self.f = openLog(self.segments[idx], offset)
+		self.segments = self.segments[idx:]
+
+	def __lines__(self):
+		""" Every line of this segment, then of any segments that follow it """
+
+		for line in self.f:
+			yield line
+		for segment in self.segments[1:]:
+			self.f.close()
+			self.f = openLog(segment)
+			# Skip the header at the start of each segment
+			self.f.readline()
+			for line in self.f:
+				yield line
+
+# Log formats that can be replayed, by file suffix
+LOG_READERS = {
+	'.csv' : CsvLogReader,
+	'.gz' : CsvLogReader,
+	'.zst' : CsvLogReader,
+}
+
+class ReplaySensors():
+	""" Replay sensor retrieval class """
+
+	#############################################
+	#
+	# Public methods
+	#
+	#############################################
+
+	def available(self):
+		""" Return the list of available sensors """
+
+		return self.sensors.keys()
+
+	def data(self, sensorId):
+		""" Return sensor dictionary for a sensor id """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			return self.sensors[sensorId].data()
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def sensor(self, sensorId, force = False):
+		""" Retrieve the latest value for a sensor """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			v = self.sensors[sensorId].get(force = force)
+			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : v, 'readTime' : self.sensors[sensorId].readTime()}
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def history(self, sensorId):
+		""" Return historic sample data for a sensor """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			history = copy.copy(self.sensors[sensorId].history())
+			return history
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def performance(self, sensorId):
+		""" Return sample-time statistics for a sensor: latest, min, max and average time to get a reading """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			return self.sensors[sensorId].performance()
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def next(self):
+		""" Make the next row of the log current, if it is due yet.
+		Returns True if there is a new row to read with sensor(). """
+
+		if self.reader is None:
+			return False
+
+		if self.pending is None:
+			try:
+				self.pending = next(self.rows)
+			except StopIteration:
+				if self.loop:
+					logger.info("Replay of [%s] finished, restarting" % self.filename)
+					self.__open__()
+					return False
+				logger.info("Replay of [%s] finished" % self.filename)
+				self.close()
+				return False
+
+		t, values = self.pending
+		if self.t_log_start is None:
+			self.t_log_start = t
+			self.t_start = timeit.default_timer()
+
+		# Speed 0 means as fast as we can go, otherwise wait until
+		# the row is due at the requested multiple of real time
+		if self.speed > 0:
+			if ((t - self.t_log_start) / self.speed) > (timeit.default_timer() - self.t_start):
+				return False
+
+		self.current = values
+		self.pending = None
+		self.rows_replayed += 1
+		return True
+
+	def close(self):
+		""" Close the log file """
+
+		if self.reader:
+			self.reader.close()
+			self.reader = None
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __init__(self, filename = settings.SENSOR_REPLAY_FILE, speed = settings.SENSOR_REPLAY_SPEED, loop = settings.SENSOR_REPLAY_LOOP, start = settings.SENSOR_REPLAY_START):
+
+		logger.info("Starting Replay sensor module")
+
+		self.filename = filename
+		self.speed = speed
+		self.loop = loop
+		self.start = start
+		self.reader = None
+		self.rows = None
+		self.pending = None
+		self.current = {}
+		self.rows_replayed = 0
+		self.t_log_start = None
+		self.t_start = None
+
+		# Available sensors
+		self.sensors = {}
+
+		suffix = os.path.splitext(filename)[1]
+		if suffix not in LOG_READERS.keys():
+			logger.fatal("No log reader available for [%s] files" % suffix)
+			return None
+
+		self.__open__()
+		if self.reader:
+			logger.info("Replaying [%s] at %s" % (self.filename, ("%sx speed" % self.speed) if self.speed > 0 else "maximum speed"))
+			self.__setSensors__()
+
+	def __open__(self):
+		""" Open (or re-open) the log and reset the replay clock """
+
+		self.close()
+		try:
+			self.reader = LOG_READERS[os.path.splitext(self.filename)[1]](self.filename, start = self.start)
+			self.rows = self.reader.rows()
+		except Exception as e:
+			logger.fatal("Unable to open log [%s] for replay" % self.filename)
+			logger.fatal("%s" % e)
+			self.reader = None
+		self.pending = None
+		self.t_log_start = None
+		self.t_start = None
+
+	def __get__(self, sensorData):
+		""" Get a single sensor value from the current row.
+		This is registered as the getter() callback in the GenericSensor class.
+		"""
+
+		get_start_time = timeit.default_timer()
+		value = self.current.get(sensorData['sensorId'])
+		return value, (timeit.default_timer() - get_start_time)
+
+	def __is_connected__(self):
+
+		return self.reader is not None
+
+	def __setSensors__(self):
+		""" Set up a sensor for every column of the log """
+
+		for sensorId in self.reader.sensorIds:
+			logger.info("Adding sensor [Replay.%s]" % sensorId)
+			sensorData = {
+				'classId' : 'Replay.%s' % sensorId,
+				'sensorId' : sensorId,
+				'sensorUnit' : '',
+				'refresh' : 0,
+				'description' : 'Replayed from %s' % os.path.basename(self.filename),
+			}
+			newSensor = GenericSensor(sensorData = sensorData, getter = self.__get__)
+			newSensor.refreshTimer(0)
+			newSensor.resetTimer()
+			self.sensors[sensorId] = newSensor
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# UPS - retrieve supply and battery telemetry from the Super Watchdog V2 Raspberry Pi UPS hat.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The wdt_* functions in iomodules/watchdog/wdt open and close the I2C bus
+# for every value they read. This module opens the bus once, and reads
+# every telemetry register of the hat with a single block read each time
+# round the UPS sensors, so a full set of readings costs one bus transaction.
+#
+# Any object with the read_byte_data(), read_i2c_block_data() and close()
+# methods of smbus.SMBus can be passed in as 'bus', e.g. a stub for testing
+# away from a Pi:
+#
+# ups = UPSSensors(bus = FakeSMBus())
+
+# Standard libraries
+import multiprocessing
+import time
+import timeit
+import sys
+import os
+import copy
+
+# Generic sensor class
+from iomodules.sensors.GenericSensor import GenericSensor
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+logger = newlog(__name__)
+
+# Registers of the hat, as used by iomodules/watchdog/wdt
+UPS_VERSION_ADD = 0x00		# reads 1 on boards with battery telemetry
+UPS_BLOCK_ADD = 0x0c			# first telemetry register (V_IN_ADD)
+UPS_BLOCK_SIZE = 16			# up to and including CHARGE_STAT_ADD
+
+# Offset into the block, and length, of each sensor's register
+UPS_REGISTERS = {
+	'VIN' 		: (0x0c - UPS_BLOCK_ADD, 2),		# V_IN_ADD, mV
+	'VBAT' 		: (22 - UPS_BLOCK_ADD, 2),		# V_BAT_ADD, mV
+	'VOUT' 		: (24 - UPS_BLOCK_ADD, 2),		# V_OUT_ADD, mV
+	'UPSTEMP' 	: (26 - UPS_BLOCK_ADD, 1),		# TEMP_ADD, deg C
+	'CHARGE' 	: (27 - UPS_BLOCK_ADD, 1),		# CHARGE_STAT_ADD, low nibble
+}
+
+class UPSSensors():
+	""" UPS hat sensor retrieval class """
+
+	#############################################
+	#
+	# Public methods
+	#
+	#############################################
+
+	def available(self):
+		""" Return the list of available sensors """
+
+		return self.sensors.keys()
+
+	def data(self, sensorId):
+		""" Return sensor dictionary for a sensor id """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			return self.sensors[sensorId].data()
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def sensor(self, sensorId, force = False):
+		""" Retrieve the latest value for a sensor """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			# Has the refresh timer expired
+			raw_v = self.sensors[sensorId].get(force = force)
+			if raw_v is not None:
+				v = self.__translate__(sensorId, raw_v)
+			else:
+				v = raw_v
+			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'rawValue' : raw_v, 'readTime' : self.sensors[sensorId].readTime()}
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def history(self, sensorId):
+		""" Return historic sample data for a sensor """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			history = []
+			raw_history = self.sensors[sensorId].history()
+			for raw_v in raw_history:
+				v = self.__translate__(sensorId, raw_v)
+				history.append(v)
+			return history
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def performance(self, sensorId):
+		""" Return sample-time statistics for a sensor: latest, min, max and average time to get a reading """
+
+		# Is it a valid sensor
+		if sensorId in self.sensors.keys():
+			return self.sensors[sensorId].performance()
+		else:
+			# Not a valid sensor
+			logger.warn("Unsupported sensor type: %s" % sensorId)
+			return None
+
+	def close(self):
+		""" Disconnect the sensor and clean up any resources """
+		logger.info("Closing sensor module")
+		self.__disconnectUPS__()
+
+	##########################################
+	#
+	# The methods listed below should not be called directly by any external code.
+	#
+	##########################################
+
+	def __init__(self, bus = None):
+
+		###################################################
+		#
+		# Class variables and data structures
+		#
+		###################################################
+
+		logger.info("Starting UPS telemetry sensor module")
+
+		# Comms parameters
+		self.comms = {
+			'bus' : settings.UPS_I2C_BUS,
+			'address' : settings.UPS_I2C_ADDRESS,
+		}
+		self.bus = False
+
+		# The last block of registers read, how long it took, and the
+		# sensors which have already been given their value from it
+		self.block = None
+		self.block_time = None
+		self.consumed = set()
+		self.errors = 0
+
+		# Sensor types
+		self.all_sensors = {
+			'VIN': {
+				'classId' : 'UPS.VIN',
+				'sensorId' : 'VIN',
+				'sensorUnit' : 'v',
+				'refresh' : settings.UPS_REFRESH,
+				'description' : 'Supply voltage into the UPS hat'
+			},
+			'VBAT': {
+				'classId' : 'UPS.VBAT',
+				'sensorId' : 'VBAT',
+				'sensorUnit' : 'v',
+				'refresh' : settings.UPS_REFRESH,
+				'description' : 'UPS backup battery voltage'
+			},
+			'VOUT': {
+				'classId' : 'UPS.VOUT',
+				'sensorId' : 'VOUT',
+				'sensorUnit' : 'v',
+				'refresh' : settings.UPS_REFRESH,
+				'description' : 'Supply voltage out of the UPS hat to the Pi'
+			},
+			'UPSTEMP': {
+				'classId' : 'UPS.UPSTEMP',
+				'sensorId' : 'UPSTEMP',
+				'sensorUnit' : 'deg C.',
+				'refresh' : settings.UPS_REFRESH,
+				'description' : 'UPS hat temperature in degrees Celsius'
+			},
+			'CHARGE': {
+				'classId' : 'UPS.CHARGE',
+				'sensorId' : 'CHARGE',
+				'sensorUnit' : 'state',
+				'refresh' : settings.UPS_REFRESH,
+				'description' : 'UPS battery charge state: 0 off, 1 charged, 2 charging, 3 fault'
+			},
+		}
+
+		# Available sensors for this board
+		self.sensors = {}
+		self.connected = False
+
+		# Open a connection
+		self.__connectUPS__(bus)
+		if self.connected:
+			self.__setSensors__()
+
+	def __get__(self, sensorData):
+		""" Get a single sensor value.
+		This is registered as the getter() callback in the GenericSensor class.
+		"""
+
+		if self.connected is False:
+			logger.debug("I2C bus is not open")
+			return None, None
+
+		sensorId = sensorData['sensorId']
+
+		# A new block is read once a sensor comes round for a second time,
+		# so every sensor in a pass shares the same bus transaction
+		if (self.block is None) or (sensorId in self.consumed):
+			if self.__read__() is False:
+				return None, None
+		self.consumed.add(sensorId)
+
+		# Raw values are the register bytes, so that a reading of 0
+		# (e.g. no supply voltage) is still a valid reading
+		offset, size = UPS_REGISTERS[sensorId]
+		return bytes(self.block[offset:offset + size]), self.block_time
+
+	def __read__(self):
+		""" Read every telemetry register in one go """
+
+		get_start_time = timeit.default_timer()
+		try:
+			block = self.bus.read_i2c_block_data(self.comms['address'], UPS_BLOCK_ADD, UPS_BLOCK_SIZE)
+		except Exception as e:
+			self.errors += 1
+			logger.debug("Error reading UPS registers: %s" % e)
+			return False
+		self.block = block
+		self.block_time = timeit.default_timer() - get_start_time
+		self.consumed = set()
+		return True
+
+	def __translate__(self, sensorId, rawValue):
+		""" Translate the register bytes of a UPS sensor into a real-world number """
+
+		if sensorId in ['VIN', 'VBAT', 'VOUT']:
+			value = int.from_bytes(rawValue, 'little') / 1000.0
+		elif sensorId == 'CHARGE':
+			value = rawValue[0] & 0x0f
+		else:
+			value = rawValue[0]
+
+		return value
+
+	def __setSensors__(self):
+		""" Set up the list of sensors we can use, based on the board version """
+
+		sensorIds = list(self.all_sensors.keys())
+		sensorIds.sort()
+		for sensorId in sensorIds:
+			# Older boards only report their supply voltage
+			if (self.version != 1) and (sensorId != 'VIN'):
+				continue
+			logger.debug("Adding sensor [%s]" % self.all_sensors[sensorId]['classId'])
+			# Add a new instance of a generic sensor
+			newSensor = GenericSensor(sensorData = self.all_sensors[sensorId], getter = self.__get__)
+			# Set the refresh timer
+			newSensor.refreshTimer(self.all_sensors[sensorId]['refresh'])
+			# Start timer
+			newSensor.resetTimer()
+			self.sensors[sensorId] = newSensor
+
+	def __is_connected__(self):
+
+		return self.connected
+
+	def __connectUPS__(self, bus = None):
+		""" Open the I2C bus, and check the UPS hat is there """
+		try:
+			if bus is None:
+				logger.info("Opening I2C bus [%s] for UPS hat at [0x%02x]" % (self.comms['bus'], self.comms['address']))
+				import smbus
+				bus = smbus.SMBus(self.comms['bus'])
+			self.bus = bus
+			self.version = self.bus.read_byte_data(self.comms['address'], UPS_VERSION_ADD)
+			logger.info("UPS hat found, version [%s]" % self.version)
+			self.connected = True
+		except Exception as e:
+			self.connected = False
+			self.bus = False
+			logger.fatal("Unable to talk to the UPS hat")
+			logger.fatal("%s" % e)
+			logger.fatal("")
+			logger.fatal("Is I2C enabled?")
+			logger.fatal("Is the smbus module installed?")
+
+	def __disconnectUPS__(self):
+		""" Close the I2C bus """
+		try:
+			if self.bus:
+				self.bus.close()
+			logger.info("Closed I2C bus for UPS hat")
+			self.bus = False
+			self.connected = False
+		except Exception as e:
+			logger.warn("Unable to close I2C bus for UPS hat")
+			logger.warn("%s" % e)
@@ -69,7 +69,7 @@ class ExampleSensors():
 		if sensorId in self.sensors.keys():
 			# Has the refresh timer expired
 			v = self.sensors[sensorId].get(force = force)
-			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v }
+			return {  'sensor' : self.sensors[sensorId].data(), 'value' : v, 'readTime' : self.sensors[sensorId].readTime() }
 		else:
 			# Not a valid sensor
 			logger.warn("Unsupported sensor type: %s" % sensorId)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# AlarmEngine - evaluates alarm rules against every sample as it arrives in the main process.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Rules come from settings.ALARMS, plus one rule per sensor for its
+# 'warnValue' in settings.SENSORS if ALARM_WARN_VALUES is enabled.
+#
+# A rule is raised when all of its conditions are true at once:
+#
+# { 'alarmId' : 'LEAN_BOOST', 'message' : 'Lean on boost', 'conditions' : [
+#	{ 'sensorId' : 'MAP', 'op' : '>', 'value' : 1500 },
+#	{ 'sensorId' : 'AFR', 'op' : '>', 'value' : 13.5, 'hysteresis' : 0.3 },
+# ]}
+#
+# 'op' is one of >, >=, <, <= comparing the sensor value, or rate>, rate<
+# comparing its rate of change per second between successive reads of the
+# sensor; a sample with the same readTime as the last is a repeat of the
+# same read, and is ignored. Once true, a condition with a
+# 'hysteresis' stays true until the value has moved back past the
+# threshold by that amount, so an alarm does not flicker on and off.
+#
+# Rules are compiled once, and each condition is indexed by the sensor it
+# watches, so each sample only touches the conditions for its own sensor
+# however many rules there are. A ControlData message is sent to GraphicsIO
+# whenever a rule is raised or cleared.
+
+# Standard libraries
+import time
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Control data
+from libs.ControlData import ControlData
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# Comparison operators, and which way the hysteresis band goes for each
+ALARM_OPS = {
+	'>' 	: (lambda v, limit : v > limit, -1),
+	'>=' 	: (lambda v, limit : v >= limit, -1),
+	'<' 	: (lambda v, limit : v < limit, 1),
+	'<=' 	: (lambda v, limit : v <= limit, 1),
+}
+
+class AlarmCondition():
+	""" A single compiled comparison against one sensor """
+
+	def __init__(self, condition = None):
+
+		self.sensorId = condition['sensorId']
+		self.op = condition['op']
+		self.rate = False
+		if self.op.startswith('rate'):
+			self.rate = True
+			self.op = self.op[4:]
+		if self.op not in ALARM_OPS.keys():
+			raise ValueError("Unknown alarm condition operator [%s]" % condition['op'])
+		self.compare, direction = ALARM_OPS[self.op]
+		self.limit = condition['value']
+		# Once true, the threshold to clear the condition
+		self.clearLimit = self.limit + (direction * condition.get('hysteresis', 0))
+		self.state = False
+		self.value = None
+		self.previous = None
+		self.rules = []
+
+	def update(self, value = 0, t = 0):
+		""" Evaluate a new sample, returning True if the state of the condition changed """
+
+		if self.rate:
+			previous = self.previous
+			# A repeat of a reading already seen, or an older one
+			if (previous is not None) and (t <= previous[1]):
+				return False
+			self.previous = (value, t)
+			if previous is None:
+				return False
+			value = (value - previous[0]) / (t - previous[1])
+		self.value = value
+
+		if self.state:
+			state = self.compare(value, self.clearLimit)
+		else:
+			state = self.compare(value, self.limit)
+		if state != self.state:
+			self.state = state
+			return True
+		return False
+
+class AlarmRule():
+	""" A compiled rule; raised while all of its conditions are true """
+
+	def __init__(self, rule = None):
+
+		self.alarmId = rule['alarmId']
+		self.message = rule.get('message', rule['alarmId'])
+		self.conditions = [AlarmCondition(c) for c in rule['conditions']]
+		self.trueCount = 0
+		self.active = False
+		for c in self.conditions:
+			c.rules.append(self)
+
+	def conditionChanged(self, state = False):
+		""" Called when one of our conditions changes, returns True if the rule changed state """
+
+		if state:
+			self.trueCount += 1
+		else:
+			self.trueCount -= 1
+		active = (self.trueCount == len(self.conditions))
+		if active != self.active:
+			self.active = active
+			return True
+		return False
+
+	def payload(self):
+
+		return {
+			'status' : self.active,
+			'alarmId' : self.alarmId,
+			'description' : self.message,
+			'values' : dict([(c.sensorId, c.value) for c in self.conditions]),
+		}
+
+def warnValueRules():
+	""" A rule for every sensor with a warnValue in settings.SENSORS """
+
+	rules = []
+	for s in settings.SENSORS:
+		if s.get('warnValue') is None:
+			continue
+		rules.append({
+			'alarmId' : '%s_WARN' % s['sensorId'],
+			'message' : '%s High' % s['sensorId'],
+			'conditions' : [{
+				'sensorId' : s['sensorId'],
+				'op' : '>',
+				'value' : s['warnValue'],
+				'hysteresis' : (s['maxValue'] - s['minValue']) * settings.ALARM_WARN_HYSTERESIS,
+			}],
+		})
+	return rules
+
+class AlarmEngine():
+	""" Compiles the alarm rules and evaluates them as each sample is applied """
+
+	def __init__(self, ecuData = None, alarmQueue = None, rules = None):
+
+		self.ecuData = ecuData
+		self.alarmQueue = alarmQueue
+		self.rules = []
+		self.index = {}
+		if rules is None:
+			rules = list(settings.ALARMS)
+			if settings.ALARM_WARN_VALUES:
+				rules = warnValueRules() + rules
+		for rule in rules:
+			self.add(rule)
+		logger.info("Compiled %s alarm rules watching %s sensors" % (len(self.rules), len(self.index)))
+
+	def add(self, rule = None):
+		""" Compile a rule and index its conditions by sensorId """
+
+		try:
+			compiled = AlarmRule(rule)
+		except Exception as e:
+			logger.error("Unable to compile alarm rule [%s]" % rule.get('alarmId'))
+			logger.error("%s" % e)
+			return None
+		self.rules.append(compiled)
+		for c in compiled.conditions:
+			if c.sensorId not in self.index.keys():
+				self.index[c.sensorId] = []
+			self.index[c.sensorId].append(c)
+		return compiled
+
+	def update(self, sensorId = None, value = None, t = None):
+		""" Evaluate every condition on a sensor against its latest value; t is
+		the time.monotonic() at which the value was read by SensorIO, if known """
+
+		if sensorId not in self.index:
+			return
+		if isinstance(value, bool) or not isinstance(value, (int, float)):
+			return
+		if t is None:
+			t = time.monotonic()
+		changed = []
+		for c in self.index[sensorId]:
+			if c.update(value, t):
+				for rule in c.rules:
+					if rule.conditionChanged(c.state):
+						changed.append(rule)
+		for rule in changed:
+			self.__send__(rule)
+
+	def active(self):
+		""" Every rule which is currently raised """
+
+		return [rule for rule in self.rules if rule.active]
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __send__(self, rule = None):
+		""" Tell GraphicsIO that an alarm has been raised or cleared """
+
+		if rule.active:
+			logger.warn("Alarm raised [%s] %s" % (rule.alarmId, rule.payload()['values']))
+		else:
+			logger.info("Alarm cleared [%s]" % rule.alarmId)
+		if self.alarmQueue:
+			cdata = ControlData()
+			cdata.button = settings.STATUS_ALARM
+			cdata.destination = settings.BUTTON_DEST_GRAPHICSIO
+			cdata.setPayload(data = rule.payload())
+			self.alarmQueue.put(cdata)
+		if self.ecuData:
+			self.ecuData.setStatusData({
+				'sourceId' : 'alarms',
+				'active' : [{ 'alarmId' : r.alarmId, 'description' : r.message } for r in self.active()],
+			})
@@ -18,8 +18,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Every ControlData message is pickled to cross a multiprocessing.Queue. To
+# keep that cheap, a message is sent as a single short byte string:
+#
+# kind, destination, duration, button length, created	(struct CONTROL_HEADER)
+# button										(ascii)
+# payload										(depends on kind)
+#
+# The status payloads sent by the workers, {'status' : bool, 'description' : str},
+# are packed as a flag byte and the utf8 description. Any other payload is
+# pickled after the header as before.
+
 # Standard libraries
 import multiprocessing
+import pickle
+import struct
 import time
 import sys
 import os
@@ -33,9 +46,70 @@ if getattr(sys, 'frozen', False):
 	__file__ = os.path.dirname(sys.executable)
 logger = newlog(__file__)
 
+# Wire format of a message
+CONTROL_HEADER = struct.Struct("<BBBBd")
+PAYLOAD_NONE = 0x00
+PAYLOAD_STATUS = 0x01
+PAYLOAD_PICKLE = 0x02
+
+def encodeControlData(cdata = None):
+	""" Pack a control message into bytes. Raises ValueError if the fields
+	do not fit the compact format. """
+	
+	if cdata.button is None:
+		button = b""
+	else:
+		button = cdata.button.encode("ascii")
+	data = cdata.data
+	if data is None:
+		kind = PAYLOAD_NONE
+		payload = b""
+	elif (type(data) is dict) and (len(data) == 2) and (type(data.get('status')) is bool) and (type(data.get('description')) is str):
+		kind = PAYLOAD_STATUS
+		payload = (b"\x01" if data['status'] else b"\x00") + data['description'].encode("utf8")
+	else:
+		kind = PAYLOAD_PICKLE
+		payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+	try:
+		header = CONTROL_HEADER.pack(kind, cdata.destination, cdata.duration, len(button), cdata.created)
+	except struct.error as e:
+		raise ValueError("%s" % e)
+	return header + button + payload
+
+def decodeControlData(message = b""):
+	""" Unpack a control message created by encodeControlData() """
+	
+	kind, destination, duration, buttonLength, created = CONTROL_HEADER.unpack_from(message)
+	offset = CONTROL_HEADER.size
+	cdata = ControlData.__new__(ControlData)
+	cdata.created = created
+	cdata.destination = destination
+	cdata.duration = duration
+	if buttonLength > 0:
+		cdata.button = message[offset:offset + buttonLength].decode("ascii")
+	else:
+		cdata.button = None
+	offset += buttonLength
+	if kind == PAYLOAD_STATUS:
+		cdata.data = {'status' : message[offset] == 1, 'description' : message[offset + 1:].decode("utf8")}
+	elif kind == PAYLOAD_PICKLE:
+		cdata.data = pickle.loads(message[offset:])
+	else:
+		cdata.data = None
+	return cdata
+
+def restoreControlData(fields = None):
+	""" Recreate a control message pickled field by field """
+	
+	cdata = ControlData.__new__(ControlData)
+	cdata.created, cdata.button, cdata.duration, cdata.destination, cdata.data = fields
+	return cdata
+
 class ControlData():
 	""" Control data class """
 	
+	__slots__ = ('created', 'button', 'duration', 'destination', 'data')
+	
 	def __init__(self):
 		""" Initialise a new control data class """
 		self.created = time.time()
@@ -80,6 +154,19 @@ class ControlData():
 			else:
 				self.destination = settings.BUTTON_DEST_ALL
 	
+	def encode(self):
+		""" This message as bytes, see encodeControlData() """
+		
+		return encodeControlData(self)
+	
+	def __reduce__(self):
+		""" Pickle as the compact encoding, or field by field if it does not fit """
+		
+		try:
+			return (decodeControlData, (encodeControlData(self),))
+		except (ValueError, UnicodeError, AttributeError) as e:
+			return (restoreControlData, ((self.created, self.button, self.duration, self.destination, self.data),))
+	
 	def isMine(self, my_destination = None):
 		""" Is this message for us? """
 		if my_destination:
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# DerivedSensors - virtual sensor channels calculated from the values of other sensors.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Derived sensors are defined in settings.DERIVED_SENSORS:
+#
+# { 'sensorId' : 'BOOST', 'expression' : '(MAP - BARO) / 1000.0', 'sensorUnit' : 'bar', ... }
+#
+# The expression is a Python expression using the sensorIds of other
+# sensors (including other derived sensors), names from
+# settings.DERIVED_CONSTANTS and the functions in DERIVED_FUNCTIONS.
+#
+# Expressions are compiled once. When a sample arrives in the main process,
+# only the derived sensors which use that sensor are recalculated, and only
+# if its value has actually changed. The results are stored in ecuData just
+# like the value of any other sensor, so displays and logs need nothing extra.
+
+# Standard libraries
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# The only functions an expression may call
+DERIVED_FUNCTIONS = {
+	'abs' : abs,
+	'min' : min,
+	'max' : max,
+	'round' : round,
+}
+
+# Expressions get no other builtins
+DERIVED_GLOBALS = { '__builtins__' : {} }
+DERIVED_GLOBALS.update(DERIVED_FUNCTIONS)
+
+class DerivedSensor():
+	""" A single compiled derived sensor """
+
+	def __init__(self, definition = None, knownIds = []):
+
+		self.sensorId = definition['sensorId']
+		self.expression = definition['expression']
+		self.definition = definition
+		self.code = compile(self.expression, "<derived %s>" % self.sensorId, "eval")
+		self.inputs = []
+		for name in self.code.co_names:
+			if name in DERIVED_FUNCTIONS.keys() or name in settings.DERIVED_CONSTANTS.keys():
+				continue
+			if name not in knownIds:
+				raise ValueError("Unknown name [%s] in expression for %s" % (name, self.sensorId))
+			self.inputs.append(name)
+		self.value = None
+
+	def evaluate(self, namespace = None):
+		""" Calculate the value, or None if an input is missing or the expression fails """
+
+		for sensorId in self.inputs:
+			if namespace.get(sensorId) is None:
+				return None
+		try:
+			return eval(self.code, DERIVED_GLOBALS, namespace)
+		except (ArithmeticError, ValueError, TypeError):
+			return None
+
+	def sensorData(self):
+		""" A sensor dictionary in the same form as a sensor backend would return """
+
+		return {
+			'classId' : 'Derived.%s' % self.sensorId,
+			'sensorId' : self.sensorId,
+			'sensorUnit' : self.definition.get('sensorUnit', ''),
+			'refresh' : 0,
+			'description' : self.definition.get('description', self.expression),
+		}
+
+class DerivedSensors():
+	""" Compiles settings.DERIVED_SENSORS and recalculates them as their inputs change """
+
+	def __init__(self, definitions = None):
+
+		if definitions is None:
+			definitions = settings.DERIVED_SENSORS
+		self.sensors = {}
+		self.index = {}
+		# The latest value of every input, plus the constants
+		self.values = dict(settings.DERIVED_CONSTANTS)
+
+		knownIds = [s['sensorId'] for s in settings.SENSORS]
+		for definition in definitions:
+			try:
+				derived = DerivedSensor(definition, knownIds)
+			except Exception as e:
+				logger.error("Unable to compile derived sensor [%s]" % definition.get('sensorId'))
+				logger.error("%s" % e)
+				continue
+			logger.info("Adding sensor [Derived.%s] = %s" % (derived.sensorId, derived.expression))
+			self.sensors[derived.sensorId] = derived
+			for sensorId in derived.inputs:
+				if sensorId not in self.index.keys():
+					self.index[sensorId] = []
+				self.index[sensorId].append(derived)
+
+	def available(self):
+		""" Return the list of derived sensors """
+
+		return self.sensors.keys()
+
+	def isDerived(self, sensorId = None):
+
+		return sensorId in self.sensors
+
+	def data(self, sensorId = None):
+		""" Return sensor dictionary for a derived sensor """
+
+		return self.sensors[sensorId].sensorData()
+
+	def update(self, sensorId = None, value = None, depth = 0):
+		""" Record a new sensor value. Returns a list of (sensorId, value) for every
+		derived sensor whose value changed as a result. """
+
+		changed = []
+		if (sensorId not in self.index) or (self.values.get(sensorId) == value):
+			self.values[sensorId] = value
+			return changed
+		self.values[sensorId] = value
+
+		for derived in self.index[sensorId]:
+			derivedValue = derived.evaluate(self.values)
+			if derivedValue is None or derivedValue == derived.value:
+				continue
+			derived.value = derivedValue
+			changed.append((derived.sensorId, derivedValue))
+			# Derived sensors may themselves be the input of others
+			if depth < len(self.sensors):
+				changed += self.update(derived.sensorId, derivedValue, depth + 1)
+		return changed
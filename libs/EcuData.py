@@ -38,7 +38,9 @@ class EcuData():
 		ecuErrors = None, 
 		ecuSampleTime = None, 
 		ecuMatrixLCDDict = None,
-		ecuStatusDict = None):
+		ecuStatusDict = None,
+		ecuPeakDict = None,
+		ecuStatusBlock = None):
 		""" Initialise the class with the shared data manager dictionary """
 		
 		self.data = ecuDataDict
@@ -47,11 +49,14 @@ class EcuData():
 		self.counter = ecuCounter
 		self.timer = ecuSampleTime
 		self.status = ecuStatusDict
+		self.peaks = ecuPeakDict
+		# Shared memory status flags, see libs/StatusBlock.py
+		self.statusBlock = ecuStatusBlock
 		
 		# Initialise sensor values structure
 		for sensor in settings.SENSORS:
-			# value, sample time, counter
-			self.data[sensor['sensorId']] = (0,0,0)
+			# value, sample time, counter, latency trace, unfiltered value
+			self.data[sensor['sensorId']] = (0,0,0,None,None)
 		
 		# Store error codes as they occur
 		self.errors_ = []
@@ -64,15 +69,17 @@ class EcuData():
 		
 		self.errors_.append(errortext)
 	
-	def setData(self, sensorId = None, value = 0, sampletime = 0, counter = 0):
-		""" Set the latest value for a sensor """
+	def setData(self, sensorId = None, value = 0, sampletime = 0, counter = 0, trace = None, unfilteredValue = None):
+		""" Set the latest value for a sensor, trace is the tuple of timestamps from libs/LatencyTrace.py,
+		unfilteredValue is the reading before it was smoothed by libs/SensorFilters.py """
 		
 		self.counter.value = counter
 		if sensorId in self.data.keys():
-			self.data[sensorId] = (value, sampletime, counter)
+			self.data[sensorId] = (value, sampletime, counter, trace, unfilteredValue)
 			
 	
-	def getData(self, sensorId = None, allData = False):
+	def getData(self, sensorId = None, allData = False, raw = False):
+		""" Latest value of a sensor, or its unfiltered value if raw is set """
 		
 		if sensorId in self.data.keys():
 			if len(self.data[sensorId]) > 0:
@@ -80,6 +87,8 @@ class EcuData():
 				if self.data[sensorId][0] is not None:
 					if allData:
 						return self.data[sensorId]
+					elif raw and (self.data[sensorId][4] is not None):
+						return self.data[sensorId][4]
 					else:
 						v = self.data[sensorId][0]
 						return v
@@ -98,6 +107,11 @@ class EcuData():
 		else:
 			return None
 	
+	def getAllSensorData(self):
+		""" Sensor dictionaries of every sensor, in a single read of the shared dictionary """
+		
+		return self.sensor.copy()
+	
 	def setSensorData(self, sensorData = None):
 		
 		mapped = False
@@ -121,6 +135,38 @@ class EcuData():
 		sourceId = statusData['sourceId']
 		self.status[sourceId] = statusData
 	
+	def getStatusData(self, sourceId = None):
+		
+		if sourceId in self.status.keys():
+			return self.status[sourceId]
+		else:
+			return None
+	
+	def getAllStatusData(self):
+		""" Status data of every source, in a single read of the shared dictionary """
+		
+		return self.status.copy()
+	
+	def setPeakData(self, sensorId = None, peakData = None):
+		""" Set the peak values of a sensor, see libs/PeakTracker.py """
+		
+		if self.peaks is not None:
+			self.peaks[sensorId] = peakData
+	
+	def getPeakData(self, sensorId = None):
+		
+		if (self.peaks is not None) and (sensorId in self.peaks.keys()):
+			return self.peaks[sensorId]
+		else:
+			return None
+	
+	def getAllPeakData(self):
+		""" Peak values of every sensor, in a single read of the shared dictionary """
+		
+		if self.peaks is None:
+			return {}
+		return self.peaks.copy()
+	
 	def setCounter(self, counter):
 		""" Set counter """
 		
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# LatencyTrace - per-stage latency histograms for samples travelling from the serial port to the screen.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every sample carries a trace; a tuple of time.monotonic() timestamps that
+# grows by one entry at each hop of the pipeline:
+#
+# TRACE_READ			GenericSensor.get() received the value from the sensor
+# TRACE_ENQUEUE		SensorIO put the sample on the data queue
+# TRACE_APPLY			the main process stored it with ecuData.setData()
+# TRACE_GFX_READ		GraphicsIO read it back out of ecuData
+# TRACE_DISPLAYED		updateOLEDScreen()/updateSDLWindow() returned
+#
+# time.monotonic() is used, rather than timeit.default_timer(), as it is the
+# same clock in every process, so timestamps can be compared across workers.
+
+# Standard libraries
+import time
+import json
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+TRACE_READ = 0
+TRACE_ENQUEUE = 1
+TRACE_APPLY = 2
+TRACE_GFX_READ = 3
+TRACE_DISPLAYED = 4
+
+# Names of each hop, between one trace timestamp and the next
+TRACE_STAGES = [
+	'read->enqueue',
+	'enqueue->apply',
+	'apply->gfx_read',
+	'gfx_read->displayed',
+]
+
+# Upper edge, in milliseconds, of each histogram bucket. Anything slower
+# than the last edge is counted in a final overflow bucket.
+TRACE_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+def traceStamp(trace = None):
+	""" Return a trace extended with the current time """
+
+	if trace is None:
+		return (time.monotonic(),)
+	return tuple(trace) + (time.monotonic(),)
+
+class LatencyHistogram():
+	""" A fixed bucket latency histogram with running min/max/mean """
+
+	def __init__(self, buckets = TRACE_BUCKETS_MS):
+
+		self.buckets = buckets
+		self.reset()
+
+	def reset(self):
+
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, ms):
+		""" Record a single latency, in milliseconds """
+
+		idx = 0
+		for edge in self.buckets:
+			if ms <= edge:
+				break
+			idx += 1
+		self.counts[idx] += 1
+		self.count += 1
+		self.total += ms
+		if (self.min is None) or (ms < self.min):
+			self.min = ms
+		if (self.max is None) or (ms > self.max):
+			self.max = ms
+
+	def percentile(self, p):
+		""" Approximate percentile, as the upper edge of the bucket it falls into """
+
+		if self.count == 0:
+			return 0
+		target = (p / 100.0) * self.count
+		running = 0
+		for idx in range(0, len(self.counts)):
+			running += self.counts[idx]
+			if running >= target:
+				if idx < len(self.buckets):
+					return min(self.buckets[idx], self.max)
+				return self.max
+		return self.max
+
+	def summary(self):
+
+		if self.count == 0:
+			return { 'count' : 0 }
+		return {
+			'count' : self.count,
+			'min' : self.min,
+			'max' : self.max,
+			'average' : self.total / self.count,
+			'p50' : self.percentile(50),
+			'p90' : self.percentile(90),
+			'p99' : self.percentile(99),
+			'buckets' : dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts)),
+		}
+
+class LatencyTracer():
+	""" Aggregates complete sample traces into one histogram per pipeline hop """
+
+	def __init__(self):
+
+		self.stages = {}
+		for stage in TRACE_STAGES:
+			self.stages[stage] = LatencyHistogram()
+		self.stages['total'] = LatencyHistogram()
+		self.t_start = time.monotonic()
+
+	def record(self, trace = None):
+		""" Record the hop latencies from a trace, however far it got """
+
+		if not trace:
+			return
+		for idx in range(1, min(len(trace), len(TRACE_STAGES) + 1)):
+			self.stages[TRACE_STAGES[idx - 1]].add((trace[idx] - trace[idx - 1]) * 1000)
+		if len(trace) > 1:
+			self.stages['total'].add((trace[-1] - trace[0]) * 1000)
+
+	def summary(self):
+		""" All of the histograms as a dictionary, suitable for ecuData.setStatusData() """
+
+		stats = {
+			'sourceId' : 'latency',
+			'period' : time.monotonic() - self.t_start,
+			'stages' : {},
+		}
+		for stage in self.stages.keys():
+			stats['stages'][stage] = self.stages[stage].summary()
+		return stats
+
+	def dump(self, filename = None):
+		""" Write the current histograms to disk as JSON """
+
+		try:
+			dirname = os.path.dirname(filename)
+			if dirname and (os.path.exists(dirname) is False):
+				os.makedirs(dirname)
+			with open(filename, 'w') as f:
+				json.dump(self.summary(), f, indent = 1, sort_keys = True)
+			return True
+		except Exception as e:
+			logger.error("Unable to write latency dump [%s]" % filename)
+			logger.error("%s" % e)
+			return False
+
+	def show(self):
+		""" Print a one line summary of each hop """
+
+		for stage in TRACE_STAGES + ['total']:
+			s = self.stages[stage].summary()
+			if s['count'] > 0:
+				logger.info("Latency %20s: n=%6d avg=%8.3fms p50=%8.3fms p99=%8.3fms max=%8.3fms" % (stage, s['count'], s['average'], s['p50'], s['p99'], s['max']))
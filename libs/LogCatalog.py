@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+# LogCatalog - a persistent list of every logging session in the log directory.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The catalog lives in LOGGING_DIR as two small files:
+#
+# catalog.json		one entry per logging session:
+#
+#	{"sessions": {"7": {"session": 7, "status": "closed", "start": 1538300000.0,
+#		"duration": 1234.5, "segments": 3, "size": 1048576,
+#		"sensorIds": ["AFR", "RPM", ...], "peaks": {"RPM": 6100, ...}}, ...}}
+#
+# catalog.next		the next free session number
+#
+# so that starting a new session never has to list the log directory. Both
+# are replaced atomically, under a lock, as DataLoggerIO and LogCompressorIO
+# each update the catalog. If the catalog is missing or damaged it is rebuilt
+# from the log files and their indexes.
+
+# Standard libraries
+import fcntl
+import json
+import time
+import sys
+import os
+import re
+
+# Settings file
+from libs import settings
+
+# Log segments and their indexes
+from libs.SegmentLog import segmentFilename, findSegment, syncFile
+from libs.LogIndex import LogIndex, indexFilename
+from libs.LogCompress import mapFilename
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# Session status
+SESSION_RECORDING = "recording"
+SESSION_CLOSED = "closed"
+
+def sessionFiles(session = 0):
+	""" Every file belonging to a logging session: segments, indexes and block maps """
+
+	files = []
+	segment = 0
+	filename = findSegment(session, segment)
+	if filename is None:
+		# A log from before logs were split into segments
+		filename = os.path.join(settings.LOGGING_DIR, "%s%03d%s" % (settings.LOGGING_FILE_PREFIX, session, settings.LOGGING_FILE_SUFFIX))
+		if os.path.exists(filename) is False:
+			return files
+		files.append(filename)
+	while filename:
+		for f in [filename, indexFilename(filename), mapFilename(filename)]:
+			if os.path.exists(f) and (f not in files):
+				files.append(f)
+		segment += 1
+		filename = findSegment(session, segment)
+	return files
+
+def sessionSize(session = 0):
+	""" Bytes used on disk by a logging session """
+
+	return sum([os.path.getsize(f) for f in sessionFiles(session) if os.path.exists(f)])
+
+def scanSession(session = 0):
+	""" Build a catalog entry for a session from its files on disk """
+
+	files = sessionFiles(session)
+	entry = {
+		'session' : session,
+		'status' : SESSION_CLOSED,
+		'start' : 0,
+		'duration' : 0,
+		'segments' : len([f for f in files if f.endswith(settings.LOGGING_INDEX_SUFFIX)]),
+		'size' : sum([os.path.getsize(f) for f in files]),
+		'sensorIds' : [],
+		'peaks' : {},
+	}
+	for f in files:
+		if f.endswith(settings.LOGGING_INDEX_SUFFIX):
+			try:
+				index = LogIndex(f)
+			except Exception as e:
+				logger.warn("Unable to read index [%s]" % f)
+				continue
+			entry['sensorIds'] = index.sensorIds
+			for block in index.blocks:
+				entry['duration'] = max(entry['duration'], block['t1'])
+				for sensorId in block['max'].keys():
+					if (sensorId not in entry['peaks']) or (block['max'][sensorId] > entry['peaks'][sensorId]):
+						entry['peaks'][sensorId] = block['max'][sensorId]
+	if len(files) > 0:
+		# Best guess, from when the session was last written to
+		entry['start'] = max([os.path.getmtime(f) for f in files]) - entry['duration']
+	return entry
+
+class LogCatalog():
+	""" Records every logging session, and hands out new session numbers """
+
+	def __init__(self, logDir = settings.LOGGING_DIR):
+
+		self.logDir = logDir
+		self.filename = os.path.join(logDir, settings.LOGGING_CATALOG_FILE)
+		self.nextFilename = os.path.splitext(self.filename)[0] + ".next"
+		self.lockFilename = os.path.splitext(self.filename)[0] + ".lock"
+		if os.path.exists(logDir) is False:
+			logger.info("Log directory [%s] is missing, creating..." % logDir)
+			os.makedirs(logDir, mode = 0o775)
+		if os.path.exists(self.filename) is False:
+			self.__locked__(self.rebuild)
+
+	def newSession(self, sensorIds = [], start = None):
+		""" Reserve the next session number and record the session as started """
+
+		def new():
+			catalog = self.__load__()
+			session = self.__readNext__()
+			if session is None:
+				# The counter has been lost, carry on from the newest session recorded
+				session = max([int(k) for k in catalog['sessions'].keys()] + [-1]) + 1
+				logger.warn("Log catalog counter [%s] is missing, next session is %s" % (self.nextFilename, session))
+			self.__writeNext__(session + 1)
+			catalog['sessions'][str(session)] = {
+				'session' : session,
+				'status' : SESSION_RECORDING,
+				'start' : start or time.time(),
+				'duration' : 0,
+				'segments' : 0,
+				'size' : 0,
+				'sensorIds' : list(sensorIds),
+				'peaks' : {},
+			}
+			self.__save__(catalog)
+			return session
+		return self.__locked__(new)
+
+	def updateSession(self, session = 0, **fields):
+		""" Change some of the details recorded for a session """
+
+		def update():
+			catalog = self.__load__()
+			if str(session) in catalog['sessions'].keys():
+				catalog['sessions'][str(session)].update(fields)
+				self.__save__(catalog)
+		self.__locked__(update)
+
+	def closeSession(self, session = 0, **fields):
+		""" Record the final details of a session once it has been written """
+
+		fields['status'] = SESSION_CLOSED
+		self.updateSession(session, **fields)
+
+	def removeSession(self, session = 0):
+		""" Forget a session whose files have been deleted """
+
+		def remove():
+			catalog = self.__load__()
+			if str(session) in catalog['sessions'].keys():
+				del catalog['sessions'][str(session)]
+				self.__save__(catalog)
+		self.__locked__(remove)
+
+	def sessions(self):
+		""" Every session, oldest first """
+
+		catalog = self.__locked__(self.__load__)
+		return [catalog['sessions'][k] for k in sorted(catalog['sessions'].keys(), key = int)]
+
+	def session(self, session = 0):
+		""" The catalog entry for one session, or None """
+
+		catalog = self.__locked__(self.__load__)
+		return catalog['sessions'].get(str(session))
+
+	def rebuild(self):
+		""" Recreate the catalog from the files in the log directory. Must be called with the lock held. """
+
+		logger.warn("Rebuilding log catalog [%s]" % self.filename)
+		reMatch = r'^%s([0-9]+)[_.]' % re.escape(settings.LOGGING_FILE_PREFIX)
+		sessions = set()
+		for f in os.listdir(self.logDir):
+			m = re.match(reMatch, f)
+			if m:
+				sessions.add(int(m.group(1)))
+		catalog = { 'sessions' : {} }
+		for session in sorted(sessions):
+			catalog['sessions'][str(session)] = scanSession(session)
+		self.__save__(catalog)
+		nextSession = 0
+		if len(sessions) > 0:
+			nextSession = max(sessions) + 1
+		self.__writeNext__(max(nextSession, self.__readNext__() or 0))
+		logger.info("Log catalog rebuilt with %s sessions" % len(sessions))
+		return catalog
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __locked__(self, function):
+		""" Run a function with exclusive access to the catalog """
+
+		with open(self.lockFilename, 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				return function()
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def __load__(self):
+
+		try:
+			with open(self.filename, 'r') as f:
+				return json.load(f)
+		except Exception as e:
+			logger.error("Unable to read log catalog [%s]" % self.filename)
+			logger.error("%s" % e)
+			return self.rebuild()
+
+	def __save__(self, catalog = None):
+
+		self.__replace__(self.filename, json.dumps(catalog, indent = 1, sort_keys = True))
+
+	def __readNext__(self):
+		""" The next free session number, or None if the counter is missing or damaged """
+
+		try:
+			with open(self.nextFilename, 'r') as f:
+				return int(f.read().strip())
+		except Exception as e:
+			return None
+
+	def __writeNext__(self, session = 0):
+
+		self.__replace__(self.nextFilename, "%d\n" % session)
+
+	def __replace__(self, filename = None, data = ""):
+		""" Write a file, synced to disk, replacing the old copy in one step """
+
+		tmpFilename = filename + ".tmp"
+		with open(tmpFilename, 'w') as f:
+			f.write(data)
+			f.flush()
+			syncFile(f.fileno())
+		os.replace(tmpFilename, filename)
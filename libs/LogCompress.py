@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# LogCompress - block compressed log segments which can still be read from any point.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A closed log segment 'pycosworth_007_0003.csv' is compressed by
+# LogCompressorIO into 'pycosworth_007_0003.csv.gz' (or '.csv.zst').
+#
+# Each block of the segment is compressed on its own, as a separate gzip
+# member or zstd frame, one after another in the same file. Standard tools
+# (zcat, zstdcat) still decompress the whole file in one go.
+#
+# A map sidecar 'pycosworth_007_0003.map' records where each block lives:
+#
+# {"format": "gzip", "chunks": [[raw offset, raw end, compressed offset, compressed length], ...]}
+#
+# so that, along with the log index, a reader can decompress only the
+# blocks it needs. The decompressed data is byte-for-byte the original
+# segment, so offsets in the log index remain valid.
+
+# Standard libraries
+import bisect
+import gzip
+import json
+import sys
+import os
+import io
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# zstd is optional, gzip is always available
+try:
+	import zstandard
+	USE_ZSTD = True
+except Exception as e:
+	USE_ZSTD = False
+
+# Suffix of the compressed file, for each format
+COMPRESS_SUFFIXES = {
+	'gzip' : '.gz',
+	'zstd' : '.zst',
+}
+
+# Sidecar holding the position of each compressed block
+MAP_SUFFIX = ".map"
+
+def compressFormat():
+	""" The compression format to use, falling back to gzip if zstd is unavailable """
+
+	if (settings.LOGGING_COMPRESS_FORMAT == 'zstd') and (USE_ZSTD is False):
+		logger.warn("zstd compression requested, but the zstandard library is not installed, using gzip")
+		return 'gzip'
+	if settings.LOGGING_COMPRESS_FORMAT not in COMPRESS_SUFFIXES.keys():
+		return 'gzip'
+	return settings.LOGGING_COMPRESS_FORMAT
+
+def isCompressed(filename = None):
+	""" Is this a compressed log file """
+
+	for suffix in COMPRESS_SUFFIXES.values():
+		if filename.endswith(suffix):
+			return True
+	return False
+
+def rawFilename(filename = None):
+	""" The name of a log file before it was compressed """
+
+	for suffix in COMPRESS_SUFFIXES.values():
+		if filename.endswith(suffix):
+			return filename[:-len(suffix)]
+	return filename
+
+def mapFilename(filename = None):
+	""" The name of the block map sidecar of a log file """
+
+	return os.path.splitext(rawFilename(filename))[0] + MAP_SUFFIX
+
+def compressBlock(data = b"", fmt = 'gzip'):
+	""" Compress one block as a self contained gzip member or zstd frame """
+
+	if fmt == 'zstd':
+		return zstandard.ZstdCompressor(level = settings.LOGGING_COMPRESS_LEVEL).compress(data)
+	return gzip.compress(data, compresslevel = settings.LOGGING_COMPRESS_LEVEL)
+
+def openLog(filename = None, offset = 0):
+	""" Open a log, compressed or not, as a binary stream starting at
+	byte 'offset' of the uncompressed data """
+
+	if isCompressed(filename) is False:
+		f = open(filename, 'rb')
+		if offset > 0:
+			f.seek(offset)
+		return f
+
+	# Start decompressing at the block containing the offset
+	chunk = [0, 0, 0, 0]
+	if offset > 0:
+		with open(mapFilename(filename), 'r') as m:
+			chunks = json.load(m)['chunks']
+		idx = bisect.bisect_right([c[0] for c in chunks], offset) - 1
+		if idx >= 0:
+			chunk = chunks[idx]
+
+	f = open(filename, 'rb')
+	f.seek(chunk[2])
+	if filename.endswith(COMPRESS_SUFFIXES['zstd']):
+		stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames = True, closefd = True))
+	else:
+		stream = gzip.GzipFile(fileobj = f, mode = 'rb')
+		# GzipFile does not close a file object it was given
+		stream.myfileobj = f
+
+	# Skip forward to the offset within the block
+	skip = offset - chunk[0]
+	while skip > 0:
+		data = stream.read(min(skip, 65536))
+		if not data:
+			break
+		skip -= len(data)
+	return stream
+
+def readRange(filename = None, offset = 0, end = 0):
+	""" Read bytes 'offset' to 'end' of the uncompressed data of a log """
+
+	f = openLog(filename, offset)
+	try:
+		return f.read(end - offset)
+	finally:
+		f.close()
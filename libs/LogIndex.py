@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# LogIndex - a sidecar index of time checkpoints and per-block min/max values for DataLoggerIO logs.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every log file 'pycosworth_NNN.csv' gets a sidecar 'pycosworth_NNN.idx'.
+#
+# The first line of the index is a JSON header naming the log and its sensors,
+# then one JSON line is appended for every block of LOGGING_INDEX_BLOCK_ROWS
+# rows of the log:
+#
+# {"offset": 1234, "end": 5678, "t0": 10.1, "t1": 15.0, "rows": 50,
+#  "min": {"RPM": 900, ...}, "max": {"RPM": 6100, ...}}
+#
+# 'offset' and 'end' are byte positions in the log, so a reader can seek
+# straight to a time, or to only those blocks where a sensor went above a
+# value, without parsing the rest of the file.
+
+# Standard libraries
+import bisect
+import json
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Reading from compressed logs
+from libs.LogCompress import rawFilename, readRange
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+def indexFilename(logFilename = None):
+	""" The name of the index sidecar for a log file """
+
+	return os.path.splitext(rawFilename(logFilename))[0] + settings.LOGGING_INDEX_SUFFIX
+
+def truncateIndex(logFilename = None, size = 0):
+	""" Drop any index entries which refer to data beyond 'size' bytes of the log,
+	for when a log has been truncated during recovery """
+
+	filename = indexFilename(logFilename)
+	if os.path.exists(filename) is False:
+		return 0
+	keep = []
+	dropped = 0
+	with open(filename, 'r') as f:
+		keep.append(f.readline())
+		for line in f:
+			try:
+				if json.loads(line)['end'] <= size:
+					keep.append(line)
+					continue
+			except (ValueError, KeyError):
+				pass
+			dropped += 1
+	if dropped > 0:
+		with open(filename, 'w') as f:
+			f.write("".join(keep))
+		logger.warn("Dropped %s index entries beyond the end of [%s]" % (dropped, logFilename))
+	return dropped
+
+class LogIndexWriter():
+	""" Builds the index incrementally, as each line is written to the log """
+
+	def __init__(self, logFilename = None, sensorIds = []):
+
+		self.filename = indexFilename(logFilename)
+		self.sensorIds = list(sensorIds)
+		self.block = None
+		self.f = open(self.filename, 'w')
+		header = {
+			'log' : os.path.basename(logFilename),
+			'sensorIds' : self.sensorIds,
+			'blockRows' : settings.LOGGING_INDEX_BLOCK_ROWS,
+		}
+		self.f.write(json.dumps(header) + "\n")
+		self.f.flush()
+
+	def add(self, offset = 0, end = 0, t = 0, values = []):
+		""" Add a log line, starting at byte 'offset' and finishing before byte 'end',
+		with 'values' in the same order as sensorIds """
+
+		if self.block is None:
+			self.block = {
+				'offset' : offset,
+				't0' : t,
+				'rows' : 0,
+				'min' : {},
+				'max' : {},
+			}
+		b = self.block
+		b['end'] = end
+		b['t1'] = t
+		b['rows'] += 1
+		for idx in range(0, len(self.sensorIds)):
+			v = values[idx]
+			if isinstance(v, (int, float)) and not isinstance(v, bool):
+				sensorId = self.sensorIds[idx]
+				if (sensorId not in b['min']) or (v < b['min'][sensorId]):
+					b['min'][sensorId] = v
+				if (sensorId not in b['max']) or (v > b['max'][sensorId]):
+					b['max'][sensorId] = v
+		if b['rows'] >= settings.LOGGING_INDEX_BLOCK_ROWS:
+			self.flush()
+
+	def flush(self):
+		""" Write out the current block, even if it is not yet full """
+
+		if self.block:
+			self.f.write(json.dumps(self.block, sort_keys = True) + "\n")
+			self.f.flush()
+			self.block = None
+
+	def close(self):
+
+		self.flush()
+		self.f.close()
+
+class LogIndex():
+	""" Reads an index sidecar to seek around a log without scanning it """
+
+	def __init__(self, logFilename = None):
+
+		self.logFilename = logFilename
+		self.filename = indexFilename(logFilename)
+		self.sensorIds = []
+		self.blocks = []
+		self.times = []
+		self.load()
+
+	def load(self):
+		""" Load the index from disk; a truncated last line is ignored """
+
+		self.blocks = []
+		with open(self.filename, 'r') as f:
+			header = json.loads(f.readline())
+			self.sensorIds = header['sensorIds']
+			for line in f:
+				try:
+					self.blocks.append(json.loads(line))
+				except ValueError:
+					logger.warn("Ignoring damaged index entry in [%s]" % self.filename)
+		self.times = [b['t0'] for b in self.blocks]
+
+	def seek(self, t = 0):
+		""" Return the byte offset of the block containing time 't' """
+
+		if len(self.blocks) == 0:
+			return None
+		idx = bisect.bisect_right(self.times, t) - 1
+		if idx < 0:
+			idx = 0
+		return self.blocks[idx]['offset']
+
+	def blocksAbove(self, sensorId = None, value = None):
+		""" All blocks in which a sensor exceeded a value; warnValue from settings.SENSORS if not given """
+
+		if value is None:
+			value = self.__warnValue__(sensorId)
+			if value is None:
+				return []
+		return [b for b in self.blocks if (sensorId in b['max']) and (b['max'][sensorId] > value)]
+
+	def blocksBelow(self, sensorId = None, value = None):
+		""" All blocks in which a sensor fell below a value """
+
+		return [b for b in self.blocks if (sensorId in b['min']) and (b['min'][sensorId] < value)]
+
+	def readBlock(self, block = None):
+		""" Return the raw lines of the log covered by a block """
+
+		data = readRange(self.logFilename, block['offset'], block['end'])
+		# Block trailers (see libs/SegmentLog.py) are not log data
+		return [l for l in data.decode('utf-8', 'ignore').splitlines() if not l.startswith("#")]
+
+	def __warnValue__(self, sensorId = None):
+
+		for s in settings.SENSORS:
+			if s['sensorId'] == sensorId:
+				return s['warnValue']
+		return None
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# MessageBus - delivers ControlData messages only to the workers which want them.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The bus lives in the main process. Each worker's control queue is
+# subscribed to the destinations (settings.BUTTON_DEST_*) it listens on,
+# and optionally to only some message types (cdata.button):
+#
+# bus = MessageBus()
+# bus.subscribe(graphicsControlQueue, destinations = [settings.BUTTON_DEST_GRAPHICSIO])
+# bus.subscribe(compressorControlQueue, destinations = [settings.BUTTON_DEST_COMPRESSOR], buttons = [settings.STATUS_SEGMENT_CLOSED])
+# bus.publish(cdata)
+#
+# A message is put on the queue of every subscriber to its destination, or
+# of every subscriber if it is sent to settings.BUTTON_DEST_ALL. Subscribers
+# may also be a function, called with the message, for messages handled in
+# the main process itself.
+#
+# The bus has a put() method, so it can be handed to anything which would
+# otherwise put its messages straight onto a queue.
+
+# Standard libraries
+import queue
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+def drainQueue(controlQueue = None, limit = None):
+	""" Every message waiting on a queue, without blocking, up to 'limit' messages """
+
+	if limit is None:
+		limit = settings.MESSAGE_DRAIN_LIMIT
+	messages = []
+	while len(messages) < limit:
+		try:
+			messages.append(controlQueue.get(block = False))
+		except queue.Empty:
+			break
+	return messages
+
+class Subscription():
+	""" A queue, or function, and the messages it wants """
+
+	def __init__(self, target = None, buttons = None, name = None):
+
+		self.target = target
+		self.buttons = None
+		if buttons is not None:
+			self.buttons = set(buttons)
+		self.name = name
+		if hasattr(target, 'put'):
+			self.deliver = target.put
+		else:
+			self.deliver = target
+
+	def wants(self, cdata = None):
+
+		return (self.buttons is None) or (cdata.button in self.buttons)
+
+class MessageBus():
+	""" Publish/subscribe delivery of ControlData messages, by destination """
+
+	def __init__(self):
+
+		self.subscriptions = []
+		self.index = {}
+		self.published = 0
+		self.delivered = 0
+		self.dropped = 0
+
+	def subscribe(self, target = None, destinations = [], buttons = None, name = None):
+		""" Deliver messages for any of the destinations to a queue or function,
+		optionally only those whose button is in 'buttons' """
+
+		subscription = Subscription(target, buttons, name)
+		self.subscriptions.append(subscription)
+		for destination in destinations:
+			if destination not in self.index.keys():
+				self.index[destination] = []
+			self.index[destination].append(subscription)
+		logger.info("Subscribed [%s] to destinations %s" % (name, ["0x%02x" % d for d in destinations]))
+		return subscription
+
+	def unsubscribe(self, subscription = None):
+		""" Stop delivering messages to a subscriber """
+
+		if subscription in self.subscriptions:
+			self.subscriptions.remove(subscription)
+		for destination in self.index.keys():
+			if subscription in self.index[destination]:
+				self.index[destination].remove(subscription)
+
+	def publish(self, cdata = None):
+		""" Deliver a message to every matching subscriber, returning how many it went to """
+
+		self.published += 1
+		if cdata.destination == settings.BUTTON_DEST_ALL:
+			subscriptions = self.subscriptions
+		else:
+			subscriptions = self.index.get(cdata.destination, [])
+		delivered = 0
+		for subscription in subscriptions:
+			if subscription.wants(cdata):
+				subscription.deliver(cdata)
+				delivered += 1
+		if delivered == 0:
+			self.dropped += 1
+			logger.debug("No subscribers for message [%s] to destination [%s]" % (cdata.button, cdata.destination))
+		self.delivered += delivered
+		return delivered
+
+	def send(self, name = None, cdata = None):
+		""" Deliver a message only to the subscriber(s) with the given name,
+		whatever its destination, returning how many it went to """
+
+		delivered = 0
+		for subscription in self.subscriptions:
+			if subscription.name == name:
+				subscription.deliver(cdata)
+				delivered += 1
+		self.delivered += delivered
+		return delivered
+
+	def put(self, cdata = None, block = True, timeout = None):
+		""" Queue style alias of publish() """
+
+		self.publish(cdata)
+
+	def stats(self):
+
+		return {
+			'sourceId' : 'messageBus',
+			'subscribers' : len(self.subscriptions),
+			'published' : self.published,
+			'delivered' : self.delivered,
+			'dropped' : self.dropped,
+		}
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# PeakTracker - session, rolling window and per-lap peak values of every sensor.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The tracker runs in the main process and is fed every sample by the
+# SensorRouter. Every PEAK_PUBLISH_TIMER seconds the peaks of each sensor are
+# copied into ecuData, so other processes can read them with:
+#
+# ecudata.getPeakData('RPM')
+#
+# {'max': 6100, 'maxTime': 1538300012.1, 'min': 850, 'minTime': 1538300001.7,
+#  'windowMax': 5200, 'windowMin': 3100, 'lap': 3,
+#  'lapMax': 5900, 'lapMin': 2100, 'lastLapMax': 6100, 'lastLapMin': 1900}
+#
+# 'max'/'min' are since the last reset, 'windowMax'/'windowMin' over the last
+# PEAK_WINDOW seconds, 'lapMax'/'lapMin' since the lap was last marked and
+# 'lastLapMax'/'lastLapMin' over the previous lap.
+
+# Standard libraries
+from collections import deque
+import timeit
+import time
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+class SensorPeak():
+	""" Peak values of a single sensor, all updated in constant (amortised) time per sample """
+
+	def __init__(self, window = settings.PEAK_WINDOW):
+
+		self.window = window
+		self.reset()
+
+	def reset(self):
+
+		self.max = None
+		self.maxTime = None
+		self.min = None
+		self.minTime = None
+		# Rolling window extremes are kept as monotonic queues of (time, value):
+		# the front of each queue is always the extreme of the window.
+		self.windowMax = deque()
+		self.windowMin = deque()
+		self.lapMax = None
+		self.lapMin = None
+		self.lastLapMax = None
+		self.lastLapMin = None
+
+	def add(self, value = 0, t = 0, wallTime = 0):
+		""" Add a sample; 't' is time.monotonic(), 'wallTime' is time.time() """
+
+		if (self.max is None) or (value > self.max):
+			self.max = value
+			self.maxTime = wallTime
+		if (self.min is None) or (value < self.min):
+			self.min = value
+			self.minTime = wallTime
+
+		if (self.lapMax is None) or (value > self.lapMax):
+			self.lapMax = value
+		if (self.lapMin is None) or (value < self.lapMin):
+			self.lapMin = value
+
+		while self.windowMax and (self.windowMax[-1][1] <= value):
+			self.windowMax.pop()
+		self.windowMax.append((t, value))
+		while self.windowMin and (self.windowMin[-1][1] >= value):
+			self.windowMin.pop()
+		self.windowMin.append((t, value))
+		self.expire(t)
+
+	def expire(self, t = 0):
+		""" Drop samples older than the rolling window """
+
+		while self.windowMax and ((t - self.windowMax[0][0]) > self.window):
+			self.windowMax.popleft()
+		while self.windowMin and ((t - self.windowMin[0][0]) > self.window):
+			self.windowMin.popleft()
+
+	def newLap(self):
+
+		self.lastLapMax = self.lapMax
+		self.lastLapMin = self.lapMin
+		self.lapMax = None
+		self.lapMin = None
+
+	def summary(self, t = 0):
+
+		self.expire(t)
+		return {
+			'max' : self.max,
+			'maxTime' : self.maxTime,
+			'min' : self.min,
+			'minTime' : self.minTime,
+			'windowMax' : self.windowMax[0][1] if self.windowMax else None,
+			'windowMin' : self.windowMin[0][1] if self.windowMin else None,
+			'lapMax' : self.lapMax,
+			'lapMin' : self.lapMin,
+			'lastLapMax' : self.lastLapMax,
+			'lastLapMin' : self.lastLapMin,
+		}
+
+class PeakTracker():
+	""" Tracks the peaks of every sensor and publishes them to ecuData """
+
+	def __init__(self, ecuData = None):
+
+		self.ecuData = ecuData
+		self.sensors = {}
+		self.lap = 0
+		self.publish_timer = timeit.default_timer()
+
+	def update(self, sensorId = None, value = None):
+		""" Add the latest value of a sensor """
+
+		if isinstance(value, bool) or not isinstance(value, (int, float)):
+			return
+		if sensorId not in self.sensors.keys():
+			self.sensors[sensorId] = SensorPeak()
+		self.sensors[sensorId].add(value, time.monotonic(), time.time())
+
+	def publish(self, force = False):
+		""" Copy the peaks of every sensor to ecuData, if it is time to """
+
+		if (force is False) and ((timeit.default_timer() - self.publish_timer) < settings.PEAK_PUBLISH_TIMER):
+			return False
+		t = time.monotonic()
+		for sensorId in self.sensors.keys():
+			peaks = self.sensors[sensorId].summary(t)
+			peaks['lap'] = self.lap
+			self.ecuData.setPeakData(sensorId, peaks)
+		self.publish_timer = timeit.default_timer()
+		return True
+
+	def reset(self):
+		""" Forget all peak values """
+
+		logger.info("Resetting peak values")
+		for sensorId in self.sensors.keys():
+			self.sensors[sensorId].reset()
+		self.lap = 0
+		self.publish(force = True)
+
+	def newLap(self):
+		""" Mark the start of a new lap """
+
+		self.lap += 1
+		logger.info("Starting lap %s" % self.lap)
+		for sensorId in self.sensors.keys():
+			self.sensors[sensorId].newLap()
+		self.publish(force = True)
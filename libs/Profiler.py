@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+# Profiler - run PyCosworth worker processes under cProfile and collect per-loop timings.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Use as follows:
+#
+# In a worker function:
+#
+# loopTimer = LoopTimer("SensorIO")
+# while True:
+#	loopTimer.start()
+#	... do work ...
+#	loopTimer.stop()
+#	time.sleep(x)
+#
+# In SensorDashboard:
+#
+# def sensorWorker(dataQueue, controlQueue):
+#	profileWorker("SensorIO", SensorIO, dataQueue, controlQueue)
+#
+# When settings.PROFILE is enabled each worker is run under cProfile for
+# settings.PROFILE_DURATION seconds and then writes <name>.prof and
+# <name>.loops.json into settings.PROFILE_DIR. The main process merges
+# them with mergeProfiles().
+
+# Standard libraries
+import cProfile
+import pstats
+import signal
+import timeit
+import json
+import glob
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Loop counters watched by the supervisor
+from libs.Supervisor import heartbeat
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# All of the loop timers created in this process
+loopTimers = {}
+
+class LoopTimer():
+	""" Counts the iterations of a worker loop and how long the work in each one took """
+
+	def __init__(self, name = None):
+
+		self.name = name
+		self.count = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+		self.last = 0.0
+		self.t_start = None
+		loopTimers[name] = self
+
+	def start(self):
+		""" Mark the start of a loop, which also tells the supervisor we are still alive """
+
+		self.t_start = timeit.default_timer()
+		heartbeat(self.name)
+
+	def stop(self):
+		""" Mark the end of the work done in a loop """
+
+		if self.t_start is None:
+			return
+		self.last = timeit.default_timer() - self.t_start
+		self.t_start = None
+		self.count += 1
+		self.total += self.last
+		if (self.min is None) or (self.last < self.min):
+			self.min = self.last
+		if (self.max is None) or (self.last > self.max):
+			self.max = self.last
+
+	def summary(self):
+		""" Loop statistics, times in milliseconds """
+
+		if self.count == 0:
+			return { 'name' : self.name, 'count' : 0 }
+		return {
+			'name' : self.name,
+			'count' : self.count,
+			'last' : self.last * 1000,
+			'min' : self.min * 1000,
+			'max' : self.max * 1000,
+			'average' : (self.total / self.count) * 1000,
+		}
+
+def profileFilename(name = None, suffix = ".prof"):
+	""" Where the profile output of a named worker is written """
+
+	return os.path.join(settings.PROFILE_DIR, name + suffix)
+
+def dumpProfile(name = None, profile = None):
+	""" Write the cProfile stats and loop timers of this process to disk """
+
+	try:
+		if profile:
+			profile.disable()
+			profile.dump_stats(profileFilename(name))
+		loops = {}
+		for k in loopTimers.keys():
+			loops[k] = loopTimers[k].summary()
+		with open(profileFilename(name, ".loops.json"), 'w') as f:
+			json.dump(loops, f, indent = 1, sort_keys = True)
+		logger.info("Profile for [%s] written to %s" % (name, settings.PROFILE_DIR))
+	except Exception as e:
+		logger.error("Unable to write profile for [%s]" % name)
+		logger.error("%s" % e)
+
+def profileWorker(name, target, *args):
+	""" Run a worker function, under cProfile if profiling is enabled """
+
+	if settings.PROFILE is False:
+		return target(*args)
+
+	profile = cProfile.Profile()
+	state = { 'dumped' : False }
+
+	def stopProfile(signum = None, frame = None):
+		# The alarm fires in the main thread of the worker, which is
+		# the thread being profiled.
+		if state['dumped'] is False:
+			state['dumped'] = True
+			dumpProfile(name, profile)
+
+	logger.info("Profiling [%s] for %ss" % (name, settings.PROFILE_DURATION))
+	signal.signal(signal.SIGALRM, stopProfile)
+	signal.setitimer(signal.ITIMER_REAL, settings.PROFILE_DURATION)
+	profile.enable()
+	try:
+		return target(*args)
+	finally:
+		# Worker exited (or was shut down) before the profile period ended
+		signal.setitimer(signal.ITIMER_REAL, 0)
+		stopProfile()
+
+def clearProfiles():
+	""" Remove the output of any previous profiling run """
+
+	if os.path.exists(settings.PROFILE_DIR) is False:
+		os.makedirs(settings.PROFILE_DIR)
+	for f in glob.glob(os.path.join(settings.PROFILE_DIR, "*.prof")) + glob.glob(os.path.join(settings.PROFILE_DIR, "*.loops.json")):
+		os.remove(f)
+
+def mergeProfiles():
+	""" Merge every per-process profile into a single text summary """
+
+	filename = os.path.join(settings.PROFILE_DIR, "summary.txt")
+	profiles = sorted(glob.glob(os.path.join(settings.PROFILE_DIR, "*.prof")))
+	if len(profiles) == 0:
+		logger.warn("No worker profiles found in %s" % settings.PROFILE_DIR)
+		return False
+
+	with open(filename, 'w') as f:
+		f.write("PyCosworth profile summary (%ss per worker)\n\n" % settings.PROFILE_DURATION)
+
+		# Per-loop timing counters from each worker
+		f.write("Loop timings (ms)\n")
+		f.write("%-20s %10s %10s %10s %10s\n" % ("Loop", "Count", "Average", "Min", "Max"))
+		for loops_file in sorted(glob.glob(os.path.join(settings.PROFILE_DIR, "*.loops.json"))):
+			with open(loops_file) as l:
+				loops = json.load(l)
+			for k in sorted(loops.keys()):
+				if loops[k]['count'] > 0:
+					f.write("%-20s %10d %10.3f %10.3f %10.3f\n" % (k, loops[k]['count'], loops[k]['average'], loops[k]['min'], loops[k]['max']))
+		f.write("\n")
+
+		# Each process on its own, then everything together
+		for p in profiles:
+			f.write("=" * 72 + "\n")
+			f.write("%s\n" % os.path.basename(p))
+			f.write("=" * 72 + "\n")
+			stats = pstats.Stats(p, stream = f)
+			stats.sort_stats('cumulative').print_stats(settings.PROFILE_SUMMARY_LINES)
+
+		f.write("=" * 72 + "\n")
+		f.write("All workers merged\n")
+		f.write("=" * 72 + "\n")
+		stats = pstats.Stats(profiles[0], stream = f)
+		for p in profiles[1:]:
+			stats.add(p)
+		stats.sort_stats('tottime').print_stats(settings.PROFILE_SUMMARY_LINES)
+
+	logger.info("Merged %s worker profiles into %s" % (len(profiles), filename))
+	return True
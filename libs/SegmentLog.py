@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# SegmentLog - crash safe, append-only, segmented log files for DataLoggerIO.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A logging session is written as a series of segment files:
+#
+# logs/pycosworth_007_0000.csv
+# logs/pycosworth_007_0001.csv
+# ...
+#
+# A new segment is started once the current one reaches LOGGING_SEGMENT_SIZE,
+# and every segment begins with the CSV header line, so each one can be
+# opened on its own.
+#
+# Lines are not written to the file one at a time. They are collected into a
+# block which is written with a single write() call, followed by a trailer
+# line:
+#
+# #B,<block number>,<length of block>,<crc32 of block>
+#
+# A block is written once the next line would not fit in it, and the trailer
+# padded with spaces, so that the block ends exactly on the next multiple of
+# LOGGING_BLOCK_SIZE bytes into the segment. Lines are never split across
+# blocks, as each line of a segment must still be a whole CSV line, which the
+# log index can point straight at.
+#
+# The exception is a partial block, which is written early, unpadded, and the
+# file synced to the SD card with fdatasync(), if LOGGING_SYNC_INTERVAL
+# seconds have passed (and the header block at the start of each segment).
+# The block after it is only as long as is needed to reach the next multiple
+# of LOGGING_BLOCK_SIZE, so the blocks still line up with it. After a power
+# cut, recoverSegment() truncates a segment back to the end of the last
+# block whose trailer and checksum are intact.
+#
+# Once closed, a segment may be compressed by LogCompressorIO, becoming
+# 'pycosworth_007_0000.csv.gz' (see libs/LogCompress.py).
+
+# Standard libraries
+import timeit
+import zlib
+import re
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Seekable index of each log file
+from libs.LogIndex import LogIndexWriter, truncateIndex
+
+# Compressed segments
+from libs.LogCompress import COMPRESS_SUFFIXES
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# The start of every block trailer line
+BLOCK_MARKER = b"#B,"
+
+# Block trailers are of a fixed width, before any padding
+BLOCK_TRAILER = "#B,%010d,%010d,%08x"
+BLOCK_TRAILER_SIZE = len(BLOCK_TRAILER % (0, 0, 0)) + 1
+
+def segmentFilename(session = 0, segment = 0):
+	""" The name of a segment file of a logging session """
+
+	return os.path.join(settings.LOGGING_DIR, "%s%03d_%04d%s" % (settings.LOGGING_FILE_PREFIX, session, segment, settings.LOGGING_FILE_SUFFIX))
+
+def segmentMatch(filename = None):
+	""" Return (session, segment) if a filename is a log segment, compressed or not, else None """
+
+	compressed = "|".join([re.escape(s) for s in COMPRESS_SUFFIXES.values()])
+	m = re.match(r'^%s([0-9]+)_([0-9]+)%s(%s)?$' % (re.escape(settings.LOGGING_FILE_PREFIX), re.escape(settings.LOGGING_FILE_SUFFIX), compressed), os.path.basename(filename))
+	if m:
+		return int(m.group(1)), int(m.group(2))
+	return None
+
+def findSegment(session = 0, segment = 0):
+	""" The file holding a segment; the uncompressed file if there is one, else a compressed copy, else None """
+
+	filename = segmentFilename(session, segment)
+	if os.path.exists(filename):
+		return filename
+	for suffix in COMPRESS_SUFFIXES.values():
+		if os.path.exists(filename + suffix):
+			return filename + suffix
+	return None
+
+def sessionSegments(filename = None):
+	""" All of the segment files of the session that a segment belongs to, from that segment onwards """
+
+	match = segmentMatch(filename)
+	if match is None:
+		return [filename]
+	session, segment = match
+	segments = []
+	while findSegment(session, segment):
+		segments.append(findSegment(session, segment))
+		segment += 1
+	return segments
+
+def syncFile(fd):
+	""" Flush a file descriptor through to the storage device """
+
+	if hasattr(os, 'fdatasync'):
+		os.fdatasync(fd)
+	else:
+		os.fsync(fd)
+
+def segmentBlocks(data = b""):
+	""" Return the (start, end) of every valid block in the contents of a segment,
+	each including its trailer line """
+
+	blocks = []
+	block_start = 0
+	pos = 0
+	while pos < len(data):
+		eol = data.find(b"\n", pos)
+		if eol == -1:
+			# Torn final line
+			break
+		if data.startswith(BLOCK_MARKER, pos):
+			try:
+				fields = data[pos:eol].split(b",")
+				length = int(fields[2])
+				crc = int(fields[3], 16)
+			except (ValueError, IndexError):
+				break
+			block = data[block_start:pos]
+			if (len(block) != length) or ((zlib.crc32(block) & 0xffffffff) != crc):
+				break
+			blocks.append((block_start, eol + 1))
+			block_start = eol + 1
+		pos = eol + 1
+	return blocks
+
+def recoverSegment(filename = None):
+	""" Truncate a segment to the end of its last valid block. Returns the number of bytes removed. """
+
+	with open(filename, 'rb') as f:
+		data = f.read()
+
+	blocks = segmentBlocks(data)
+	valid_end = 0
+	if len(blocks) > 0:
+		valid_end = blocks[-1][1]
+	removed = len(data) - valid_end
+	if removed > 0:
+		logger.warn("Recovered log segment [%s], discarded %s bytes after the last valid block" % (filename, removed))
+		os.truncate(filename, valid_end)
+		truncateIndex(filename, valid_end)
+	return removed
+
+class SegmentLogWriter():
+	""" Writes the lines of one logging session into checksummed blocks and fixed size segments """
+
+	def __init__(self, session = 0, header = "", sensorIds = []):
+
+		self.session = session
+		self.header = header.encode('utf-8')
+		self.sensorIds = list(sensorIds)
+		self.segment = -1
+		self.fd = None
+		self.index = None
+		self.pos = 0
+		self.block = bytearray()
+		self.blocks = 0
+		self.bytes_closed = 0
+		self.closed = []
+		self.sync_timer = timeit.default_timer()
+		self.__nextSegment__()
+
+	def filename(self):
+		""" The segment currently being written """
+
+		return segmentFilename(self.session, self.segment)
+
+	def size(self):
+		""" Total bytes written to this session, including any not yet flushed """
+
+		return self.bytes_closed + self.pos + len(self.block)
+
+	def write(self, line = "", t = 0, values = []):
+		""" Add a line to the current block; 'values' are recorded in the index """
+
+		data = line.encode('utf-8')
+		room = self.__room__()
+		# A line longer than a whole block has to go in a block of its own
+		if (len(data) > room) and (room < (settings.LOGGING_BLOCK_SIZE - BLOCK_TRAILER_SIZE)):
+			self.flush(pad = True)
+		offset = self.pos + len(self.block)
+		self.block.extend(data)
+		if self.index:
+			self.index.add(offset = offset, end = offset + len(data), t = t, values = values)
+		if self.__room__() <= 0:
+			self.flush(pad = True)
+
+	def tick(self):
+		""" Call regularly; writes and syncs a partial block once the sync interval has passed """
+
+		if (timeit.default_timer() - self.sync_timer) >= settings.LOGGING_SYNC_INTERVAL:
+			self.flush(sync = True)
+
+	def flush(self, sync = False, roll = True, pad = False):
+		""" Write the current block and its trailer to the segment in a single write;
+		if 'pad' is set, the trailer is padded out to the end of the block """
+
+		if (len(self.block) > 0) or pad:
+			trailer = BLOCK_TRAILER % (self.blocks, len(self.block), zlib.crc32(bytes(self.block)) & 0xffffffff)
+			if pad:
+				trailer += " " * max(0, self.__room__())
+			data = bytes(self.block) + (trailer + "\n").encode('ascii')
+			os.write(self.fd, data)
+			self.pos += len(data)
+			self.blocks += 1
+			self.block = bytearray()
+		if sync:
+			syncFile(self.fd)
+			self.sync_timer = timeit.default_timer()
+		if roll and (self.pos >= settings.LOGGING_SEGMENT_SIZE):
+			self.__nextSegment__()
+
+	def closedSegments(self):
+		""" Return, and forget, the segments finished since this was last called """
+
+		closed = self.closed
+		self.closed = []
+		return closed
+
+	def close(self):
+		""" Write any remaining lines and sync the segment to disk """
+
+		if self.fd is not None:
+			self.flush(sync = True, roll = False)
+			self.__closeSegment__()
+
+	def __room__(self):
+		""" Bytes of lines which will still fit in the current block, leaving space for its trailer """
+
+		# The block ends on the next multiple of LOGGING_BLOCK_SIZE, or the one
+		# after that if there isn't space for the trailer before it
+		end = ((self.pos // settings.LOGGING_BLOCK_SIZE) + 1) * settings.LOGGING_BLOCK_SIZE
+		if (end - self.pos) < BLOCK_TRAILER_SIZE:
+			end += settings.LOGGING_BLOCK_SIZE
+		return end - self.pos - len(self.block) - BLOCK_TRAILER_SIZE
+
+	def __closeSegment__(self):
+
+		if self.index:
+			self.index.close()
+			self.index = None
+		os.close(self.fd)
+		self.fd = None
+		self.closed.append(self.filename())
+		self.bytes_closed += self.pos
+		self.pos = 0
+
+	def __nextSegment__(self):
+		""" Close the current segment, if any, and start the next """
+
+		if self.fd is not None:
+			syncFile(self.fd)
+			self.__closeSegment__()
+		self.segment += 1
+		filename = self.filename()
+		logger.info("Opening log segment [%s]" % filename)
+		self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o664)
+		self.index = LogIndexWriter(filename, self.sensorIds)
+		# Each segment starts with its own header, as a block of its own
+		self.block.extend(self.header)
+		self.flush(sync = True)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# SensorFilters - per-sensor smoothing of noisy sensor readings.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Filters are configured per sensor in settings.SENSOR_FILTERS:
+#
+# SENSOR_FILTERS = {
+#	'TPS' : { 'type' : 'median', 'size' : 5 },
+#	'MAP' : { 'type' : 'kalman', 'q' : 5, 'r' : 400 },
+#	'AFR' : { 'type' : 'ema', 'alpha' : 0.3 },
+# }
+#
+# SensorIO passes every new reading of a sensor through its filter, and
+# sends both the filtered value (used for display, logging and alarms) and
+# the unfiltered value, which is available from ecudata.getData(sensorId, raw = True).
+
+# Standard libraries
+from collections import deque
+import bisect
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+class SensorFilter():
+	""" Base class of the filters; each filter implements apply() and reset() """
+
+	readTime = None
+	filtered = None
+
+	def sample(self, value = 0, readTime = None):
+		""" Filter a reading, once per sample. A backend returns the same reading,
+		with the same readTime, until its refresh timer expires; those repeats
+		must not be counted again. """
+
+		if (readTime is None) or (readTime != self.readTime):
+			self.readTime = readTime
+			self.filtered = self.apply(value)
+		return self.filtered
+
+class EmaFilter(SensorFilter):
+	""" Exponential moving average; 'alpha' between 0 (never changes) and 1 (no filtering) """
+
+	def __init__(self, alpha = 0.3):
+
+		self.alpha = alpha
+		self.reset()
+
+	def reset(self):
+
+		self.value = None
+
+	def apply(self, value = 0):
+
+		if self.value is None:
+			self.value = value
+		else:
+			self.value += self.alpha * (value - self.value)
+		return self.value
+
+class MedianFilter(SensorFilter):
+	""" Median of the last 'size' readings; removes single sample spikes entirely """
+
+	def __init__(self, size = 5):
+
+		self.size = size
+		self.reset()
+
+	def reset(self):
+
+		self.window = deque()
+		self.ordered = []
+
+	def apply(self, value = 0):
+
+		self.window.append(value)
+		bisect.insort(self.ordered, value)
+		if len(self.window) > self.size:
+			oldest = self.window.popleft()
+			del self.ordered[bisect.bisect_left(self.ordered, oldest)]
+		return self.ordered[len(self.ordered) // 2]
+
+class KalmanFilter(SensorFilter):
+	""" One dimensional Kalman filter for a slowly changing value.
+	'q' is the process noise (how fast the real value can change),
+	'r' the measurement noise (how jittery the sensor is). """
+
+	def __init__(self, q = 1, r = 10):
+
+		self.q = q
+		self.r = r
+		self.reset()
+
+	def reset(self):
+
+		self.value = None
+		self.p = 0
+
+	def apply(self, value = 0):
+
+		if self.value is None:
+			self.value = value
+			self.p = self.r
+			return self.value
+		self.p += self.q
+		k = self.p / (self.p + self.r)
+		self.value += k * (value - self.value)
+		self.p *= (1 - k)
+		return self.value
+
+# Filter types, by the name used in settings.SENSOR_FILTERS
+SENSOR_FILTER_TYPES = {
+	'ema' : EmaFilter,
+	'median' : MedianFilter,
+	'kalman' : KalmanFilter,
+}
+
+def newFilter(config = None):
+	""" Create a filter from its settings.SENSOR_FILTERS entry """
+
+	options = dict(config)
+	filterType = options.pop('type')
+	if filterType not in SENSOR_FILTER_TYPES.keys():
+		raise ValueError("Unknown sensor filter type [%s]" % filterType)
+	return SENSOR_FILTER_TYPES[filterType](**options)
+
+def sensorFilters():
+	""" A filter for every sensor listed in settings.SENSOR_FILTERS """
+
+	filters = {}
+	for sensorId in settings.SENSOR_FILTERS.keys():
+		try:
+			filters[sensorId] = newFilter(settings.SENSOR_FILTERS[sensorId])
+			logger.info("Filtering sensor [%s] with %s" % (sensorId, settings.SENSOR_FILTERS[sensorId]))
+		except Exception as e:
+			logger.error("Unable to set up filter for sensor [%s]" % sensorId)
+			logger.error("%s" % e)
+	return filters
+
+def filterSample(filters = None, sensorData = None):
+	""" Replace the value of a sensor reading with its filtered value, keeping
+	the reading as 'unfilteredValue' """
+
+	sensorFilter = filters.get(sensorData['sensor']['sensorId'])
+	if (sensorFilter is None) or isinstance(sensorData['value'], bool) or not isinstance(sensorData['value'], (int, float)):
+		return sensorData
+	sensorData['unfilteredValue'] = sensorData['value']
+	sensorData['value'] = sensorFilter.sample(sensorData['value'], sensorData.get('readTime'))
+	return sensorData
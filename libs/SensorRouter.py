@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# SensorRouter - apply messages from the SensorIO process to the shared EcuData structure.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard libraries
+import queue
+import timeit
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Sample timestamps
+from libs.LatencyTrace import traceStamp
+
+# Peak values of every sensor
+from libs.PeakTracker import PeakTracker
+
+# Sensor alarms
+from libs.AlarmEngine import AlarmEngine
+
+# Sensors calculated from other sensors
+from libs.DerivedSensors import DerivedSensors
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+class SensorRouter():
+	""" The main process side of the sensor pipeline. Every message taken off
+	the SensorIO data queue is passed through route(), so that the dashboard and
+	the benchmark tools apply sensor data in exactly the same way. """
+
+	def __init__(self, ecuData = None, statusQueue = None, bootTime = None):
+		""" ecuData is the shared EcuData instance, statusQueue is where any
+		TYPE_STATUS messages are forwarded to (normally the GraphicsIO control queue).
+		If bootTime is given, the time from then to the first sample is reported. """
+
+		self.ecuData = ecuData
+		self.statusQueue = statusQueue
+		self.bootTime = bootTime
+		# Queues which are also sent every sample, see addListener()
+		self.listeners = []
+		self.dropped = 0
+		self.startup = {
+			'sourceId' : 'startup',
+			'firstSample' : None,
+			'firstSampleId' : None,
+			'startupSensor' : None,
+			'startupSensorId' : settings.STARTUP_SENSOR,
+		}
+		self.peakTracker = PeakTracker(ecuData = ecuData)
+		self.alarmEngine = AlarmEngine(ecuData = ecuData, alarmQueue = statusQueue)
+		self.derivedSensors = DerivedSensors()
+		# Derived sensors are registered up front, as no backend will report them
+		for sensorId in self.derivedSensors.available():
+			self.ecuData.setSensorData(self.derivedSensors.data(sensorId))
+
+	def addListener(self, sampleQueue = None):
+		""" Also put (sensorId, value, timerData, readTime) of every sample applied onto a bounded
+		queue. When the queue is full, the oldest sample on it is thrown away,
+		so that a slow listener never holds up the sensors. """
+
+		self.listeners.append(sampleQueue)
+
+	def route(self, d):
+		""" Apply a single (message_type, sensorData, loop count, sample time) tuple """
+
+		sensorDataType = d[0] # d0 = message_type
+		sensorData = d[1] # d1 = sensorData dict
+		loopCount = d[2] # d2 = sensor loop count
+		timerData = d[3] # d3 = time taken for last data collection cycle
+
+		# Check for type of the data
+		if sensorDataType == settings.TYPE_ERROR:
+			# We do special things for error messages
+			logger.warn("Error message received")
+			self.ecuData.setError(sensorData)
+		elif sensorDataType == settings.TYPE_DATA:
+			# But for anything else we record it as a sensor value
+			sensorId = sensorData['sensor']['sensorId']
+			if self.derivedSensors.isDerived(sensorId):
+				# e.g. a replayed log; we calculate these ourselves
+				return sensorDataType
+			self.ecuData.setCounter(loopCount)
+			self.ecuData.setSensorData(sensorData['sensor'])
+			if self.bootTime is not None:
+				self.__startup__(sensorId)
+			trace = sensorData.get('trace')
+			if trace:
+				trace = traceStamp(trace)
+			readTime = sensorData.get('readTime')
+			self.__apply__(sensorId, sensorData['value'], timerData, loopCount, trace, sensorData.get('unfilteredValue'), readTime)
+			# Then any derived sensors which depend on it
+			for derivedId, derivedValue in self.derivedSensors.update(sensorId, sensorData['value']):
+				self.__apply__(derivedId, derivedValue, timerData, loopCount, trace, None, readTime)
+			self.peakTracker.publish()
+		elif sensorDataType == settings.TYPE_STATUS:
+			if isinstance(sensorData, dict) and ('sourceId' in sensorData):
+				# Status data of a sensor module, e.g. link error counters
+				self.ecuData.setStatusData(sensorData)
+			elif self.statusQueue:
+				# A status update - failed connection, enable/disable demo, ecu error, etc
+				# Pass it on to the graphics display so it can work out what to show to the user
+				self.statusQueue.put(sensorData)
+		else:
+			logger.warn("Unknown message type from SensorIO process")
+
+		return sensorDataType
+
+	def __apply__(self, sensorId = None, value = None, timerData = 0, loopCount = 0, trace = None, unfilteredValue = None, readTime = None):
+		""" Store a sensor value and pass it to the peak tracker and alarms. readTime
+		is when SensorIO read the value; it is the same for every repeat of a reading. """
+
+		self.ecuData.setData(sensorId, value, timerData, loopCount, trace, unfilteredValue)
+		self.peakTracker.update(sensorId, value)
+		self.alarmEngine.update(sensorId, value, readTime)
+		for sampleQueue in self.listeners:
+			self.__publish__(sampleQueue, (sensorId, value, timerData, readTime))
+
+	def __publish__(self, sampleQueue = None, sample = None):
+		""" Put a sample on a listener queue, making room for it if need be """
+
+		try:
+			sampleQueue.put_nowait(sample)
+		except queue.Full:
+			self.dropped += 1
+			try:
+				sampleQueue.get_nowait()
+				sampleQueue.put_nowait(sample)
+			except (queue.Empty, queue.Full):
+				pass
+
+	def __startup__(self, sensorId = None):
+		""" Report the time from boot to the first sample of any sensor, and
+		to the first sample of settings.STARTUP_SENSOR """
+
+		elapsed = timeit.default_timer() - self.bootTime
+		if self.startup['firstSample'] is None:
+			self.startup['firstSample'] = elapsed
+			self.startup['firstSampleId'] = sensorId
+			logger.info("Time to first sample [%s]: %.2fs" % (sensorId, elapsed))
+			self.ecuData.setStatusData(self.startup)
+		if sensorId == settings.STARTUP_SENSOR:
+			self.startup['startupSensor'] = elapsed
+			logger.info("Time to first %s sample: %.2fs" % (sensorId, elapsed))
+			self.ecuData.setStatusData(self.startup)
+		if (settings.STARTUP_SENSOR is None) or (self.startup['startupSensor'] is not None):
+			self.bootTime = None
+
+	def control(self, cdata = None):
+		""" Act on a button press meant for the main process """
+
+		if cdata.button == settings.BUTTON_PEAK_RESET:
+			self.peakTracker.reset()
+		elif cdata.button == settings.BUTTON_LAP_MARK:
+			self.peakTracker.newLap()
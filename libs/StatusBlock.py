@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# StatusBlock - status flags and counters shared by every process through shared memory.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The block is a small array of doubles in shared memory, one per field in
+# STATUS_FIELDS. Workers write the fields they own as soon as they change:
+#
+# statusBlock.set(ecuError = True)
+#
+# and any process can read them back without a message being sent:
+#
+# statusBlock.flag('ecuError')
+# statusBlock.snapshot()
+#
+# Every change to the block increments 'generation'. A reader that only
+# needs to know if anything has changed compares the generation with the
+# one it saw last time, which is a single read of shared memory.
+#
+# Writers hold the lock of the array while they write, and the generation
+# is odd for the duration, so snapshot() never returns a half written set
+# of fields. Readers never take the lock.
+
+# Standard libraries
+import multiprocessing
+import time
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# Every field of the block, in order
+STATUS_FIELDS = (
+	'generation',	# incremented before and after every change
+	'ecuError',		# Cosworth ECU enabled, but not connected (SensorIO)
+	'aemError',		# AEM wideband enabled, but not connected (SensorIO)
+	'demoMode',		# demo sensors are running (SensorIO)
+	'sampleRate',	# sensor samples sent per second (SensorIO)
+	'logging',		# a log is being recorded (DataLoggerIO)
+	'logSession',	# number of the session being recorded, or -1 (DataLoggerIO)
+	'logSize',		# bytes recorded so far in this session (DataLoggerIO)
+	'logRate',		# lines logged per second (DataLoggerIO)
+	'powerError',	# input power lost, shutdown timer running (main)
+)
+STATUS_INDEX = dict([(name, i) for i, name in enumerate(STATUS_FIELDS)])
+
+class StatusBlock():
+	""" Shared memory status flags and counters, with a generation counter """
+
+	def __init__(self):
+
+		self.values = multiprocessing.Array('d', len(STATUS_FIELDS))
+		self.raw = self.values.get_obj()
+		self.raw[STATUS_INDEX['logSession']] = -1
+
+	def set(self, **fields):
+		""" Change one or more fields, returns True if any of them changed """
+
+		raw = self.raw
+		changed = False
+		for name in fields.keys():
+			if raw[STATUS_INDEX[name]] != fields[name]:
+				changed = True
+				break
+		if changed is False:
+			return False
+		with self.values.get_lock():
+			raw[0] += 1
+			for name in fields.keys():
+				raw[STATUS_INDEX[name]] = fields[name]
+			raw[0] += 1
+		return True
+
+	def get(self, name = None):
+		""" The current value of a single field """
+
+		return self.raw[STATUS_INDEX[name]]
+
+	def flag(self, name = None):
+
+		return self.raw[STATUS_INDEX[name]] != 0
+
+	def generation(self):
+		""" Changes whenever any field changes """
+
+		return self.raw[0]
+
+	def snapshot(self):
+		""" A consistent copy of every field, as a dictionary """
+
+		raw = self.raw
+		while True:
+			generation = raw[0]
+			if generation % 2 == 0:
+				values = raw[:]
+				if raw[0] == generation:
+					return dict(zip(STATUS_FIELDS, values))
+			# A write is in progress
+			time.sleep(0)
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __getstate__(self):
+		""" Only the shared array itself can be passed to a new process """
+
+		return { 'values' : self.values }
+
+	def __setstate__(self, state = None):
+
+		self.values = state['values']
+		self.raw = self.values.get_obj()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# Supervisor - watches the worker processes, and restarts any which die or hang.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every worker has a loop counter in shared memory, which is incremented by
+# its LoopTimer (libs/Profiler.py) each time round its main loop, so the
+# workers need no code of their own to take part.
+#
+# In SensorDashboard:
+#
+# supervisor = Supervisor()
+# supervisor.add("SensorIO", sensorWorker, (sensorDataQueue, sensorControlQueue, ecuStatusBlock))
+# while True:
+#	supervisor.check()
+#	if supervisor.healthy():
+#		wdt_reload()
+#
+# A worker is dead if its process has exited with an error, and hung if its
+# loop counter has not changed for the 'hangTimeout' given for it in
+# settings.SUPERVISOR_WORKERS. Either way it is (re)started after a backoff
+# delay, which doubles with each failure in a row. The new process is given
+# the same arguments as the old one, so it picks up the same queues and
+# shared ecuData where the old one left off.
+#
+# healthy() is only True while every worker marked 'critical' is running
+# and its loop counter is still moving.
+#
+# shutdown() stops the workers a stage at a time, in the order given by
+# settings.SHUTDOWN_STAGES, e.g. DataLoggerIO first so that it can flush its
+# log while the battery lasts. Each worker is told to stop (by a
+# STATUS_SHUTDOWN message, or SIGTERM if it has no control queue) and calls
+# acknowledge() once it has finished; any worker which has neither
+# acknowledged nor exited by the end of its stage is terminated.
+
+# Standard libraries
+import multiprocessing
+import timeit
+import time
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+# Loop counters of every supervised worker, created in the main process
+# before any worker is started, and inherited by each of them
+heartbeats = None
+heartbeatIndex = {}
+
+# Set by each worker once it has finished shutting down
+acks = None
+
+def createHeartbeats(names = []):
+	""" Allocate a shared loop counter, and shutdown flag, for each named worker """
+
+	global heartbeats
+	global heartbeatIndex
+	global acks
+	heartbeatIndex = dict([(name, i) for i, name in enumerate(names)])
+	heartbeats = multiprocessing.RawArray('L', max(1, len(names)))
+	acks = multiprocessing.RawArray('b', max(1, len(names)))
+
+def heartbeat(name = None):
+	""" Called each time round the loop of a worker """
+
+	index = heartbeatIndex.get(name)
+	if index is not None:
+		heartbeats[index] += 1
+
+def acknowledge(name = None):
+	""" Called by a worker when it has finished shutting down, just before it exits """
+
+	if name is None:
+		name = multiprocessing.current_process().name
+	index = heartbeatIndex.get(name)
+	if index is not None:
+		acks[index] = 1
+
+class Worker():
+	""" A supervised worker process and its restart state """
+
+	def __init__(self, name = None, target = None, args = (), config = {}):
+
+		self.name = name
+		self.target = target
+		self.args = args
+		self.critical = config.get('critical', False)
+		self.hangTimeout = config.get('hangTimeout', settings.SUPERVISOR_HANG_TIMEOUT)
+		self.process = None
+		self.restarts = 0
+		self.failures = 0
+		self.backoff = 0
+		self.retryTime = None
+		self.counter = None
+		self.changeTime = None
+		self.startTime = None
+		self.state = "stopped"
+
+	def start(self):
+
+		index = heartbeatIndex.get(self.name)
+		if index is not None:
+			acks[index] = 0
+		self.process = multiprocessing.Process(target = self.target, args = self.args, name = self.name)
+		self.process.start()
+		self.startTime = timeit.default_timer()
+		self.changeTime = self.startTime
+		self.counter = self.beats()
+		self.retryTime = None
+		self.state = "starting"
+
+	def stop(self, timeout = 2):
+		""" Stop the process, forcibly if it will not go """
+
+		if self.process and self.process.is_alive():
+			self.process.terminate()
+			self.process.join(timeout)
+			if self.process.is_alive():
+				logger.warn("Killing worker [%s]" % self.name)
+				self.process.kill()
+				self.process.join(timeout)
+
+	def acknowledged(self):
+		""" Has the worker finished shutting down """
+
+		index = heartbeatIndex.get(self.name)
+		if index is None:
+			return False
+		return acks[index] == 1
+
+	def beats(self):
+
+		index = heartbeatIndex.get(self.name)
+		if index is None:
+			return None
+		return heartbeats[index]
+
+	def summary(self):
+
+		return {
+			'name' : self.name,
+			'state' : self.state,
+			'critical' : self.critical,
+			'pid' : self.process.pid if self.process else None,
+			'restarts' : self.restarts,
+			'loops' : self.beats(),
+		}
+
+class Supervisor():
+	""" Starts the workers, checks on them, and restarts any which fail """
+
+	def __init__(self, names = None):
+
+		if names is None:
+			names = list(settings.SUPERVISOR_WORKERS.keys())
+		createHeartbeats(names)
+		self.workers = []
+		self.stopping = False
+		self.check_timer = timeit.default_timer()
+
+	def add(self, name = None, target = None, args = ()):
+		""" Start a new supervised worker """
+
+		worker = Worker(name, target, args, settings.SUPERVISOR_WORKERS.get(name, {}))
+		worker.start()
+		self.workers.append(worker)
+		logger.info("Started worker [%s] pid %s%s" % (name, worker.process.pid, " (critical)" if worker.critical else ""))
+		return worker.process
+
+	def check(self, force = False):
+		""" Look for dead or hung workers and restart them when their backoff has passed.
+		Returns True if the workers were checked. """
+
+		if (force is False) and ((timeit.default_timer() - self.check_timer) < settings.SUPERVISOR_CHECK_TIMER):
+			return False
+		self.check_timer = timeit.default_timer()
+		if self.stopping:
+			return False
+
+		now = timeit.default_timer()
+		for worker in self.workers:
+
+			# Waiting to be restarted
+			if worker.retryTime is not None:
+				if now >= worker.retryTime:
+					worker.restarts += 1
+					worker.start()
+					logger.warn("Restarted worker [%s] pid %s, restart %s" % (worker.name, worker.process.pid, worker.restarts))
+				continue
+
+			if worker.state == "finished":
+				continue
+
+			# Dead?
+			if worker.process.is_alive() is False:
+				if worker.process.exitcode == 0:
+					logger.info("Worker [%s] has finished" % worker.name)
+					worker.state = "finished"
+					continue
+				logger.error("Worker [%s] died with exit code %s" % (worker.name, worker.process.exitcode))
+				self.__failed__(worker, now)
+				continue
+
+			# Hung?
+			counter = worker.beats()
+			if counter is None:
+				# Not a worker we have a loop counter for; alive is all we can tell
+				worker.state = "running"
+				continue
+			if counter != worker.counter:
+				worker.counter = counter
+				worker.changeTime = now
+				worker.state = "running"
+				# Running happily for long enough to forget about earlier failures
+				if (worker.failures > 0) and ((now - worker.startTime) > settings.SUPERVISOR_BACKOFF_RESET):
+					worker.failures = 0
+					worker.backoff = 0
+				continue
+			if worker.state == "starting":
+				timeout = settings.SUPERVISOR_START_TIMEOUT
+			else:
+				timeout = worker.hangTimeout
+			if (now - worker.changeTime) > timeout:
+				logger.error("Worker [%s] has not looped for %.1fs, stopping it" % (worker.name, now - worker.changeTime))
+				worker.stop()
+				self.__failed__(worker, now)
+		return True
+
+	def healthy(self):
+		""" True while every critical worker is running and looping """
+
+		for worker in self.workers:
+			if worker.critical and (worker.state not in ("starting", "running")):
+				return False
+		return True
+
+	def stop(self):
+		""" Stop restarting workers, e.g. when shutting down """
+
+		self.stopping = True
+
+	def shutdown(self, notify = None):
+		""" Stop every worker, a stage at a time, and report how long each took.
+		notify(name) should tell a worker to shut down, and return False if it
+		has no way to be told, in which case it is sent SIGTERM instead. """
+
+		self.stopping = True
+		report = {
+			'sourceId' : 'shutdown',
+			'stages' : [],
+		}
+		shutdown_start = timeit.default_timer()
+		remaining = list(self.workers)
+		for stage in settings.SHUTDOWN_STAGES:
+			if stage['workers'] is None:
+				workers = remaining
+			else:
+				workers = [worker for worker in remaining if worker.name in stage['workers']]
+			remaining = [worker for worker in remaining if worker not in workers]
+			report['stages'].append(self.__stopStage__(stage, workers, notify))
+		report['time'] = timeit.default_timer() - shutdown_start
+		logger.critical("Shutdown of all workers took %.2fs" % report['time'])
+		return report
+
+	def summary(self):
+
+		return {
+			'sourceId' : 'workers',
+			'healthy' : self.healthy(),
+			'workers' : [worker.summary() for worker in self.workers],
+		}
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __failed__(self, worker = None, now = 0):
+		""" Schedule the restart of a failed worker """
+
+		worker.failures += 1
+		if worker.backoff == 0:
+			worker.backoff = settings.SUPERVISOR_BACKOFF[0]
+		else:
+			worker.backoff = min(worker.backoff * 2, settings.SUPERVISOR_BACKOFF[1])
+		worker.retryTime = now + worker.backoff
+		worker.state = "failed"
+		logger.warn("Restarting worker [%s] in %ss" % (worker.name, worker.backoff))
+
+	def __stopStage__(self, stage = None, workers = [], notify = None):
+		""" Tell each worker in a stage to stop, and wait until they all have,
+		or until the timeout of the stage """
+
+		stage_start = timeit.default_timer()
+		deadline = stage_start + stage['timeout']
+		results = {}
+		for worker in workers:
+			results[worker.name] = { 'acknowledged' : None, 'exitcode' : None }
+			if worker.process.is_alive() is False:
+				continue
+			if (notify is None) or (notify(worker.name) is False):
+				worker.process.terminate()
+
+		# Wait for every worker to acknowledge, or exit
+		pending = [worker for worker in workers if worker.process.is_alive()]
+		while (len(pending) > 0) and (timeit.default_timer() < deadline):
+			for worker in list(pending):
+				if worker.acknowledged() or (worker.process.is_alive() is False):
+					results[worker.name]['acknowledged'] = timeit.default_timer() - stage_start
+					pending.remove(worker)
+			if len(pending) > 0:
+				time.sleep(settings.SHUTDOWN_POLL_TIME)
+
+		# Then for them to exit, using whatever is left of the stage
+		for worker in workers:
+			if worker in pending:
+				logger.error("Worker [%s] did not acknowledge shutdown within %ss" % (worker.name, stage['timeout']))
+			else:
+				worker.process.join(max(0, deadline - timeit.default_timer()))
+			if worker.process.is_alive():
+				worker.stop(settings.SHUTDOWN_KILL_TIMEOUT)
+			worker.state = "finished"
+			results[worker.name]['exitcode'] = worker.process.exitcode
+
+		stage_time = timeit.default_timer() - stage_start
+		logger.critical("Shutdown stage [%s] took %.2fs: %s" % (stage['name'], stage_time, results))
+		return {
+			'name' : stage['name'],
+			'time' : stage_time,
+			'workers' : results,
+		}
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+# Telemetry - compact binary frames of live sensor values, for viewing away from the car.
+# Copyright (C) 2018  John Snowdon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every frame is a single UDP datagram:
+#
+# header:	magic "PC", version, kind, sequence, time, channel count
+# key frame:	for each channel; index, name length, name, value
+# delta frame:	for each changed channel; index, value
+#
+# A key frame carries every channel, along with the index it is known by,
+# and is sent every TELEMETRY_KEYFRAME_TIME seconds and whenever a new
+# channel appears. Delta frames in between carry only the channels whose
+# value has changed since they were last sent, so a receiver which joins
+# late, or loses a packet, is back in step at the next key frame.
+#
+# Sender (iomodules/TelemetryIO.py):
+#
+# encoder = TelemetryEncoder()
+# encoder.update('RPM', 3500)
+# frame = encoder.frame()
+#
+# Receiver (TelemetryReceiver):
+#
+# decoder = TelemetryDecoder()
+# changed = decoder.decode(frame)	# { 'RPM' : 3500.0 }
+
+# Standard libraries
+import struct
+import timeit
+import time
+import sys
+import os
+
+# Settings file
+from libs import settings
+
+# Start a new logger
+from libs.newlog import newlog
+if getattr(sys, 'frozen', False):
+	__file__ = os.path.dirname(sys.executable)
+logger = newlog(__file__)
+
+TELEMETRY_MAGIC = b"PC"
+TELEMETRY_VERSION = 1
+
+# Frame kinds
+FRAME_KEY = 0
+FRAME_DELTA = 1
+
+# magic, version, kind, sequence, time, channel count
+FRAME_HEADER = struct.Struct("<2sBBIdB")
+# index, name length (followed by the name, then a CHANNEL_VALUE)
+KEY_CHANNEL = struct.Struct("<BB")
+CHANNEL_VALUE = struct.Struct("<f")
+# index, value
+DELTA_CHANNEL = struct.Struct("<Bf")
+
+# Channel indexes are a single byte
+MAX_CHANNELS = 255
+
+class TelemetryEncoder():
+	""" Builds key and delta frames from the latest value of each sensor """
+
+	def __init__(self, intervals = None, keyframeTime = None):
+		""" intervals is the minimum time, in seconds, between sending each
+		sensor (decimation); sensors not listed are sent in every frame they change """
+
+		if intervals is None:
+			intervals = settings.TELEMETRY_INTERVALS
+		if keyframeTime is None:
+			keyframeTime = settings.TELEMETRY_KEYFRAME_TIME
+		self.intervals = intervals
+		self.keyframeTime = keyframeTime
+		self.index = {}
+		self.values = {}
+		self.sent = {}
+		self.sentTime = {}
+		self.sequence = 0
+		self.keyframe_timer = None
+
+	def update(self, sensorId = None, value = None):
+		""" Record the latest value of a sensor """
+
+		if isinstance(value, bool) or not isinstance(value, (int, float)):
+			return
+		if sensorId not in self.index:
+			if len(self.index) >= MAX_CHANNELS:
+				return
+			self.index[sensorId] = len(self.index)
+			# New channels are announced in a key frame straight away
+			self.keyframe_timer = None
+		self.values[sensorId] = value
+
+	def frame(self, now = None):
+		""" The next frame to send, or None if nothing has changed """
+
+		if now is None:
+			now = timeit.default_timer()
+		if len(self.values) == 0:
+			return None
+
+		if (self.keyframe_timer is None) or ((now - self.keyframe_timer) >= self.keyframeTime):
+			self.keyframe_timer = now
+			return self.__keyFrame__(now)
+
+		changed = []
+		for sensorId, value in self.values.items():
+			if value == self.sent.get(sensorId):
+				continue
+			if (now - self.sentTime.get(sensorId, 0)) < self.intervals.get(sensorId, 0):
+				continue
+			changed.append(sensorId)
+		if len(changed) == 0:
+			return None
+
+		entries = []
+		for sensorId in changed:
+			entries.append(DELTA_CHANNEL.pack(self.index[sensorId], self.values[sensorId]))
+			self.__sent__(sensorId, now)
+		return self.__header__(FRAME_DELTA, len(changed)) + b"".join(entries)
+
+	##########################################
+	#
+	# The methods listed below should not be called by any external code.
+	#
+	##########################################
+
+	def __keyFrame__(self, now = 0):
+
+		entries = []
+		for sensorId, value in self.values.items():
+			name = sensorId.encode('utf8')[:255]
+			entries.append(KEY_CHANNEL.pack(self.index[sensorId], len(name)) + name + CHANNEL_VALUE.pack(value))
+			self.__sent__(sensorId, now)
+		return self.__header__(FRAME_KEY, len(entries)) + b"".join(entries)
+
+	def __header__(self, kind = FRAME_DELTA, count = 0):
+
+		self.sequence = (self.sequence + 1) & 0xffffffff
+		return FRAME_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, kind, self.sequence, time.time(), count)
+
+	def __sent__(self, sensorId = None, now = 0):
+
+		self.sent[sensorId] = self.values[sensorId]
+		self.sentTime[sensorId] = now
+
+class TelemetryDecoder():
+	""" Keeps the latest value of every channel from a stream of frames """
+
+	def __init__(self):
+
+		self.channels = {}
+		self.values = {}
+		self.sequence = None
+		self.frameTime = None
+		self.frames = 0
+		self.lost = 0
+		self.invalid = 0
+
+	def decode(self, data = b""):
+		""" Apply a frame, returning the channels it changed, or None if it is not a valid frame """
+
+		try:
+			magic, version, kind, sequence, frameTime, count = FRAME_HEADER.unpack_from(data, 0)
+		except struct.error:
+			self.invalid += 1
+			return None
+		if (magic != TELEMETRY_MAGIC) or (version != TELEMETRY_VERSION):
+			self.invalid += 1
+			return None
+
+		# Lost frames; anything out of order is ignored
+		if self.sequence is not None:
+			gap = (sequence - self.sequence) & 0xffffffff
+			if (gap == 0) or (gap > 0x7fffffff):
+				return {}
+			self.lost += gap - 1
+		self.sequence = sequence
+		self.frameTime = frameTime
+		self.frames += 1
+
+		changed = {}
+		pos = FRAME_HEADER.size
+		try:
+			for i in range(count):
+				if kind == FRAME_KEY:
+					index, length = KEY_CHANNEL.unpack_from(data, pos)
+					pos += KEY_CHANNEL.size
+					name = data[pos:pos + length].decode('utf8', 'replace')
+					pos += length
+					value = CHANNEL_VALUE.unpack_from(data, pos)[0]
+					pos += CHANNEL_VALUE.size
+					self.channels[index] = name
+				else:
+					index, value = DELTA_CHANNEL.unpack_from(data, pos)
+					pos += DELTA_CHANNEL.size
+					# Not seen a key frame with this channel in it yet
+					if index not in self.channels:
+						continue
+				name = self.channels[index]
+				self.values[name] = value
+				changed[name] = value
+		except struct.error:
+			self.invalid += 1
+		return changed
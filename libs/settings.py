@@ -55,6 +55,8 @@ USE_GEAR_INDICATOR = False	# Try to read gear indicator position via GPIO
 USE_COSWORTH = False 		# Try to connect to a Cosworth L8/P8 ECU over serial
 USE_AEM = True				# Try to connect to an AEM Wideband AFR module over serial
 USE_SENSOR_DEMO = False 	# Enable demo data mode from the SensorIO module instead of real data
+USE_SENSOR_REPLAY = False	# Play back a recorded log from the SensorIO module instead of real data
+USE_UPS = False				# Read supply and battery voltages from the Super Watchdog V2 UPS hat over I2C
 
 # Should INFO category messages be shown
 INFO = True
@@ -63,6 +65,12 @@ DEBUG = False
 # Enable/Disable support for the Super Watchdog V2 Raspberry Pi hat
 USE_PI_WATCHDOG = True
 
+# Stream live sensor values over the network (see iomodules/TelemetryIO.py)
+USE_TELEMETRY = False
+
+# Serve live sensor values and metrics over HTTP (see iomodules/HttpIO.py)
+USE_HTTP = False
+
 ##############################################################
 #
 # Sensor information
@@ -97,6 +105,35 @@ SENSORS = [
 	{ 	'sensorId'	: 'RPM',		'minValue' : 0,		'maxValue'	: 7500, 'warnValue' : 6000,	},
 	{	'sensorId' 	: 'TPS',		'minValue' : -0.3,	'maxValue'	: 90,	'warnValue' : 100,	},
 ]
+
+# Sensors of the UPS hat, only there when USE_UPS is enabled
+UPS_SENSORS = [
+	{	'sensorId' 	: 'VIN',		'minValue' : 0,		'maxValue'	: 6,		'warnValue' : 5.5,	},
+	{	'sensorId' 	: 'VBAT',	'minValue' : 0,		'maxValue'	: 5,		'warnValue' : 4.3,	},
+	{	'sensorId' 	: 'VOUT',	'minValue' : 0,		'maxValue'	: 6,		'warnValue' : 5.5,	},
+	{	'sensorId' 	: 'UPSTEMP',	'minValue' : 0,		'maxValue'	: 80,	'warnValue' : 60,	},
+	{	'sensorId' 	: 'CHARGE',	'minValue' : 0,		'maxValue'	: 3,		'warnValue' : 2.5,	},
+]
+if USE_UPS:
+	SENSORS.extend(UPS_SENSORS)
+
+# Derived sensors are calculated in the main process from the values of other
+# sensors, see libs/DerivedSensors.py. 'expression' may use any sensorId above,
+# the names in DERIVED_CONSTANTS and the functions abs, min, max and round.
+DERIVED_CONSTANTS = {
+	'BARO' 		: 1013.25, 	# Atmospheric pressure, in mbar, the same units as MAP
+	'STOICH' 	: 14.7, 		# Stoichiometric AFR of the fuel
+}
+DERIVED_SENSORS = [
+	{	'sensorId' 	: 'BOOST',	'minValue' : -1,		'maxValue'	: 2,		'warnValue' : 1.5,	'sensorUnit' : 'bar',		'expression' : '(MAP - BARO) / 1000.0',	},
+	{	'sensorId' 	: 'INJDC',	'minValue' : 0,		'maxValue'	: 100,	'warnValue' : 85,	'sensorUnit' : '% duty',		'expression' : 'INJDUR * RPM / 1200.0',	},
+	{	'sensorId' 	: 'LOAD',	'minValue' : 0,		'maxValue'	: 300,	'warnValue' : 250,	'sensorUnit' : '%',			'expression' : 'MAP * 100.0 / BARO',		},
+	{	'sensorId' 	: 'LAMBDA',	'minValue' : 0.5,	'maxValue'	: 1.5,	'warnValue' : 1.1,	'sensorUnit' : 'lambda',		'expression' : 'AFR / STOICH',			},
+]
+# Derived sensors are displayed and logged like any other
+for d in DERIVED_SENSORS:
+	SENSORS.append({ 'sensorId' : d['sensorId'], 'minValue' : d['minValue'], 'maxValue' : d['maxValue'], 'warnValue' : d['warnValue'] })
+
 # A list of all sensor id's
 SENSOR_IDS = []
 for s in SENSORS:
@@ -105,11 +142,23 @@ for s in SENSORS:
 # How many previous sensor samples, for each sensor, to keep in memory
 SENSOR_MAX_HISTORY = 256
 
+# Smoothing applied to noisy sensors in the SensorIO process, before they are
+# displayed or logged, see libs/SensorFilters.py. The unfiltered reading is
+# still available with ecudata.getData(sensorId, raw = True).
+# 'ema'		exponential moving average, 'alpha' 0 - 1, lower is smoother
+# 'median'	median of the last 'size' readings, removes single sample spikes
+# 'kalman'	'q' how fast the real value changes, 'r' how noisy the sensor is
+SENSOR_FILTERS = {
+	'AFR' 	: { 'type' : 'ema', 'alpha' : 0.3 },
+	'MAP' 	: { 'type' : 'kalman', 'q' : 400, 'r' : 900 },
+	'TPS' 	: { 'type' : 'median', 'size' : 5 },
+}
+
 # The amount of time, in seconds, that the SensorIO process sleeps between each loop
 SENSOR_SLEEP_TIME = 0.05
 
-# How often to sleep between broadcasting ECU/comms error messages
-SENSOR_ERROR_HEARTBEAT_TIMER = 5
+# How often, in seconds, SensorIO updates its sample rate in the shared status block
+SENSOR_RATE_TIMER = 1
 
 ##########################################################
 #
@@ -120,6 +169,42 @@ COSWORTH_ECU_TYPE = "L8 Pectel" # see iomodules/sensors/CosworthSensors.py for a
 
 # Which USB interface your USB to serial device is on
 COSWORTH_ECU_USB = "/dev/ttyUSB0" 
+
+# The link to the ECU is taken down, and the serial port
+# reopened, when at least COSWORTH_ERROR_MIN of the last
+# COSWORTH_ERROR_WINDOW reads have been made and this
+# fraction of them failed
+COSWORTH_ERROR_WINDOW = 50
+COSWORTH_ERROR_MIN = 10
+COSWORTH_ERROR_RATE = 0.5
+
+# Delay, in seconds, before reopening the serial port; it
+# doubles each time the link fails in a row, up to the
+# second number
+COSWORTH_RECONNECT_BACKOFF = (1, 30)
+
+# Seconds the link must stay up before the backoff delay
+# goes back to the start
+COSWORTH_BACKOFF_RESET = 60
+
+# How often, in seconds, the link error counters are
+# published to the other processes
+COSWORTH_STATS_TIMER = 5
+
+# Turn on the low latency mode of the USB serial adaptor,
+# if it has one
+COSWORTH_LOW_LATENCY = True
+
+# How many times each control code is timed when the link
+# comes up
+COSWORTH_CALIBRATION_READS = 5
+
+# The read deadline of each control code is the slowest of
+# its calibration round trips, times the factor, plus the
+# margin (in seconds), but never less than the minimum
+COSWORTH_DEADLINE_FACTOR = 2
+COSWORTH_DEADLINE_MARGIN = 0.005
+COSWORTH_DEADLINE_MIN = 0.01
 	
 #########################################################
 #
@@ -127,6 +212,19 @@ COSWORTH_ECU_USB = "/dev/ttyUSB0"
 #
 #########################################################
 AEM_USB = "/dev/ttyUSB1"
+
+#########################################################
+#
+# UPS hat telemetry settings
+#
+#########################################################
+# Which I2C bus, and address on it, the UPS hat is on
+UPS_I2C_BUS = 1
+UPS_I2C_ADDRESS = 0x30
+
+# How often, in seconds, to read the UPS sensors. All of them
+# are read together, in a single I2C transaction
+UPS_REFRESH = 1
 	
 #######################################################
 #
@@ -138,6 +236,30 @@ AEM_USB = "/dev/ttyUSB1"
 # sensor to simulate.
 DEMO_STEPS = 64
 
+#######################################################
+#
+# Replay module config
+#
+#######################################################
+
+# The recorded log to play back when USE_SENSOR_REPLAY is enabled.
+# Can also be given as: ./SensorDashboard --replay <file> [speed]
+SENSOR_REPLAY_FILE = "logs/pycosworth_000_0000.csv"
+
+# Multiple of real time to replay at; 1 is the original timing,
+# 4 is four times faster, 0 is as fast as possible
+SENSOR_REPLAY_SPEED = 1
+
+# Start again from the beginning when the end of the log is reached
+SENSOR_REPLAY_LOOP = True
+
+# Time, in seconds from the start of the log, to begin replaying from.
+# Uses the log index to seek, rather than reading the whole log.
+SENSOR_REPLAY_START = 0
+
+# Maximum rows of the log sent each time round the SensorIO loop
+SENSOR_REPLAY_BATCH = 100
+
 #######################################################
 #
 # GPIO module config - this sends button presses and 
@@ -146,8 +268,9 @@ DEMO_STEPS = 64
 #
 #######################################################
 
-# How long to sleep between button scans
-GPIO_SLEEP_TIME = 0.2
+# Button presses are detected by edge interrupts, this is how long, in ms,
+# to ignore further edges on a pin for while a button stops bouncing
+GPIO_BOUNCE_TIME = 20
 
 # Length of time each press takes (min time, max time)
 BUTTON_TIME_SHORT 	= (0, 	0.3)
@@ -170,12 +293,24 @@ STATUS_DEMO_DISABLED	 		= "d2" #
 BUTTON_LOGGING_STATUS 		= "S" # Logging status/heartbeat response
 BUTTON_RESET_COSWORTH_ECU 	= "R" # Reset Cosworth ECU serial comms
 BUTTON_RESET_AEM_ECU 		= "r" # Reset AEM serial comms
+BUTTON_PEAK_RESET 			= "p" # Reset all peak values
+BUTTON_LAP_MARK 				= "m" # Mark the start of a new lap
+STATUS_ALARM					= "a1" # A sensor alarm has been raised or cleared
+STATUS_SEGMENT_CLOSED		= "c1" # A log segment has been closed and can be compressed
 
 # For the simple, 3 button interface
 BUTTON_LOGGING_TOGGLE 		= "1" # Logging is stopped or started
 BUTTON_SENSOR_NEXT			= "2" # Select next sensor
 BUTTON_RESET_ECU				= "3" # Reset all comms
 
+# Which GPIO pin (board numbering) each of the buttons is wired to, the
+# other side of each button goes to ground
+GPIO_BUTTON_PINS = {
+	11 : BUTTON_LOGGING_TOGGLE,
+	13 : BUTTON_SENSOR_NEXT,
+	15 : BUTTON_RESET_ECU,
+}
+
 # Button message types
 MESSAGE_TYPE_PRESS 	= 0x01 # message is a button press
 MESSAGE_TYPE_PAUSE 	= 0xFE # message is to pause logging/display
@@ -194,6 +329,13 @@ BUTTON_DEST_CONSOLEIO 	= 0x03 # send to console process
 BUTTON_DEST_MATRIXIO 	= 0x04 # send to matrix lcd process
 BUTTON_DEST_GRAPHICSIO 	= 0x05 # send to SDL/OLED graphics process
 BUTTON_DEST_DATALOGGER 	= 0x06 # send to datalogger process
+BUTTON_DEST_COMPRESSOR 	= 0x07 # send to log compressor process
+BUTTON_DEST_TELEMETRY 	= 0x08 # send to network telemetry process
+BUTTON_DEST_HTTP 		= 0x09 # send to http server process
+
+# The most control messages a worker handles each time it wakes, so that a
+# flood of messages cannot stop it doing anything else
+MESSAGE_DRAIN_LIMIT = 64
 
 # Mapping of buttons to modules
 # i.e. button 1 and 2 to GraphicsIO, button 3 to datalogger, etc
@@ -208,6 +350,8 @@ BUTTON_MAP = {
 	STATUS_AEM_ERROR				: { 'dest' : BUTTON_DEST_GRAPHICSIO }, # AEM AFR comms problem
 	STATUS_ECU_OK				: { 'dest' : BUTTON_DEST_GRAPHICSIO }, # ECU comms problem
 	STATUS_AEM_OK				: { 'dest' : BUTTON_DEST_GRAPHICSIO }, # AEM AFR comms problem
+	BUTTON_PEAK_RESET			: { 'dest' : BUTTON_DEST_MAIN }, # Reset peak values
+	BUTTON_LAP_MARK				: { 'dest' : BUTTON_DEST_MAIN }, # Start a new lap
 }
 
 #######################################################
@@ -259,6 +403,10 @@ GFX_SLEEP_TIME = 0.01
 # How long a period to measure framerate over
 GFX_FRAME_COUNT_TIME = 5
 
+# Skip the boot logos and 'please wait' animation, and show
+# the sensors as soon as the display is ready
+GFX_FAST_BOOT = False
+
 GFX_MODE_NUMERIC = "Numeric"
 GFX_MODE_OFF = "OFF"
 
@@ -288,6 +436,10 @@ GFX_MASTER_WINDOW = {
 	'value_refreshTime'	: 0.1,
 	'screen_refreshTime': 0.05,
 }
+if USE_UPS:
+	GFX_MASTER_WINDOW['sensorIds'].extend(['VIN', 'VBAT'])
+for d in DERIVED_SENSORS:
+	GFX_MASTER_WINDOW['sensorIds'].append(d['sensorId'])
 
 # All of the fonts used in the graphics routines
 #
@@ -316,8 +468,8 @@ GFX_FONTS = {
 #
 #######################################################
 
-# Broadcast logging status every 'X' seconds
-LOGGING_HEARTBEAT_TIMER = 3
+# How often, in seconds, the logger updates the log size and rate in the shared status block
+LOGGING_RATE_TIMER = 1
 
 # How often to sleep between loops, should be no more than the sensor module
 # otherwise we may miss datapoints
@@ -328,6 +480,329 @@ LOGGING_DIR = "logs"
 LOGGING_FILE_PREFIX = "pycosworth_"
 LOGGING_FILE_SUFFIX = ".csv"
 
+# A list of every logging session, kept in LOGGING_DIR
+LOGGING_CATALOG_FILE = "catalog.json"
+
+# Every log file has an index sidecar with this suffix, holding a time
+# to byte offset checkpoint and the min/max of every sensor for each
+# block of this many lines of the log.
+LOGGING_INDEX_SUFFIX = ".idx"
+LOGGING_INDEX_BLOCK_ROWS = 50
+
+# Each logging session is written as a series of segment files of up to this
+# many bytes. Lines are collected into blocks of LOGGING_BLOCK_SIZE bytes,
+# each written in one go with a checksum, so that a log cut short by a power
+# failure can be truncated back to the last complete block. Keep the block
+# size a multiple of the flash page size of the SD card. A partial block
+# written on sync is shorter; the block after it is shortened to line back up.
+LOGGING_SEGMENT_SIZE = 4 * 1024 * 1024
+LOGGING_BLOCK_SIZE = 16 * 1024
+LOGGING_SYNC_INTERVAL = 5 		# Write and sync a partial block after this many seconds
+
+# Compress finished log segments in a low priority background process,
+# using "gzip" or "zstd" (needs the zstandard library, otherwise gzip is used).
+LOGGING_COMPRESS = True
+LOGGING_COMPRESS_FORMAT = "gzip"
+LOGGING_COMPRESS_LEVEL = 6
+LOGGING_COMPRESS_NICE = 19 		# Niceness of the compressor process, 19 is the lowest priority
+LOGGING_COMPRESS_SLEEP = 10 	# How long the compressor sleeps between looking for work
+
+# Oldest logging sessions are deleted once logs take up more than LOGGING_QUOTA_MB,
+# or there is less than LOGGING_MIN_FREE_MB left on the disk. 0 disables either check.
+LOGGING_QUOTA_MB = 4096
+LOGGING_MIN_FREE_MB = 256
+
+########################################################
+#
+# Alarms
+#
+########################################################
+
+# Raise an alarm when any sensor goes over its 'warnValue' in SENSORS
+ALARM_WARN_VALUES = True
+
+# Once raised, a warnValue alarm clears when the sensor falls back below
+# warnValue by this fraction of the sensor range (maxValue - minValue)
+ALARM_WARN_HYSTERESIS = 0.02
+
+# Additional alarm rules, see libs/AlarmEngine.py. An alarm is raised when
+# all of its conditions are true at the same time. 'op' is one of
+# >, >=, <, <= or rate>, rate< for the rate of change per second.
+ALARMS = [
+	{ 'alarmId' : 'LEAN_BOOST', 'message' : 'Lean Boost', 'conditions' : [
+		{ 'sensorId' : 'MAP', 'op' : '>', 'value' : 1500, 'hysteresis' : 100 },
+		{ 'sensorId' : 'AFR', 'op' : '>', 'value' : 13.5, 'hysteresis' : 0.3 },
+	]},
+	{ 'alarmId' : 'ECT_RISE', 'message' : 'ECT Rising', 'conditions' : [
+		{ 'sensorId' : 'ECT', 'op' : '>', 'value' : 95 },
+		{ 'sensorId' : 'ECT', 'op' : 'rate>', 'value' : 1, 'hysteresis' : 0.5 },
+	]},
+	{ 'alarmId' : 'SUPPLY_SAG', 'message' : 'Supply Low', 'conditions' : [
+		{ 'sensorId' : 'VIN', 'op' : '<', 'value' : 4.75, 'hysteresis' : 0.1 },
+	]},
+]
+
+########################################################
+#
+# Peak values
+#
+########################################################
+
+# Length, in seconds, of the rolling window over which recent
+# peak values of each sensor are kept
+PEAK_WINDOW = 10
+
+# How often, in seconds, peak values are published to the
+# other processes
+PEAK_PUBLISH_TIMER = 0.5
+
+########################################################
+#
+# Network telemetry
+#
+########################################################
+
+# The UDP multicast group and port frames are sent to. Any
+# machine on the same network can receive them with
+# ./TelemetryReceiver
+TELEMETRY_GROUP = "239.255.42.99"
+TELEMETRY_PORT = 5199
+
+# How many network hops frames can travel; 1 keeps them on
+# the local network
+TELEMETRY_TTL = 1
+
+# The IP address of the network interface to send on, or
+# None for the default
+TELEMETRY_INTERFACE = None
+
+# How often, in seconds, a frame of changed sensor values
+# is sent
+TELEMETRY_FRAME_TIME = 0.05
+
+# How often, in seconds, a key frame of every sensor value
+# is sent, so that a receiver which has just started, or has
+# lost frames, catches up
+TELEMETRY_KEYFRAME_TIME = 2
+
+# Decimation; the minimum time, in seconds, between sending
+# changes of each sensor. Sensors not listed are sent every
+# frame they change in.
+TELEMETRY_INTERVALS = {
+	'ECT' : 1,
+	'IAT' : 1,
+	'BAT' : 1,
+	'CO' : 1,
+	'VIN' : 0.5,
+	'VBAT' : 1,
+	'VOUT' : 1,
+	'UPSTEMP' : 5,
+	'CHARGE' : 5,
+}
+
+# The most samples waiting to be sent; when there are more,
+# the oldest are thrown away
+TELEMETRY_QUEUE_SIZE = 256
+
+# How often, in seconds, the numbers of frames sent and
+# dropped are logged
+TELEMETRY_STATS_TIMER = 60
+
+########################################################
+#
+# HTTP server
+#
+########################################################
+
+# The address and port to serve on; 0.0.0.0 is every
+# network interface
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = 8080
+
+# How often, in seconds, new samples are taken up and sent
+# to any /stream clients
+HTTP_POLL_TIME = 0.1
+
+# How often, in seconds, the sensor details, peaks, worker
+# status and queue depths are read from the other processes
+HTTP_STATUS_TIME = 1
+
+# The most samples waiting to be served; when there are
+# more, the oldest are thrown away
+HTTP_QUEUE_SIZE = 256
+
+# The most /stream clients at once
+HTTP_MAX_CLIENTS = 8
+
+# The most events waiting to be sent to a /stream client;
+# a client which falls further behind misses the oldest
+HTTP_CLIENT_QUEUE = 32
+
+# How long, in seconds, to wait for a client to send its request
+HTTP_TIMEOUT = 5
+
+########################################################
+#
+# Console
+#
+########################################################
+
+# How often, in seconds, the console table is redrawn on a
+# terminal; only the lines which have changed are written
+CONSOLE_REFRESH_TIME = 0.1
+
+# How often, in seconds, sample rates are worked out and the
+# status lines updated
+CONSOLE_STATUS_TIME = 1
+
+# How often, in seconds, the whole screen is drawn again, in
+# case anything else has written over it
+CONSOLE_REPAINT_TIME = 5
+
+# How often, in seconds, the table is printed when the output
+# is not a terminal
+CONSOLE_PLAIN_TIME = 5
+
+# How many recent values of each sensor are in its sparkline
+CONSOLE_HISTORY = 24
+
+# The most samples waiting to be shown; when there are more,
+# the oldest are thrown away
+CONSOLE_QUEUE_SIZE = 256
+
+########################################################
+#
+# Latency tracing
+#
+########################################################
+
+# Aggregate the age of every displayed sample, from serial read
+# to the screen, into per-stage histograms (see libs/LatencyTrace.py)
+LATENCY_TRACE = True
+
+# How often, in seconds, to publish the histograms to the
+# ecu status data and write them to the dump file
+LATENCY_REPORT_TIMER = 10
+LATENCY_DUMP_FILE = LOGGING_DIR + "/latency.json"
+
+########################################################
+#
+# Profiling
+#
+########################################################
+
+# Run every worker process under cProfile. This can also be
+# enabled with: ./SensorDashboard --profile [seconds]
+PROFILE = False
+
+# How long, in seconds, to profile each worker for before
+# writing its profile to disk
+PROFILE_DURATION = 60
+
+# Where per-process profiles and the merged summary are written
+PROFILE_DIR = "profiles"
+
+# Number of functions listed for each profile in the summary
+PROFILE_SUMMARY_LINES = 30
+
+########################################################
+#
+# Benchmark config
+#
+########################################################
+
+# How long, in seconds, SensorBenchmark runs against the
+# emulated Cosworth and AEM serial devices, unless given
+# on the command line
+BENCHMARK_DURATION = 30
+
+########################################################
+#
+# Worker supervision
+#
+########################################################
+
+# The worker processes the main process watches over (see
+# libs/Supervisor.py). A worker which dies, or whose main
+# loop stops going round for 'hangTimeout' seconds, is
+# restarted. While any 'critical' worker is failing, the
+# Pi watchdog heartbeat is withheld.
+SUPERVISOR_WORKERS = {
+	'SensorIO' : { 'critical' : True, 'hangTimeout' : 10 },
+	'GraphicsIO' : { 'critical' : True, 'hangTimeout' : 15 },
+	'DataLoggerIO' : { 'critical' : True, 'hangTimeout' : 10 },
+	'GPIOButtonIO' : { 'critical' : False, 'hangTimeout' : 10 },
+	'ConsoleIO' : { 'critical' : False, 'hangTimeout' : 30 },
+	'LogCompressorIO' : { 'critical' : False, 'hangTimeout' : 600 },
+	'TelemetryIO' : { 'critical' : False, 'hangTimeout' : 10 },
+	'HttpIO' : { 'critical' : False, 'hangTimeout' : 10 },
+}
+
+# Hang timeout, in seconds, of a worker not listed above
+SUPERVISOR_HANG_TIMEOUT = 10
+
+# How often, in seconds, the workers are checked
+SUPERVISOR_CHECK_TIMER = 1
+
+# How long, in seconds, a newly started worker has to get
+# round its main loop for the first time
+SUPERVISOR_START_TIMEOUT = 30
+
+# Delay, in seconds, before restarting a failed worker; the
+# first value, doubled after each failure in a row up to the
+# second value
+SUPERVISOR_BACKOFF = (1, 60)
+
+# How long, in seconds, a restarted worker must keep running
+# before its earlier failures are forgotten
+SUPERVISOR_BACKOFF_RESET = 60
+
+########################################################
+#
+# Shutdown
+#
+########################################################
+
+# When the UPS shuts us down, the workers are stopped in
+# these stages, in order. Each stage waits up to 'timeout'
+# seconds for its workers to acknowledge and exit, then
+# terminates any which have not. 'workers' of None is every
+# worker not in an earlier stage.
+SHUTDOWN_STAGES = [
+	{ 'name' : 'flush', 'workers' : ['DataLoggerIO'], 'timeout' : 5 },
+	{ 'name' : 'compress', 'workers' : ['LogCompressorIO'], 'timeout' : 2 },
+	{ 'name' : 'workers', 'workers' : None, 'timeout' : 2 },
+]
+
+# How often, in seconds, to check for acknowledgements
+SHUTDOWN_POLL_TIME = 0.01
+
+# How long, in seconds, to wait for a worker which has to be
+# terminated before killing it
+SHUTDOWN_KILL_TIMEOUT = 1
+
+########################################################
+#
+# Start up
+#
+########################################################
+
+# The sensor which is read first when SensorIO starts. The
+# time from boot to its first sample (and to the first sample
+# of any sensor) is logged and published as the 'startup'
+# status data.
+STARTUP_SENSOR = 'RPM'
+
+# Modules used by more than one worker, which are imported by
+# the main process once SensorIO has been started, so that the
+# workers started after it inherit them. Every worker imports
+# its own modules as it starts.
+WORKER_PRELOAD = [
+	'libs.SegmentLog',
+	'libs.LogCatalog',
+	'libs.LogCompress',
+]
+
 ########################################################
 #
 # Watchdog timers and Power Monitoring